@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+"""Performance benchmarks for findx.
+
+Run via the Nox ``bench`` session; options follow ``--``, e.g.::
+
+    uv run nox -s bench -- --save-baseline
+    uv run nox -s bench -- --only ffg --repeat 3
+
+Synthetic trees are generated deterministically in a temporary directory.
+Results are written as JSON and compared against a saved baseline; the run
+fails if any benchmark is slower than the baseline by more than the
+tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing as T
+from pathlib import Path
+
+import findx
+
+BENCH_DIR = Path(__file__).resolve().parent
+DEFAULT_RESULTS = BENCH_DIR / "results.json"
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+
+TREE_SEED = 1234
+
+EXTENSIONS = [".c", ".h", ".py", ".txt", ".o", ".rst", ".json", ".bak", ""]
+
+# Directory names pruned by '-stdx'.
+EXCLUDED_DIRS = [".git", ".svn", "build", ".mypy_cache", ".tox", "venv"]
+
+PARSE_ARGV = (
+    "-stdx -L -type f *.{c,h,cpp}|Makefile -x -name tmp* "
+    "-i -name keep.o -mindepth 1 -maxdepth 12 -newer /dev/null"
+).split()
+
+GLOB = "*.{c,cpp,h{,pp}}|foo,bar[,]x|{a,b{c,d{e,f}}}*"
+
+GREP_PATTERN = "needle[0-9]+"
+
+
+class TreeBuilder:
+    """Generate a deterministic synthetic tree below root."""
+
+    def __init__(self, root: Path, scale: float) -> None:
+        self.root = root
+        self.scale = scale
+        self.rng = random.Random(TREE_SEED)
+
+    def count(self, n: int) -> int:
+        return max(1, int(n * self.scale))
+
+    def name(self) -> str:
+        length = self.rng.randint(3, 16)
+        letters = "abcdefghijklmnopqrstuvwxyz_0123456789"
+        stem = "".join(self.rng.choice(letters) for _ in range(length))
+        return stem + self.rng.choice(EXTENSIONS)
+
+    def text(self, lines: int) -> str:
+        out = []
+        for i in range(lines):
+            if self.rng.random() < 0.01:
+                out.append(f"needle{i} in a haystack\n")
+            else:
+                out.append("the quick brown fox jumps over the lazy dog\n")
+        return "".join(out)
+
+    def files(self, parent: Path, n: int, lines: int = 4) -> T.List[Path]:
+        parent.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for _ in range(n):
+            path = parent / self.name()
+            path.write_text(self.text(lines))
+            paths.append(path)
+        return paths
+
+    def deep(self) -> None:
+        parent = self.root
+        for level in range(self.count(60)):
+            parent = parent / f"level{level}"
+            self.files(parent, 3)
+            self.files(parent / "side", 5)
+
+    def wide(self) -> None:
+        for i in range(3):
+            self.files(self.root / f"wide{i}", self.count(3000), lines=1)
+
+    def symlinks(self) -> None:
+        targets = []
+        dir_targets = []
+        for i in range(self.count(50)):
+            d = self.root / "targets" / f"d{i}"
+            targets.extend(self.files(d, 20))
+            dir_targets.append(d)
+        links = self.root / "links"
+        links.mkdir()
+        for i in range(self.count(1000)):
+            target = self.rng.choice(targets)
+            (links / f"f{i}").symlink_to(target)
+        for i in range(self.count(50)):
+            target = self.rng.choice(dir_targets)
+            (links / f"d{i}").symlink_to(target, target_is_directory=True)
+
+    def excluded(self) -> None:
+        for i in range(self.count(200)):
+            project = self.root / f"project{i}"
+            self.files(project / "src", 5)
+            for name in EXCLUDED_DIRS:
+                self.files(project / name / "objects", 30, lines=1)
+
+    def huge(self) -> None:
+        chunk = self.text(1000)
+        size = int(16 * 1024 * 1024 * self.scale)
+        for i in range(4):
+            path = self.root / "huge" / f"big{i}.txt"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "w") as f:
+                written = 0
+                while written < size:
+                    f.write(chunk)
+                    written += len(chunk)
+        self.files(self.root / "huge" / "small", 50)
+
+
+TREE_KINDS = ["deep", "wide", "symlinks", "excluded", "huge"]
+
+
+def build_tree(kind: str, root: Path, scale: float) -> Path:
+    tree = root / kind
+    tree.mkdir()
+    builder = TreeBuilder(tree, scale)
+    getattr(builder, kind)()
+    return tree
+
+
+def best_time(func: T.Callable[[], None], repeat: int, number: int) -> float:
+    """Return the best per-call time of func over repeat trials."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def bench_parse_argv() -> None:
+    f = findx.Findx()
+    f.parse_findx_args(PARSE_ARGV)
+
+
+def bench_split_glob() -> None:
+    findx.Findx().split_glob(GLOB)
+
+
+def bench_config() -> None:
+    f = findx.Findx()
+    for var in findx.VALID_VARS:
+        f.get_var(var)
+
+
+def bench_probe() -> None:
+    f = findx.Findx()
+    for path_var in ["find_path", "xargs_path", "grep_path"]:
+        f.probe_gnu_style(f.resolve_path_var(path_var))
+
+
+def run_entry_point(entry_point: str, args: T.List[str], cwd: Path) -> None:
+    code = f"import sys, findx; sys.exit(findx.{entry_point}())"
+    # Run the same findx that was imported here.
+    env = dict(os.environ)
+    package_parent = str(Path(findx.__file__).resolve().parent.parent)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [package_parent] + env.get("PYTHONPATH", "").split(os.pathsep)
+    )
+    status = subprocess.run(
+        [sys.executable, "-c", code] + args,
+        cwd=str(cwd),
+        env=env,
+        stdout=subprocess.DEVNULL,
+    ).returncode
+    # Exit status 1 means nothing was found (e.g., no 'grep' match); for
+    # 'ffg', 'xargs' exits with 123 when any 'grep' batch matched nothing.
+    ok_statuses = [0, 1, 123] if entry_point == "ffg" else [0, 1]
+    if status not in ok_statuses:
+        raise RuntimeError(f"{entry_point} {args} failed (status {status})")
+
+
+def run_benchmarks(
+    trees: T.Dict[str, Path], repeat: int, only: T.Optional[str]
+) -> T.Dict[str, float]:
+    benchmarks: T.List[T.Tuple[str, T.Callable[[], None], int]] = [
+        ("parse_argv", bench_parse_argv, 200),
+        ("split_glob", bench_split_glob, 1000),
+        ("config", bench_config, 100),
+        ("probe", bench_probe, 1),
+    ]
+    for kind, tree in trees.items():
+
+        def ffx(tree: Path = tree) -> None:
+            run_entry_point("ffx", [], tree)
+
+        def ffg(tree: Path = tree) -> None:
+            run_entry_point("ffg", ["-E", GREP_PATTERN], tree)
+
+        benchmarks.append((f"ffx/{kind}", ffx, 1))
+        benchmarks.append((f"ffg/{kind}", ffg, 1))
+    results = {}
+    for name, func, number in benchmarks:
+        if only and only not in name:
+            continue
+        results[name] = best_time(func, repeat, number)
+        print(f"{name:20} {results[name] * 1e3:12.3f} ms")
+    return results
+
+
+def compare(
+    results: T.Dict[str, float],
+    baseline: T.Dict[str, float],
+    tolerance: float,
+) -> T.List[str]:
+    """Print a comparison table, returning names of regressed benchmarks."""
+    regressions = []
+    print(f"\n{'benchmark':20} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None or base <= 0:
+            print(f"{name:20} {'-':>12} {seconds * 1e3:10.3f}ms {'new':>7}")
+            continue
+        ratio = seconds / base
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:20} {base * 1e3:10.3f}ms {seconds * 1e3:10.3f}ms"
+            f" {ratio:7.2f}{flag}"
+        )
+    return regressions
+
+
+def write_json(path: Path, data: T.Dict[str, T.Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark findx.")
+    parser.add_argument("--output", type=Path, default=DEFAULT_RESULTS)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the new baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed slowdown relative to baseline (default: %(default)s)",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiply synthetic tree sizes by SCALE",
+    )
+    parser.add_argument("--only", help="run benchmarks whose name has ONLY")
+    parser.add_argument(
+        "--keep-trees",
+        action="store_true",
+        help="keep the generated trees (their location is printed)",
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    # Isolate from the user's configuration.
+    os.environ["FINDX_CONFIG_FILES"] = ""
+    tmp_root = Path(tempfile.mkdtemp(prefix="findx-bench-"))
+    try:
+        trees = {}
+        for kind in TREE_KINDS:
+            if args.only and not any(
+                args.only in f"{tool}/{kind}" for tool in ["ffx", "ffg"]
+            ):
+                continue
+            trees[kind] = build_tree(kind, tmp_root, args.scale)
+        results = run_benchmarks(trees, args.repeat, args.only)
+    finally:
+        if args.keep_trees:
+            print(f"Trees kept in {tmp_root}")
+        else:
+            shutil.rmtree(tmp_root)
+    record = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+    write_json(args.output, record)
+    print(f"\nResults written to {args.output}")
+    if args.save_baseline:
+        write_json(args.baseline, record)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; use --save-baseline")
+        return 0
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("meta", {}).get("scale") != args.scale:
+        print("Warning: baseline was recorded with a different --scale")
+    regressions = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -76,6 +76,12 @@ def test(s: Session) -> None:
     )
 
 
+@session
+def bench(s: Session) -> None:
+    s.install(".")
+    s.run("python", "benchmarks/bench_findx.py", *s.posargs)
+
+
 # For some sessions, set `venv_backend="none"` to simply execute scripts within
 # the existing `uv` environment.
 @session(venv_backend="none")
@@ -103,7 +109,7 @@ def lint_fix(s: Session) -> None:
 
 @session(venv_backend="none")
 def type_check(s: Session) -> None:
-    s.run("mypy", "src", "tests", "noxfile.py")
+    s.run("mypy", "src", "tests", "benchmarks", "noxfile.py")
 
 
 @session
@@ -1,13 +1,34 @@
 #!/usr/bin/env python
 
+import contextlib
+import cProfile
+import collections
+import concurrent.futures
+import ctypes
+import functools
+import hashlib
+import heapq
 import importlib.metadata
+import itertools
+import json
 import os
+import random
 import re
 import shutil
 import signal
+import stat
 import sys
+import tempfile
+import threading
+import time
 import traceback
 import typing as T
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None  # type: ignore[assignment]
 from subprocess import PIPE, Popen, STDOUT
 
 project_name = "findx"
@@ -90,6 +111,9 @@ OPTIONS
   -stdxd                use standard exclusions for directories (configured
                         by the 'stdxd' variable)
   -stdx                 use standard exclusions; short for '-stdxd -stdxf'
+  -stdxm                exclude mount points of pseudo, network, and FUSE
+                        filesystems (configured by the 'stdx_fstypes'
+                        variable); see STANDARD EXCLUSIONS
   -ff                   find files following symlinks; short for 'type -f -L'
   -ffx                  find files with standard exclusions, following
                         symlinks; short for '-stdx -ff'
@@ -102,6 +126,42 @@ OPTIONS
   -grep                 short for ': <grep> <grep_args> [ :' where
                         <grep> and <grep_args> come from the variables
                         'grep_path' and '<grep_style>_grep_args'
+  -git                  take candidates from 'git ls-files' for each ROOT
+                        (tracked plus untracked, non-ignored files) instead
+                        of walking the filesystem; see GIT MODE
+  -ignore-files         honor per-directory ignore files (configured by the
+                        'ignore_files' variable); see NATIVE MODE
+  -bfs                  walk breadth-first, yielding shallower entries first;
+                        see NATIVE MODE
+  -heatmap              walk natively, then report the costliest directories
+                        that yielded no paths; see HEATMAP
+  -estimate             estimate the size and cost of the query by sampling
+                        ROOTS instead of running it; see ESTIMATES
+  -dupes                report groups of matching files with identical
+                        contents as NDJSON; see DUPLICATE FILES
+  -prune-markers        prune directories containing a marker file
+                        (configured by the 'prune_markers' variable)
+  -stats                print statistics for each phase and pipeline stage
+                        to stderr; see STATISTICS
+  -limit N              stop after N paths; see EARLY TERMINATION
+  -top N BY             yield only the N entries largest in BY (size, mtime,
+                        or atime); see TOP ENTRIES
+  -du [DEPTH]           report the disk usage of the entries found, per
+                        directory down to DEPTH (default 1); see DISK USAGE
+  -first                stop after the first path or, with XARGS, after the
+                        first line of command output; see EARLY TERMINATION
+  -no-optimize          keep EXPRESSION's tests in the order given; see
+                        EXPRESSION OPTIMIZATION
+  -cache                reuse the results of an identical earlier query if
+                        the tree is unchanged; see RESULT CACHE
+  -since-last-run KEY   select only entries modified since the last
+                        successful run of this query under KEY; see
+                        INCREMENTAL RUNS
+  -collapse-roots       drop each ROOT that another ROOT already walks; see
+                        OVERLAPPING ROOTS
+  -background           run at idle I/O priority and lowest CPU priority,
+                        pacing paths to the 'background_file_rate' and
+                        'background_byte_rate' budgets; see BACKGROUND SCANS
 
 Note: FINDX MODE is active at start.  The '[' option does not necessitate ']'.
 A bare '[' may not be used as an XARG unless XARGS MODE has been made
@@ -133,6 +193,278 @@ EXCLUSIONS, INCLUSIONS
 STANDARD EXCLUSIONS
   When '-stdx' is specified, a built-in list of standard exclusions applies.
   (Use '-show' to see the list.)
+  When '-stdxm' is specified, findx reads the mount table once (from
+  /proc/self/mountinfo, on Linux) and excludes each mount point below a
+  ROOT whose filesystem type matches a glob in 'stdx_fstypes', as if by
+  '-x -path MOUNT_POINT'.  Host-wide scans (e.g., 'findx -stdxm /') then
+  skip /proc, /sys, and slow network or FUSE mounts.  A ROOT inside such a
+  mount is still walked.  Elsewhere, '-stdxm' excludes nothing.
+
+  Before running 'find', findx simplifies the combined exclusions: within
+  each group of OR'ed terms, duplicates (e.g., a glob added by both site
+  and user config) are dropped, as are '-name' and '-iname' tests implied
+  by another test of the group (e.g., '-iname x.bak' beside
+  '-iname *.bak'), and redundant parentheses are removed.  '-show' lists
+  each simplification.
+
+MARKER EXCLUSIONS
+  When '-prune-markers' is specified, any directory containing one of the
+  files named by 'prune_markers' (e.g., a 'CACHEDIR.TAG' written by build
+  tools) is excluded as if by:
+    -x -type d -exec test -e {}/MARKER \;
+  'find' would run one 'test' per directory and marker, so findx walks
+  natively instead (see NATIVE MODE) unless the query needs 'find' (e.g.,
+  for an action or a test such as '-size').  '-stats' reports how many
+  directories the markers pruned during a native walk.
+
+GIT MODE
+  With '-git', each ROOT must be inside a git work tree.  findx lists
+  candidates via 'git ls-files -z --cached --others --exclude-standard' and
+  evaluates exclusions, inclusions, and EXPRESSION itself, feeding matches
+  to XARGS (or printing them) as they stream in.  Directories containing
+  candidates are evaluated too, so excluding a directory drops everything
+  below it.  EXPRESSION is limited to '-name', '-iname', '-path', '-ipath',
+  '-wholename', '-iwholename', '-type', '-true', '-false', and operators;
+  of the options, '-L', '-H', '-P', '-maxdepth', and '-mindepth' are
+  honored.  Symlinked directories are not followed.
+
+NATIVE MODE
+  Some options (e.g., '-ignore-files') require findx to walk the filesystem
+  itself rather than running 'find'.  The same EXPRESSION limits apply as
+  for GIT MODE.  With '-ignore-files', each directory's ignore files are
+  read as the walk reaches it and layered over those of its parents
+  (deeper files take precedence), pruning ignored entries.  Parsed ignore
+  files are cached below 'cache_dir', keyed by file modification time.
+  With '-bfs', every entry at one depth is visited before any deeper one,
+  so matches near ROOTS appear before those inside deep subtrees.  Up to
+  'bfs_frontier' directories are queued; beyond that, findx walks the
+  remaining levels by iterative deepening, bounding memory at the cost of
+  rescanning upper levels.  '-bfs' does not reorder '-git' candidates.
+
+HEATMAP
+  With '-heatmap', findx walks natively, recording for each directory the
+  entries read, the time spent reading and evaluating them, and the paths
+  yielded.  After the run, it reports to stderr the 'heatmap_top'
+  directories without any yielded paths below them that cost the most
+  time (counting their whole subtrees, and omitting those inside another
+  reported directory).  These are candidates for '-x' exclusions or for
+  the 'stdxd' variable; set 'heatmap_format' to 'config' for a bare,
+  ready to paste 'stdxd = +NAME ...' line (still on stderr) instead of the
+  table.  Paths count as yielded when passed to XARGS, whatever the
+  command does with them.
+
+ESTIMATES
+  With '-estimate', findx prints estimates of the entries the query would
+  visit, the paths it would yield, the bytes in the yielded files (what
+  '-grep' would read), and the time the walk would take, without running
+  the query.  Each estimate comes with a 95% confidence interval.  findx
+  samples each ROOT with random probes: a probe descends from the ROOT
+  through one randomly chosen subdirectory per level, and the counts of
+  the directories along the way, each weighted by the product of the
+  numbers of subdirectories above it, estimate the whole tree.  Probing
+  goes on for up to 'estimate_seconds' seconds, stopping sooner once the
+  intervals are within 1% of the estimates.  EXPRESSION is limited as for
+  GIT MODE, and there may be no XARGS.  As for 'find', the exit status is
+  nonzero if a directory could not be read.
+
+DUPLICATE FILES
+  With '-dupes', findx walks natively (with the usual exclusions) and, in
+  place of the STANDARD ACTION, reports groups of matching regular files
+  having identical contents; there may be no XARGS.  Files are grouped by
+  size first; only files sharing a size are read.  These are hashed on
+  their first and last 64 KiB, and only files still sharing a hash are
+  then hashed in full.  Hashing runs on 'dupes_jobs' threads, reading 1 MiB
+  at a time, and each file is read at most once per stage.  Hard links to
+  one file count once, by the first of their paths in sorted order, as
+  removing one frees no space.  Empty files are not reported.  Each group
+  is written as a line of JSON with its 'size', BLAKE2b-256 'hash', and
+  sorted 'paths', largest files first, e.g.:
+
+    {"size": 1048576, "hash": "9c4f...", "paths": ["./a.iso", "./b.iso"]}
+
+BACKENDS
+  The 'find_backend' and 'grep_backend' variables select faster tools for
+  the pipeline.  With 'find_backend = fd', the 'find' stage is run by 'fd'
+  when the expression uses only the following subset (exclusions and
+  inclusions may use '-name', '-iname', and '-type d' in the same forms):
+    -L -P -maxdepth -mindepth -xdev -mount -name -iname -type [fdlps]
+  With 'grep_backend = rg', '-grep' runs a single 'rg' process instead of
+  'find | xargs grep' when the expression is '-type f' plus the subset
+  above and the grep arguments have exact 'rg' equivalents.  In all other
+  cases, findx silently falls back to 'find'; use '-show' to see the
+  command that will run.
+
+STATISTICS
+  With '-stats', findx passes the output of 'find' (or the native walk)
+  through to XARGS (or to stdout), counting paths and bytes; 'find' and
+  'xargs' still run concurrently and 'xargs' batches paths as usual.  When
+  the run finishes, findx reports to stderr the time spent parsing,
+  probing tools, and running; the wall and CPU time of each stage (for
+  'xargs', including the commands it ran); and the number of entries
+  visited (native walks only), paths emitted, bytes piped, and XARGS
+  batches (only when findx itself feeds XARGS in batches, e.g., for
+  '-first'), plus any directories pruned by '-prune-markers' (native walks
+  only).  While running, a progress line is shown when stderr is a
+  terminal and stdout is not.
+  Setting the 'metrics_file' variable gathers the same timings (without
+  printing them) on the unaltered pipeline; paths and bytes are counted
+  only with '-stats'.  After each run of a query, findx atomically
+  replaces that file with a record of them along with the shape of the
+  command line, the resolved tools, rusage, the pipeline statuses, and the
+  exit status.
+
+EARLY TERMINATION
+  With '-limit N', findx relays the paths itself and stops after the Nth
+  path, terminating 'find'; with XARGS, only the first N paths reach the
+  command.  With '-first' and no XARGS, findx prints the first path and
+  stops.  With XARGS, findx stops at the first complete line the command
+  outputs (e.g., the first match of '-grep', which is then run with
+  '--line-buffered' where supported), killing 'xargs' and the command.
+  Stopping early in either way is a success.
+
+TOP ENTRIES
+  With '-top N BY', findx yields only the N entries with the largest
+  'size', or latest 'mtime' or 'atime', in descending order.  'find'
+  reports each entry's key via '-printf' (walking natively instead if
+  'find' is not GNU find), and findx keeps only the N best entries seen so
+  far, so memory stays bounded however large the tree.  Without XARGS,
+  each entry is printed after its key (a size in bytes, or a local time);
+  with XARGS, the entries' paths are passed to the command.  EXPRESSION
+  may not contain an action, and '-limit', '-first', and '-stats' may not
+  be given.  For example, the 50 largest files outside standard
+  exclusions:
+
+    ffx -top 50 size
+
+DISK USAGE
+  With '-du [DEPTH]', findx reports the disk space taken by the entries
+  found (subject to exclusions and EXPRESSION, unlike 'du'), summed for
+  each ROOT and each directory down to DEPTH levels below it (default 1).
+  Each line holds the allocated bytes, the apparent bytes (file sizes),
+  and the directory, sorted by allocated bytes, largest first.  'find'
+  reports each entry's type, size, blocks, and inode via '-printf'
+  (walking natively instead if 'find' is not GNU find).  The sums are
+  kept as entries stream by, so memory depends on the number of
+  directories down to DEPTH rather than on the tree; a file with several
+  hard links is counted once.  A numeric argument after '-du' is taken as
+  DEPTH (write a ROOT named '3' as './3').  As for '-top', EXPRESSION may
+  not contain an action, and '-limit', '-first', and '-stats' may not be
+  given; there may also be no XARGS.  For example:
+
+    ffx -du 2 -type f -name '*.log'
+
+INTERACTIVE MODE
+  Normally, 'xargs' collects paths until a command line is full before
+  running the command, so nothing appears until 'find' has produced a
+  full batch.  If the 'interactive' variable is 'yes' (or 'auto' and
+  stdout is a terminal), findx instead feeds XARGS itself in batches of 1,
+  2, 4, ... paths, doubling up to the usual command-line size, so the
+  first results appear almost at once while long runs still use full-size
+  batches.  This runs one 'xargs' per batch, so it is off by default.
+
+BACKGROUND SCANS
+  With '-background', findx lowers its CPU priority to the lowest (as by
+  'nice -n 19') and, on Linux, its I/O priority to the idle class (as by
+  'ionice -c 3'), both inherited by 'find', 'xargs', and the command, so a
+  scan (e.g., from cron) yields the disks and CPUs to other work.  If
+  'background_file_rate' or 'background_byte_rate' is set, findx also
+  relays the paths and paces them to at most that many files, or bytes of
+  file data, per second, holding back the walk as well as the command.
+  The scan still runs to completion, only more slowly.
+
+RESULT CACHE
+  With '-cache', findx walks the tree itself and saves the resulting paths
+  below 'cache_dir' along with the mtimes of ROOTS and of every directory
+  it read.  Rerunning the same query (same working directory, ROOTS,
+  options, exclusions, inclusions, and EXPRESSION; XARGS may differ) then
+  only checks those mtimes and, if none changed, feeds the saved paths to
+  XARGS without walking again.  Only queries whose results depend on
+  nothing but entry names and types are cached: EXPRESSION is limited as
+  for GIT MODE (without '-newer'); '-git', '-ignore-files',
+  '-prune-markers' (removing a marker changes no recorded mtime), and walks
+  that follow symlinks ('-H' or '-L', as changes behind a symlink do not
+  show in the recorded mtimes) are not cached; other queries run normally.
+  Results are not saved while any of the directories was modified in the
+  last two seconds, as a further change in the same clock tick could go
+  unnoticed.  Saved results are evicted least recently used first to keep
+  them within 'result_cache_bytes'.
+
+INCREMENTAL RUNS
+  With '-since-last-run KEY', findx keeps a stamp file below 'cache_dir'
+  for KEY and the query (ROOTS as absolute paths, options, exclusions,
+  inclusions, EXPRESSION, and XARGS).  After the first run, EXPRESSION is
+  extended with '-newer STAMP' so only entries modified since the previous
+  run are selected.  The stamp is set to the time the run started, and
+  only when the run succeeds completely (not after an error, or when
+  '-limit' or '-first' stopped it early), so failed runs are retried.
+  Delete the files below 'cache_dir'/since-last-run to start over.
+
+BATCH MODE
+  'findx --batch FILE' runs each query in FILE, one findx argument list
+  per line (quoted as for config files; blank lines and '#' comments are
+  skipped).  A line starting with '> OUTFILE' writes that query's output
+  (paths, or the output of its XARGS) to OUTFILE instead of stdout.
+  Probes and config files are shared by all queries, and queries with the
+  same ROOTS and symlink options share a single native walk: each
+  directory is read once and every query's exclusions and EXPRESSION are
+  evaluated against each entry, with matches streamed to that query's
+  output or XARGS.  Queries that findx cannot evaluate itself (see GIT
+  MODE for the supported subset) or that use '-git', '-bfs', '-limit',
+  '-first', '-stats', '-top', '-du', '-dupes', '-estimate', '-heatmap',
+  '-cache', '-background', or an explicit action run on their own, just
+  as they would outside the batch.
+  Each failing query is reported, and the first failure's exit status is
+  returned.  With '-show', the grouping and commands are shown.
+
+RECORD AND REPLAY
+  To reproduce a slow run elsewhere, rerun it with '--record FILE'.  After
+  the run, findx walks ROOTS again (honoring exclusions where it can) and
+  writes FILE with:
+    - the findx arguments, verbatim: ROOTS, globs, grep patterns, XARGS,
+      and variables set on the command line (but not settings from config
+      files or the environment);
+    - statistics (as for '-stats'), the pipeline statuses, and the exit
+      status;
+    - the shape of the tree: histograms of entry depth, directory fanout,
+      name length, and file size; file counts per extension (long or
+      unusual extensions are lumped together); and the names of pruned
+      directories.
+  No other file or directory names are stored.
+  'findx --replay FILE' parses the recorded arguments afresh with the local
+  tools and configuration, builds a synthetic tree with the recorded shape
+  in a temporary directory (which also serves as 'cache_dir'), runs the
+  query on it (discarding its output), and reports the recorded and
+  replayed statistics.  Records are rejected if they do not validate, if
+  their arguments set variables other than those shaping the query (e.g.,
+  'find_path' or 'cache_dir'), if their EXPRESSION has actions that run
+  commands or write files (e.g., '-exec', '-delete', or '-fprint'), or if
+  they use a native mode (e.g., '-git').  XARGS is rerun only if it comes
+  from '-grep'; any other command is dropped with a warning.
+
+EXPRESSION OPTIMIZATION
+  'find' evaluates the terms of an AND chain from left to right, so a test
+  needing file status (e.g., '-size', '-mtime', '-perm', '-newer', '-user')
+  written before a name test costs a 'stat()' for entries the name test
+  would have rejected outright.  findx therefore moves name tests (e.g.,
+  '-name', '-path', '-regex') first and '-type' next within each AND chain,
+  at any depth of parentheses.  A term containing an action (e.g., '-exec',
+  '-print', '-prune', '-delete') or an option affecting later terms (e.g.,
+  '-daystart') stays in place, and no test moves across it; ',' and '-o'
+  operands are never reordered.  Use '-show' to see the resulting
+  EXPRESSION, or '-no-optimize' to keep the order given.
+
+OVERLAPPING ROOTS
+  Given overlapping ROOTS such as '. src src/lib', 'find' walks 'src/lib'
+  three times, and XARGS run three times on each file found there.  With
+  '-collapse-roots', findx resolves each ROOT to its real path (following
+  a symlinked ROOT only under '-H' or '-L') and drops a ROOT lying inside
+  another ROOT, warning about each ROOT dropped.  The remaining ROOTS keep
+  their original order.  A ROOT is kept if the walk from the other ROOT
+  would not reach it, e.g., because an exclusion prunes a directory on the
+  way, '-xdev' stops at a mount point on the way, or '-maxdepth',
+  '-mindepth', '-git', or '-ignore-files' make the results depend on the
+  ROOT; only duplicates of the same directory are then dropped.  Paths
+  below a dropped ROOT are reported as found from the other ROOT.
 
 STANDARD ACTION
   If EXPRESSION contains no 'find' action (e.g., '-print', '-print0',
@@ -347,6 +679,98 @@ bsd_grep_args = '-H' '--color=auto'
 # Extra grep arguments for use when grep_style = posix.
 posix_grep_args =
 
+# Backend for the 'find' stage: find, fd.  The 'fd' backend is used only when
+# 'fd' is found and the findx expression translates exactly into 'fd' flags;
+# otherwise, findx falls back to 'find'.
+find_backend = find
+
+# Names and/or absolute paths for the 'fd' utility.  The first-found choice
+# will be used (must not be empty).
+fd_path = fd fdfind
+
+# Backend for '-grep': grep, rg.  The 'rg' backend replaces the entire
+# pipeline with one 'rg' invocation when 'rg' is found and both the findx
+# expression and the grep arguments translate exactly into 'rg' flags;
+# otherwise, findx falls back to 'find' and 'xargs grep'.
+grep_backend = grep
+
+# Names and/or absolute paths for the 'rg' utility.  The first-found choice
+# will be used (must not be empty).
+rg_path = rg
+
+# Names and/or absolute paths for the 'git' utility (used by '-git').
+# The first-found choice will be used (must not be empty).
+git_path = git
+
+# Per-directory ignore files ('.gitignore' format) honored by
+# '-ignore-files'; in a directory, later files override earlier ones.
+ignore_files = .gitignore .ignore
+
+# Most directories queued by '-bfs' before it switches to iterative
+# deepening, which uses less memory but rescans upper levels.
+bfs_frontier = 100000
+
+# Filesystem types (globs) whose mount points are excluded by '-stdxm':
+# pseudo filesystems, and network and FUSE mounts.
+stdx_fstypes =
+    proc sysfs devtmpfs devpts securityfs debugfs tracefs configfs pstore
+    bpf cgroup cgroup2 mqueue hugetlbfs binfmt_misc autofs fusectl
+    efivarfs rpc_pipefs nfsd
+    nfs nfs4 cifs smb3 smbfs ncpfs afs 9p ceph glusterfs
+    fuse fuse.*
+
+# Marker files whose presence prunes a directory under '-prune-markers'.
+prune_markers = CACHEDIR.TAG .findxignore
+
+# File to which a metrics record is written after each run (none if empty).
+# A name ending in '.prom' selects the Prometheus text format (suitable for
+# the node exporter's textfile collector); otherwise, JSON is written.
+metrics_file =
+
+# File receiving a profile of findx's own Python code (none if empty).
+# A name ending in '.json' selects a Chrome trace of findx's phases
+# (parsing, config, probing, expression building, and pipeline); otherwise,
+# 'cProfile' statistics are written (view with 'python -m pstats FILE').
+profile =
+
+# File of queries to run over shared walks (see BATCH MODE); none if empty.
+batch =
+
+# Workload recording (see RECORD AND REPLAY).  After the run, 'record'
+# names a file that receives the findx arguments, statistics, and the shape
+# of the traversed tree; 'replay' names such a file to be rerun on a
+# structurally equivalent synthetic tree.
+record =
+replay =
+
+# Feed XARGS from findx in geometrically growing batches (1, 2, 4, ...
+# paths) so that the first results appear promptly: auto, yes, no.  With
+# 'auto', this is done when stdout is a terminal.
+interactive = no
+
+# Number of threads hashing files for '-dupes' (0 means one per CPU).
+dupes_jobs = 0
+
+# Most seconds spent probing ROOTS for '-estimate'.
+estimate_seconds = 5
+
+# Number of directories reported by '-heatmap', and the report's format:
+# table, or config (a line to paste into a config file).
+heatmap_top = 10
+heatmap_format = table
+
+# Budgets for '-background' scans: the most files, and bytes of file data,
+# per second to pass on from the walk (0 means no limit).
+background_file_rate = 0
+background_byte_rate = 0
+
+# Most bytes of query results kept by '-cache' below 'cache_dir'; the least
+# recently used results are evicted first.
+result_cache_bytes = 67108864
+
+# Directory for files generated and cached by findx.
+cache_dir = ~/.cache/findx
+
 # Directory globs excluded by '-stdxd'.
 stdxd =
     .svn .git .bzr .hg .undo build *export pkgexp
@@ -375,6 +799,34 @@ def warn(message: str) -> None:
     print(f"{project_name}: {message}", file=sys.stderr)
 
 
+# Linux 'ioprio_set()' system call numbers by machine.
+IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "riscv64": 30,
+    "armv7l": 314,
+    "ppc64": 273,
+    "ppc64le": 273,
+    "s390x": 282,
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_IDLE = 3 << 13
+
+
+def set_background_priority() -> None:
+    """Lower the CPU and I/O priority of this process and its children."""
+    os.setpriority(os.PRIO_PROCESS, 0, 19)
+    syscall_number = IOPRIO_SET_SYSCALLS.get(os.uname().machine)
+    if not sys.platform.startswith("linux") or syscall_number is None:
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, IOPRIO_IDLE):
+        strerror = os.strerror(ctypes.get_errno())
+        warn(f"Cannot set idle I/O priority: {strerror}")
+
+
 def single_quoted(s: str) -> str:
     if s == "":
         return "''"
@@ -432,6 +884,57 @@ def optionally_quoted_join(args: T.List[str]) -> str:
     return " ".join(optionally_quoted(arg) for arg in args)
 
 
+def case_insensitive_glob(glob: str) -> T.Optional[str]:
+    """Return glob rewritten to match case-insensitively via '[xX]' classes.
+
+    Returns None for globs containing character classes.
+    """
+    if "[" in glob:
+        return None
+    parts = []
+    escaped = False
+    for c in glob:
+        if escaped or c != "\\":
+            if c.lower() != c.upper():
+                parts.append(f"[{c.lower()}{c.upper()}]")
+            elif escaped:
+                parts.append("\\" + c)
+            else:
+                parts.append(c)
+            escaped = False
+        else:
+            escaped = True
+    if escaped:
+        parts.append("\\\\")
+    return "".join(parts)
+
+
+def ignore_file_glob(glob: str) -> str:
+    """Return glob escaped for use in a '.gitignore'-format file."""
+    parts = []
+    in_class = False
+    escaped = False
+    for c in glob:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif in_class:
+            in_class = c != "]"
+        elif c == "[":
+            in_class = True
+        elif c in "{}":
+            # Braces are literal for 'find' but alternations for 'fd'/'rg'.
+            c = f"[{c}]"
+        parts.append(c)
+    glob = "".join(parts)
+    if glob.startswith(("#", "!")):
+        glob = "\\" + glob
+    if glob.endswith(" "):
+        glob = glob[:-1] + "\\ "
+    return glob
+
+
 def count_run(s: str, pred: T.Callable[[str], bool]) -> int:
     run_length = 0
     for c in s:
@@ -582,6 +1085,11 @@ class PrintWithXargsError(FindxSyntaxError):
         super().__init__("Cannot mix '-print' with XARGS")
 
 
+class ReportConflictError(FindxSyntaxError):
+    def __init__(self, option: str, conflict: str) -> None:
+        super().__init__(f"Cannot mix {repr(option)} with {conflict}")
+
+
 class InvalidConfigLineError(FindxSyntaxError):
     def __init__(self, source: str, line: str, reason: str) -> None:
         super().__init__(f"In {source} for line {repr(line)}: {reason}")
@@ -607,6 +1115,13 @@ class InvalidScalarConfigVarError(FindxSyntaxError):
         super().__init__("Variable %s must be a single value" % (repr(var)))
 
 
+class InvalidIntConfigVarError(FindxSyntaxError):
+    def __init__(self, var: str, minimum: int) -> None:
+        super().__init__(
+            f"Variable {repr(var)} must be an integer of at least {minimum}"
+        )
+
+
 class InvalidChoiceConfigVarError(FindxSyntaxError):
     def __init__(self, var: str, choices: T.List[str]) -> None:
         super().__init__(
@@ -621,6 +1136,11 @@ class ConfigFilesUnstableError(FindxSyntaxError):
         super().__init__("'config_files' setting does not stabilize")
 
 
+class NativeUnsupportedError(FindxSyntaxError):
+    def __init__(self, option: str, mode: str) -> None:
+        super().__init__(f"{repr(option)} is not supported with {mode}")
+
+
 class InvalidRootError(FindxRuntimeError):
     def __init__(self, root: str) -> None:
         super().__init__("Invalid root path %s" % repr(root))
@@ -631,6 +1151,28 @@ class ExecutableNotFoundError(FindxRuntimeError):
         super().__init__("Executable %s not found" % repr(executable))
 
 
+class InvalidRecordError(FindxRuntimeError):
+    def __init__(self, path: str, reason: str) -> None:
+        super().__init__(f"Cannot replay {repr(path)}: {reason}")
+
+
+class InvalidBatchLineError(FindxSyntaxError):
+    def __init__(self, path: str, line_num: int, reason: str) -> None:
+        super().__init__(f"In {repr(path)} line {line_num}: {reason}")
+
+
+class ReferenceFileError(FindxRuntimeError):
+    def __init__(self, path: str, reason: str) -> None:
+        super().__init__(f"Cannot read reference file {repr(path)}: {reason}")
+
+
+class GitListingError(FindxRuntimeError):
+    def __init__(self, root: str, status: int) -> None:
+        super().__init__(
+            f"'git ls-files' failed for root {repr(root)} (status {status})"
+        )
+
+
 def must_find_executable(name: str) -> str:
     executable_abs_path = shutil.which(name)
     if executable_abs_path is None:
@@ -656,6 +1198,15 @@ def map_xargs_status(xargs_status: int) -> int:
         return xargs_status
 
 
+def rg_status_as_xargs_status(rg_status: int) -> int:
+    # 'rg' stands in for 'xargs grep'; 'xargs' returns 123 when any
+    # invocation of its command returns 1..125.
+    if 1 <= rg_status <= 125:
+        return 123
+    else:
+        return rg_status
+
+
 def merge_find_xargs_status(find_status: int, xargs_status: int) -> int:
     if find_status >= 128:
         exit_status = find_status
@@ -865,7 +1416,8 @@ class Config:
 
     def _settings_file(self, path: str) -> FileSettings:
         if path not in self._all_settings_files:
-            settings = FileSettings(path)
+            with span("config " + path):
+                settings = FileSettings(path)
             for var, raw_value in settings.items():
                 if var not in self._valid_vars:
                     raise InvalidConfigVarError(settings.name, var)
@@ -918,6 +1470,17 @@ class Config:
     ) -> T.List[str]:
         return self._get(var, self._sources(), op, value)
 
+    def copy(self) -> "Config":
+        """Return a Config whose later settings do not affect this one.
+
+        Parsed config files are shared rather than read again.
+        """
+        config = Config(self._valid_vars)
+        for var, setting in self._command_line_settings.items():
+            config._command_line_settings[var] = setting
+        config._all_settings_files = self._all_settings_files
+        return config
+
     def set(self, var: str, op: str, value: T.List[str]) -> None:
         list_value = self.get(var, op, value)
         self._command_line_settings[var] = quoted_join(list_value)
@@ -925,246 +1488,1904 @@ class Config:
             self._config_files_stable = False
 
 
-class Findx:
-    OPTIONS_0 = []
-    OPTIONS_1 = []
-    OPTIONS_2 = []
-    OPTIONS_VAR = []
+class Profiler:
+    """Profile findx's own phases for the 'profile' variable."""
 
-    # PRE_PATH_OPTIONS must come before any paths.
-    PRE_PATH_OPTIONS_0 = """
-        -H -L -P -O0 -O1 -O2 -O3
-        """.split()
-    OPTIONS_0.extend(PRE_PATH_OPTIONS_0)
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.origin = time.perf_counter()
+        self.events: T.List[T.Dict[str, T.Any]] = []
+        self.cprofile: T.Optional[cProfile.Profile] = None
+        if not path.endswith(".json"):
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> T.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": round((start - self.origin) * 1e6, 1),
+                    "dur": round((end - start) * 1e6, 1),
+                    "pid": os.getpid(),
+                    "tid": 0,
+                }
+            )
 
-    PRE_PATH_OPTIONS_1 = """
-        -D --files0-from
-        """.split()
-    OPTIONS_1.extend(PRE_PATH_OPTIONS_1)
+    def save(self) -> None:
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.path)
+        else:
+            trace = {"traceEvents": self.events, "displayTimeUnit": "ms"}
+            atomic_write(self.path, json.dumps(trace).encode("utf-8"))
 
-    PRE_PATH_OPTIONS = PRE_PATH_OPTIONS_0 + PRE_PATH_OPTIONS_1
 
-    # POST_PATH_OPTIONS must come immediately after any paths.
-    POST_PATH_OPTIONS_0 = """
-        -d -depth --help -help -ignore_readdir_race -mount
-        -noignore_readdir_race -noleaf -nowarn -version --version -warn
-        -xautofs -xdev
-        """.split()
-    OPTIONS_0.extend(POST_PATH_OPTIONS_0)
+_profiler: T.Optional[Profiler] = None
 
-    POST_PATH_OPTIONS_1 = """
-        -maxdepth -mindepth
-        """.split()
-    OPTIONS_1.extend(POST_PATH_OPTIONS_1)
+_null_span: T.ContextManager[None] = contextlib.nullcontext()
 
-    POST_PATH_OPTIONS = POST_PATH_OPTIONS_0 + POST_PATH_OPTIONS_1
 
-    # Options that go before the expression.
-    PRE_EXPR_OPTIONS = PRE_PATH_OPTIONS + POST_PATH_OPTIONS
+def span(name: str) -> T.ContextManager[None]:
+    """Return a context marking a named phase (a no-op unless profiling)."""
+    if _profiler is None:
+        return _null_span
+    return _profiler.span(name)
 
-    # Action options.
-    ACTIONS_VAR = """
-        -exec -execdir -ok -okdir
-        """.split()
-    OPTIONS_VAR.extend(ACTIONS_VAR)
 
-    ACTIONS_0 = """
-        -delete -ls -print -print0 -quit
-        """.split()
-    OPTIONS_0.extend(ACTIONS_0)
+def start_profiler(path: str) -> None:
+    global _profiler
+    if path and _profiler is None:
+        _profiler = Profiler(os.path.expanduser(path))
 
-    ACTIONS_1 = """
-        -fls -fprint -fprint0 -printf
-        """.split()
-    OPTIONS_1.extend(ACTIONS_1)
 
-    ACTIONS_2 = """
-        -fprintf
-        """.split()
-    OPTIONS_2.extend(ACTIONS_2)
+def stop_profiler() -> None:
+    global _profiler
+    if _profiler is not None:
+        profiler, _profiler = _profiler, None
+        try:
+            profiler.save()
+        except OSError as e:
+            warn(f"Cannot write {repr(profiler.path)}: {e.strerror}")
 
-    ACTIONS = ACTIONS_VAR + ACTIONS_0 + ACTIONS_1 + ACTIONS_2
 
-    # Test options.
-    TESTS_0 = """
-        -daystart -empty -executable -false -follow -nogroup -nouser -prune
-        -readable -true -writable
-        """.split()
-    OPTIONS_0.extend(TESTS_0)
+def early_profile_path(args: T.List[str]) -> str:
+    """Find the 'profile' variable in args or the environment.
 
-    TESTS_1 = """
-        -amin -anewer -atime -cmin -cnewer -context -ctime -fstype -gid -group
-        -inum -iregex -links -mmin -mtime -newer -perm -regex -regextype
-        -samefile -size -type -uid -used -user -xtype
-        """.split()
-    ref_types = "aBcmt"
-    for x in ref_types:
-        for y in ref_types:
-            TESTS_1.append(f"-newer{x}{y}")
-    OPTIONS_1.extend(TESTS_1)
+    This runs before the command line is parsed so that parsing itself can
+    be profiled.  A 'profile' setting from a config file is honored only
+    once parsing is complete.
+    """
+    raw_value = os.environ.get("FINDX_PROFILE", "")
+    for i, arg in enumerate(args[:-1]):
+        if arg in [":", "::", "]", "]]"]:
+            break
+        if arg == "--profile":
+            raw_value = args[i + 1]
+    value = parse_raw_value(raw_value)[1]
+    return value[-1] if value else ""
 
-    TESTS_WITH_GLOB = """
-        -ilname -iname -ipath -iwholename -lname -name -path -wholename
-        """.split()
-    OPTIONS_1.extend(TESTS_WITH_GLOB)
 
-    TESTS = TESTS_0 + TESTS_1 + TESTS_WITH_GLOB
+# A test name and its globs, e.g., ("-iname", ["*.c", "*.h"]).
+NameFilter = T.Tuple[str, T.List[str]]
 
-    # All possible options.
-    OPTIONS = OPTIONS_0 + OPTIONS_1 + OPTIONS_2 + OPTIONS_VAR
 
-    UNARY_OPERATORS = """
-        ! -not
-        """.split()
+class ExprNode:
+    """A node of a parsed 'find' expression.
 
-    BINARY_OPERATORS = """
-        , -a -and -o -or
-        """.split()
+    For op == "test", args holds a single option list (a test or an action,
+    e.g., ["-name", "*.c"]).  Otherwise, op is one of "and", "or", ",", or
+    "not", and children holds the operands; for "not", args may hold the
+    operator's spelling (e.g., ["-not"]).
+    """
 
-    OPERATORS = UNARY_OPERATORS + BINARY_OPERATORS
+    PRECEDENCE = {",": 0, "or": 1, "and": 2, "not": 3, "test": 3}
 
-    RESERVED_WORDS = OPTIONS + OPERATORS + ["(", ")"]
+    def __init__(
+        self,
+        op: str,
+        args: T.Optional[T.List[str]] = None,
+        children: T.Optional[T.List["ExprNode"]] = None,
+    ) -> None:
+        self.op = op
+        self.args = args or []
+        self.children = children or []
+
+    def __repr__(self) -> str:
+        return f"ExprNode({self.op!r}, {self.args!r}, {self.children!r})"
+
+    def operand_tokens(self, child: "ExprNode") -> T.List[str]:
+        tokens = child.tokens()
+        if self.PRECEDENCE[child.op] < self.PRECEDENCE[self.op]:
+            tokens = ["("] + tokens + [")"]
+        return tokens
+
+    def tokens(self) -> T.List[str]:
+        if self.op == "test":
+            return list(self.args)
+        elif self.op == "not":
+            operator = self.args[0] if self.args else "!"
+            return [operator] + self.operand_tokens(self.children[0])
+        tokens: T.List[str] = []
+        for child in self.children:
+            if tokens and self.op == "or":
+                tokens.append("-o")
+            elif tokens and self.op == ",":
+                tokens.append(",")
+            tokens.extend(self.operand_tokens(child))
+        return tokens
+
+    def and_terms(self) -> T.List["ExprNode"]:
+        if self.op == "and":
+            return list(self.children)
+        return [self]
+
+    def or_terms(self) -> T.List["ExprNode"]:
+        if self.op == "or":
+            return list(self.children)
+        return [self]
+
+
+def glob_class_regex(
+    glob: str, start: int, exclude: str = ""
+) -> T.Tuple[str, int]:
+    """Translate the bracketed class beginning at glob[start] into a regex.
+
+    Returns (regex, end), where end indexes just past the class.  An
+    unterminated '[' is literal.  Characters in exclude never match.
+    """
+    end = start + 1
+    if end < len(glob) and glob[end] in "!^":
+        end += 1
+    if end < len(glob) and glob[end] == "]":
+        end += 1
+    end = glob.find("]", end)
+    if end < 0:
+        return re.escape(glob[start]), start + 1
+    chars = glob[start + 1 : end]
+    negate = chars[:1] in ["!", "^"]
+    if negate:
+        chars = chars[1:]
+    chars = re.sub(r"([\\\[\]^&~|])", r"\\\1", chars)
+    if negate:
+        regex = "[^%s%s]" % (chars, re.escape(exclude))
+    elif exclude:
+        regex = "(?!%s)[%s]" % ("|".join(map(re.escape, exclude)), chars)
+    else:
+        regex = "[%s]" % chars
+    return regex, end + 1
 
-    META_CHARS = "*?|,"
 
-    META_PAIRS = "[]{}"
+@functools.lru_cache(maxsize=None)
+def glob_regex(glob: str, ignore_case: bool) -> T.Pattern[str]:
+    """Compile a 'find'-style glob into a regex for use with fullmatch().
 
-    def __init__(self) -> None:
-        self.pre_path_options: T.List[str] = []
-        self.post_path_options: T.List[str] = []
-        self.roots: T.List[str] = []
-        self.excludes: T.List[str] = []
-        self.includes: T.List[str] = []
-        self.saw_action = False
-        self.saw_print = False
+    As with 'find', '*' and '?' match any character (including '/' and a
+    leading '.'), '[!...]' and '[^...]' are negated classes, and a
+    backslash quotes the following character.
+    """
+    parts = []
+    i = 0
+    while i < len(glob):
+        c = glob[i]
+        if c == "[":
+            regex, i = glob_class_regex(glob, i)
+            parts.append(regex)
+            continue
+        i += 1
+        if c == "*":
+            parts.append(".*")
+        elif c == "?":
+            parts.append(".")
+        elif c == "\\" and i < len(glob):
+            parts.append(re.escape(glob[i]))
+            i += 1
+        else:
+            parts.append(re.escape(c))
+    flags = re.DOTALL | (re.IGNORECASE if ignore_case else 0)
+    return re.compile("".join(parts), flags)
 
-        self.expression: T.List[str] = []
-        self.in_xargs = False
-        self.locked_in_xargs = False
-        self.need_xarg = False
-        self.xargs: T.List[str] = []
-        self.find_pipe_args: T.List[str] = []
-        self.xargs_pipe_args: T.List[str] = []
-        self.show = False
-        self.show_help = False
-        self.show_version = False
-        self.show_readme = False
-        self.shown = False
-        self.pipe_status: T.Optional[T.Tuple[int, ...]] = None
-        self.config = Config(VALID_VARS)
-        self.stdxd = False
-        self.stdxf = False
 
-    def get_var(self, var: str) -> T.List[str]:
-        return self.config.get(var)
+def literal_glob(glob: str) -> bool:
+    return not any(c in "*?[]\\" for c in glob)
 
-    def get_non_empty_var(self, var: str) -> T.List[str]:
-        value = self.get_var(var)
-        if not value:
-            raise InvalidEmptyConfigVarError(var)
-        return value
 
-    def get_scalar_var(self, var: str) -> str:
-        value = self.get_var(var)
-        if len(value) != 1:
-            raise InvalidScalarConfigVarError(var)
-        return value[0]
+def glob_subsumes(glob: str, other_glob: str, ignore_case: bool) -> bool:
+    """Return True if every name matching other_glob matches glob.
 
-    def get_choice_var(self, var: str, choices: T.List[str]) -> str:
-        value = self.get_scalar_var(var)
-        if value not in choices:
-            raise InvalidChoiceConfigVarError(var, choices)
-        return value
+    Only cases that are easy to prove are detected: a literal other_glob,
+    and a glob of '*', '*SUFFIX', or 'PREFIX*'.
+    """
 
-    def expand_path_var(self, path_var: str) -> T.List[str]:
-        locations = self.get_non_empty_var(path_var)
-        return [os.path.expanduser(p) for p in locations]
+    def fold(s: str) -> str:
+        return s.lower() if ignore_case else s
 
-    def resolve_path_var(self, path_var: str) -> str:
-        locations = self.expand_path_var(path_var)
-        for tool in locations:
-            if shutil.which(tool):
-                return tool
-        # Not found; fall back to first configured location.
-        return locations[0]
+    if literal_glob(other_glob):
+        return bool(glob_regex(glob, ignore_case).fullmatch(other_glob))
+    if glob.startswith("*") and literal_glob(glob[1:]):
+        suffix = glob[1:]
+        tail = other_glob[len(other_glob) - len(suffix) :]
+        return literal_glob(tail) and fold(tail) == fold(suffix)
+    if glob.endswith("*") and literal_glob(glob[:-1]):
+        prefix = glob[:-1]
+        head = other_glob[: len(prefix)]
+        return literal_glob(head) and fold(head) == fold(prefix)
+    return False
 
-    def run_args(self, args: T.List[str]) -> T.Tuple[int, bytes]:
-        with open(os.devnull) as stdin:
-            try:
-                p = Popen(args, stdin=stdin, stdout=PIPE, stderr=STDOUT)
-                output = p.communicate()[0]
-                retcode = p.poll()
-                if retcode is None:
-                    retcode = 1
-            except OSError:
-                retcode = 1
-                output = b""
-            return retcode, output
 
-    def probe_gnu_style(self, tool: str) -> str:
-        retcode, output = self.run_args([tool, "--version"])
-        if retcode == 0 and b"GNU" in output:
-            style = "gnu"
+def ignore_pattern_regex(pattern: str) -> str:
+    """Translate a '.gitignore' pattern into a regex source string.
+
+    Unlike 'find' globs, '*', '?', and classes never match '/', while '**'
+    matches across directories.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "[":
+            regex, i = glob_class_regex(pattern, i, exclude="/")
+            parts.append(regex)
+            continue
+        i += 1
+        if pattern.startswith("**/", i - 1):
+            parts.append("(?:.*/)?")
+            i += 2
+        elif pattern.startswith("**", i - 1):
+            parts.append(".*")
+            i += 1
+        elif c == "*":
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "\\" and i < len(pattern):
+            parts.append(re.escape(pattern[i]))
+            i += 1
         else:
-            style = "bsd"
-        return style
+            parts.append(re.escape(c))
+    return "".join(parts)
 
-    def resolve_xargs_style(self, xargs_tool: str) -> str:
-        choices = ["probe", "gnu", "bsd", "posix"]
-        style = self.get_choice_var("xargs_style", choices)
-        if style == "probe":
-            style = self.probe_gnu_style(xargs_tool)
-        return style
 
-    def resolve_find_style(self, find_tool: str) -> str:
-        choices = ["probe", "gnu", "bsd", "posix"]
-        style = self.get_choice_var("find_style", choices)
-        if style == "probe":
-            style = self.probe_gnu_style(find_tool)
-        return style
+# A raw ignore rule: (regex, negate, dir_only, anchored).
+IgnoreRule = T.Tuple[str, bool, bool, bool]
 
-    def resolve_grep_style(self, grep_tool: str) -> str:
-        choices = ["probe", "gnu", "bsd", "posix"]
-        style = self.get_choice_var("grep_style", choices)
-        if style == "probe":
-            style = self.probe_gnu_style(grep_tool)
-        return style
 
-    def has_meta(self, s: str) -> bool:
-        for c in self.META_CHARS:
-            if c in s:
-                return True
-        # Paired characters cannot match one-character string.
-        if len(s) > 1:
-            for c in self.META_PAIRS:
-                if c in s:
-                    return True
-        return False
+def parse_ignore_lines(lines: T.Iterable[str]) -> T.List[IgnoreRule]:
+    """Parse the lines of a '.gitignore'-format file into raw rules."""
+    rules = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and stripped != line:
+            # An escaped trailing space is kept.
+            stripped += " "
+        line = stripped
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        if line.startswith("/"):
+            line = line[1:]
+        if line:
+            rule = (ignore_pattern_regex(line), negate, dir_only, anchored)
+            rules.append(rule)
+    return rules
+
+
+def atomic_write(
+    path: str, data: bytes, mtime: T.Optional[float] = None
+) -> None:
+    """Write data to path such that readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(tmp_path, (mtime, mtime))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-    def matches_root(self, s: str) -> bool:
-        return (
-            s not in self.RESERVED_WORDS
-            and not s.startswith("-")
-            and (not self.has_meta(s) or os.path.exists(s))
+
+def escape_glob(s: str) -> str:
+    """Quote s for use as a literal 'find' glob."""
+    return re.sub(r"([*?\[\]\\])", r"\\\1", s)
+
+
+@functools.lru_cache(maxsize=None)
+def mount_table(
+    path: str = "/proc/self/mountinfo",
+) -> T.Tuple[T.Tuple[str, str], ...]:
+    """Return (mount point, fstype) pairs read from a Linux mountinfo file.
+
+    Returns no mounts where the file is unavailable.
+    """
+    try:
+        with open(path, encoding="utf-8", errors="surrogateescape") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return ()
+    mounts = []
+    for line in lines:
+        # Optional fields end with a lone '-' before the fstype.
+        fields, sep, rest = line.partition(" - ")
+        mount_fields = fields.split()
+        if not sep or len(mount_fields) < 5 or not rest.split():
+            continue
+        mount_point = re.sub(
+            r"\\([0-7]{3})",
+            lambda m: chr(int(m.group(1), 8)),
+            mount_fields[4],
         )
+        mounts.append((mount_point, rest.split()[0]))
+    return tuple(mounts)
 
-    def push_arg(self, arg: str) -> None:
-        self.args.insert(0, arg)
 
-    def push_arg_list(self, arg_list: T.List[str]) -> None:
-        self.args[:0] = arg_list
+def walked_path(root: str, follow_roots: bool) -> str:
+    """Return the real path of root, resolving a symlinked root if followed."""
+    if follow_roots or not os.path.islink(root):
+        return os.path.realpath(root)
+    parent, name = os.path.split(os.path.abspath(root))
+    return os.path.join(os.path.realpath(parent), name)
 
-    def peek_arg(self) -> str:
-        try:
-            return self.args[0]
-        except IndexError:
-            raise MissingArgumentError()
 
-    def pop_arg(self) -> str:
-        try:
-            return self.args.pop(0)
-        except IndexError:
-            raise MissingArgumentError()
+def same_device(
+    st: T.Optional[os.stat_result], other_st: T.Optional[os.stat_result]
+) -> bool:
+    return (
+        st is not None
+        and other_st is not None
+        and st.st_dev == other_st.st_dev
+    )
+
+
+def join_find_path(parent: str, name: str) -> str:
+    """Join like 'find' does when printing paths below a root."""
+    if parent.endswith("/"):
+        return parent + name
+    return parent + "/" + name
+
+
+# '-dupes' hashes files on chunks of this size at the head and tail first.
+DUPES_CHUNK_BYTES = 64 * 1024
+
+HASH_BUFFER_BYTES = 1024 * 1024
+
+
+def file_digest(path: str, size: int, partial: bool) -> str:
+    """Return the hex BLAKE2b-256 digest of a file of the given size.
+
+    With partial, only chunks at the head and tail are hashed; files of at
+    most two chunks are hashed in full either way.
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    buf = bytearray(HASH_BUFFER_BYTES)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        if partial and size > 2 * DUPES_CHUNK_BYTES:
+            digest.update(f.read(DUPES_CHUNK_BYTES))
+            f.seek(size - DUPES_CHUNK_BYTES)
+            digest.update(f.read(DUPES_CHUNK_BYTES))
+        else:
+            n = f.readinto(buf)
+            while n:
+                digest.update(view[:n])
+                n = f.readinto(buf)
+    return digest.hexdigest()
+
+
+def mean_interval(
+    n: float, total: float, total_squares: float
+) -> T.Tuple[float, float]:
+    """Return the mean and 95% confidence half-width of n samples.
+
+    The samples are given by their total and the total of their squares.
+    """
+    mean = total / n
+    if n < 2:
+        return mean, float("inf")
+    variance = max(total_squares - n * mean**2, 0.0) / (n - 1)
+    return mean, 1.96 * (variance / n) ** 0.5
+
+
+def entry_dir(entry: "Entry") -> str:
+    """Return the path of the directory holding entry (a ROOT holds itself)."""
+    if entry.depth == 0:
+        return entry.path
+    if entry.depth == 1:
+        return entry.root
+    return entry.path[: -len(entry.name) - 1]
+
+
+def mode_type_char(mode: int) -> str:
+    for type_char, test in [
+        ("f", stat.S_ISREG),
+        ("d", stat.S_ISDIR),
+        ("l", stat.S_ISLNK),
+        ("p", stat.S_ISFIFO),
+        ("s", stat.S_ISSOCK),
+        ("b", stat.S_ISBLK),
+        ("c", stat.S_ISCHR),
+    ]:
+        if test(mode):
+            return type_char
+    return "?"
+
+
+def iter_records(stream: T.IO[bytes], separator: bytes) -> T.Iterator[bytes]:
+    """Yield separator-terminated records from stream as they arrive."""
+    pending = b""
+    while True:
+        chunk = stream.read1(65536)  # type: ignore[attr-defined]
+        if not chunk:
+            break
+        records = (pending + chunk).split(separator)
+        pending = records.pop()
+        yield from records
+    if pending:
+        yield pending
+
+
+class Entry:
+    """A filesystem entry visited by findx's native evaluation."""
+
+    def __init__(
+        self,
+        path: str,
+        depth: int,
+        follow: bool,
+        dir_entry: T.Optional["os.DirEntry[str]"] = None,
+        root: T.Optional[str] = None,
+    ) -> None:
+        self.path = path
+        self.depth = depth
+        self.follow = follow
+        self.dir_entry = dir_entry
+        self.root = path if root is None else root
+        self._stat: T.Optional[os.stat_result] = None
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path.rstrip("/")) or self.path
+
+    def rel_parts(self) -> T.List[str]:
+        """Return the path components below the entry's root."""
+        if self.depth == 0:
+            return []
+        return self.path[len(join_find_path(self.root, "")) :].split("/")
+
+    def stat(self) -> T.Optional[os.stat_result]:
+        """Return the entry's status (following symlinks if requested).
+
+        As with 'find -L', a broken symlink reports its own status.
+        """
+        if self._stat is None:
+            try:
+                if self.follow:
+                    try:
+                        self._stat = os.stat(self.path)
+                    except FileNotFoundError:
+                        self._stat = os.lstat(self.path)
+                else:
+                    self._stat = os.lstat(self.path)
+            except OSError:
+                return None
+        return self._stat
+
+    def type_char(self) -> str:
+        # Prefer the cheap 'd_type' information from os.scandir().
+        d = self.dir_entry
+        if d is not None:
+            if not self.follow and d.is_symlink():
+                return "l"
+            elif d.is_dir(follow_symlinks=self.follow):
+                return "d"
+            elif d.is_file(follow_symlinks=self.follow):
+                return "f"
+        st = self.stat()
+        return mode_type_char(st.st_mode) if st else "?"
+
+    def is_dir(self) -> bool:
+        return self.type_char() == "d"
+
+
+def marker_test_args(marker: str) -> T.List[str]:
+    """Return a 'find' test for a directory containing the file marker."""
+    return ["-exec", "test", "-e", "{}/" + marker, ";"]
+
+
+def marker_test_name(args: T.List[str]) -> T.Optional[str]:
+    """Return the marker of a marker_test_args() test (else None)."""
+    if args[:3] != ["-exec", "test", "-e"] or args[4:] != [";"]:
+        return None
+    marker = args[3][len("{}/") :]
+    if args[3] != "{}/" + marker or "{}" in marker or "/" in marker:
+        return None
+    return marker
+
+
+def wait_rusage(
+    proc: "Popen[bytes]",
+) -> T.Optional["resource.struct_rusage"]:
+    """Wait for proc, returning its resource usage where supported."""
+    if not hasattr(os, "wait4"):
+        proc.wait()
+        return None
+    _, status, rusage = os.wait4(proc.pid, 0)
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+
+class Stats:
+    """Counters and timings gathered for '-stats'.
+
+    Without counting, paths and bytes go uncounted, so findx need not pass
+    the output of 'find' through itself.
+    """
+
+    PROGRESS_INTERVAL = 0.25
+
+    def __init__(self, progress: bool, counting: bool = True) -> None:
+        self.phases: T.Dict[str, float] = {}
+        # Stage name -> [wall, user, sys, processes].
+        self.stages: T.Dict[str, T.List[float]] = {}
+        self.visited: T.Optional[int] = None
+        self.emitted = 0
+        self.bytes = 0
+        # Known only when findx runs XARGS once per batch.
+        self.batches: T.Optional[int] = None
+        # Known only when findx walks natively with '-prune-markers'.
+        self.marked_dirs: T.Optional[int] = None
+        self.counting = counting
+        self.progress = progress and counting
+        self.progress_start = time.perf_counter()
+        self.progress_time = self.progress_start
+        self.progress_shown = False
+
+    def add_stage(
+        self, stage: str, wall: float, user: float, sys_: float
+    ) -> None:
+        totals = self.stages.setdefault(stage, [0.0, 0.0, 0.0, 0])
+        totals[0] += wall
+        totals[1] += user
+        totals[2] += sys_
+        totals[3] += 1
+
+    def wait(self, proc: "Popen[bytes]", stage: str, start: float) -> int:
+        """Reap proc, charging its time and rusage to stage."""
+        rusage = wait_rusage(proc)
+        wall = time.perf_counter() - start
+        if rusage is None:
+            self.add_stage(stage, wall, 0.0, 0.0)
+        else:
+            self.add_stage(stage, wall, rusage.ru_utime, rusage.ru_stime)
+        return proc.returncode
+
+    def count(self, nbytes: int, records: int = 1) -> None:
+        if not self.counting:
+            return
+        self.emitted += records
+        self.bytes += nbytes
+        if self.progress:
+            now = time.perf_counter()
+            if now - self.progress_time >= self.PROGRESS_INTERVAL:
+                self.progress_time = now
+                rate = self.emitted / (now - self.progress_start)
+                sys.stderr.write(
+                    f"\r{project_name}: {self.emitted} paths, {rate:.0f}/s "
+                )
+                sys.stderr.flush()
+                self.progress_shown = True
+
+    def clear_progress(self) -> None:
+        if self.progress_shown:
+            sys.stderr.write("\r\x1b[K")
+            sys.stderr.flush()
+            self.progress_shown = False
+
+    def report(self) -> None:
+        self.clear_progress()
+        phases = ", ".join(f"{k} {v:.3f}s" for k, v in self.phases.items())
+        warn(f"stats: phases: {phases}")
+        for stage, (wall, user, sys_, procs) in self.stages.items():
+            warn(
+                f"stats: stage {stage}: wall {wall:.3f}s, user {user:.3f}s,"
+                f" sys {sys_:.3f}s, processes {procs:.0f}"
+            )
+        visited = "n/a" if self.visited is None else str(self.visited)
+        batches = "n/a" if self.batches is None else str(self.batches)
+        emitted, piped = "n/a", "n/a"
+        if self.counting:
+            emitted, piped = str(self.emitted), str(self.bytes)
+        warn(
+            f"stats: entries visited: {visited}, paths emitted:"
+            f" {emitted}, bytes piped: {piped}, xargs batches: {batches}"
+        )
+        if self.marked_dirs is not None:
+            warn(f"stats: directories pruned by markers: {self.marked_dirs}")
+
+    @classmethod
+    def from_dict(cls, data: T.Dict[str, T.Any]) -> "Stats":
+        """Rebuild Stats from the output of as_dict().
+
+        Raises ValueError or TypeError for values of the wrong type.
+        """
+
+        def optional_int(value: T.Any) -> T.Optional[int]:
+            return None if value is None else int(value)
+
+        counting = data["paths_emitted"] is not None
+        stats = cls(progress=False, counting=counting)
+        stats.phases = {str(k): float(v) for k, v in data["phases"].items()}
+        stats.stages = {
+            str(stage): [
+                float(t["wall"]),
+                float(t["user"]),
+                float(t["sys"]),
+                int(t["processes"]),
+            ]
+            for stage, t in data["stages"].items()
+        }
+        stats.visited = optional_int(data["entries_visited"])
+        stats.emitted = optional_int(data["paths_emitted"]) or 0
+        stats.bytes = optional_int(data["bytes_piped"]) or 0
+        stats.batches = optional_int(data["xargs_batches"])
+        stats.marked_dirs = optional_int(data["dirs_pruned_by_markers"])
+        return stats
+
+    def as_dict(self) -> T.Dict[str, T.Any]:
+        return {
+            "phases": dict(self.phases),
+            "stages": {
+                stage: {
+                    "wall": wall,
+                    "user": user,
+                    "sys": sys_,
+                    "processes": int(procs),
+                }
+                for stage, (wall, user, sys_, procs) in self.stages.items()
+            },
+            "entries_visited": self.visited,
+            "paths_emitted": self.emitted if self.counting else None,
+            "bytes_piped": self.bytes if self.counting else None,
+            "xargs_batches": self.batches,
+            "dirs_pruned_by_markers": self.marked_dirs,
+        }
+
+
+def rusage_dict(who: int) -> T.Dict[str, float]:
+    usage = resource.getrusage(who)
+    return {
+        "user": usage.ru_utime,
+        "sys": usage.ru_stime,
+        "max_rss_kib": usage.ru_maxrss,
+        "in_blocks": usage.ru_inblock,
+        "out_blocks": usage.ru_oublock,
+    }
+
+
+def rusage_dicts() -> T.Dict[str, T.Dict[str, float]]:
+    """Return rusage for findx and its children (empty if unsupported)."""
+    if resource is None:
+        return {}
+    return {
+        "self": rusage_dict(resource.RUSAGE_SELF),
+        "children": rusage_dict(resource.RUSAGE_CHILDREN),
+    }
+
+
+def cpu_times() -> T.Tuple[float, float]:
+    """Return the user and system CPU seconds used by findx so far."""
+    if resource is None:
+        times = os.times()
+        return times.user, times.system
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime, usage.ru_stime
+
+
+def prometheus_label(value: T.Any) -> str:
+    s = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    return '"%s"' % s.replace('"', '\\"')
+
+
+def prometheus_text(record: T.Dict[str, T.Any]) -> str:
+    """Render a metrics record in the Prometheus text exposition format."""
+    families: T.Dict[str, T.List[str]] = {}
+
+    def gauge(name: str, value: T.Any, **labels: T.Any) -> None:
+        if value is None:
+            return
+        metric = f"{project_name}_{name}"
+        samples = families.setdefault(metric, [f"# TYPE {metric} gauge"])
+        if labels:
+            metric += "{%s}" % ",".join(
+                f"{k}={prometheus_label(v)}" for k, v in labels.items()
+            )
+        samples.append(f"{metric} {value}")
+
+    gauge("last_run_timestamp_seconds", record["timestamp"])
+    gauge("exit_status", record["exit_status"])
+    for i, status in enumerate(record["pipe_status"] or []):
+        gauge("pipe_status", status, stage=i)
+    for tool, info in record["tools"].items():
+        gauge("tool_info", 1, tool=tool, **info)
+    stats = record["stats"]
+    for phase, seconds in stats["phases"].items():
+        gauge("phase_seconds", seconds, phase=phase)
+    for stage, totals in stats["stages"].items():
+        gauge("stage_wall_seconds", totals["wall"], stage=stage)
+        for mode in ["user", "sys"]:
+            gauge("stage_cpu_seconds", totals[mode], stage=stage, mode=mode)
+        gauge("stage_processes", totals["processes"], stage=stage)
+    for key in ["entries_visited", "paths_emitted", "bytes_piped"]:
+        gauge(key, stats[key])
+    gauge("xargs_batches", stats["xargs_batches"])
+    for who, usage in record["rusage"].items():
+        for key, value in usage.items():
+            gauge(f"rusage_{key}", value, who=who)
+    lines = [line for samples in families.values() for line in samples]
+    return "\n".join(lines) + "\n"
+
+
+class Throttle:
+    """Pace paths to budgets of files and bytes of file data per second."""
+
+    def __init__(self, file_rate: int, byte_rate: int) -> None:
+        self.file_rate = file_rate
+        self.byte_rate = byte_rate
+        self.files = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+
+    def pace(self, path: T.Union[str, bytes]) -> None:
+        """Account for path, sleeping until it is within budget."""
+        self.files += 1
+        due = 0.0
+        if self.file_rate:
+            due = self.files / self.file_rate
+        if self.byte_rate:
+            try:
+                self.bytes += os.stat(path).st_size
+            except OSError:
+                pass
+            due = max(due, self.bytes / self.byte_rate)
+        delay = self.start + due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class BatchRunner:
+    """Run an 'xargs' command line once per batch of records.
+
+    Feeding each batch to its own 'xargs' lets findx observe batches while
+    'xargs' still interprets its options.  Batches stay under the default
+    command-line limit of GNU 'xargs' so each one runs a single command.
+    With grow, the first batch holds one record and each later batch twice
+    as many as the one before (still bounded by size), so that output
+    starts promptly while long runs still use full-size batches.
+    """
+
+    MAX_BATCH_BYTES = 128 * 1024 - 4096
+
+    # 'xargs' statuses after which it stops running commands.
+    STOP_STATUSES = [124, 125, 126, 127]
+
+    def __init__(
+        self,
+        xargs_args: T.List[str],
+        stats: T.Optional[Stats] = None,
+        first: bool = False,
+        grow: bool = False,
+    ) -> None:
+        self.xargs_args = xargs_args
+        self.xargs_abs_path = must_find_executable(xargs_args[0])
+        self.separator = b"\0" if xargs_args[1:2] == ["-0"] else b"\n"
+        overhead = sum(len(os.fsencode(a)) + 1 for a in xargs_args)
+        self.max_bytes = max(self.MAX_BATCH_BYTES - overhead, 1)
+        self.stats = stats
+        self.batch: T.List[bytes] = []
+        self.batch_bytes = 0
+        self.batches = 0
+        self.status = 0
+        self.stopped = False
+        # Stop after the first line of command output (for '-first').
+        self.first = first
+        self.matched = False
+        self.max_records: T.Optional[int] = 1 if grow else None
+
+    def add(self, record: bytes) -> bool:
+        """Queue record for a batch; return False once 'xargs' stopped."""
+        size = len(record) + 1
+        if self.batch and self.batch_bytes + size > self.max_bytes:
+            self.flush()
+        if self.stopped:
+            return False
+        self.batch.append(record)
+        self.batch_bytes += size
+        if self.max_records is not None:
+            if len(self.batch) >= self.max_records:
+                self.max_records *= 2
+                self.flush()
+        return True
+
+    def flush(self) -> None:
+        if self.stopped:
+            return
+        data = b"".join(r + self.separator for r in self.batch)
+        self.batch = []
+        self.batch_bytes = 0
+        start = time.perf_counter()
+        if self.first:
+            proc = self.run_first_batch(data)
+        else:
+            proc = Popen(
+                self.xargs_args, stdin=PIPE, executable=self.xargs_abs_path
+            )
+            feed_pipe(proc.stdin, data)
+        if self.stats is None:
+            status = proc.wait()
+        else:
+            status = self.stats.wait(proc, "xargs", start)
+            self.stats.batches = (self.stats.batches or 0) + 1
+        self.batches += 1
+        self.merge_status(status)
+
+    def run_first_batch(self, data: bytes) -> "Popen[bytes]":
+        """Run a batch, killing it once it has output a complete line."""
+        # A process group lets the command be killed along with 'xargs'.
+        proc = Popen(
+            self.xargs_args,
+            stdin=PIPE,
+            stdout=PIPE,
+            executable=self.xargs_abs_path,
+            preexec_fn=os.setpgrp,
+        )
+        assert proc.stdout is not None
+        feeder = threading.Thread(target=feed_pipe, args=(proc.stdin, data))
+        feeder.daemon = True
+        feeder.start()
+        try:
+            line = proc.stdout.readline()
+            if line:
+                self.matched = True
+                write_stdout(line)
+        except BaseException:
+            self.matched = True
+            raise
+        finally:
+            if self.matched and proc.poll() is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            proc.stdout.close()
+            feeder.join()
+        return proc
+
+    def merge_status(self, status: int) -> None:
+        if self.matched:
+            # Stopping at the first output line is a success.
+            self.status = 0
+            self.stopped = True
+        elif status in self.STOP_STATUSES or status < 0:
+            self.status = status
+            self.stopped = True
+        elif status and not self.status:
+            self.status = status
+
+    def close(self) -> int:
+        """Run any final batch, returning the merged 'xargs' status."""
+        # With no records at all, 'xargs' decides whether to run anything.
+        if self.batch or not self.batches:
+            self.flush()
+        return self.status
+
+
+def write_stdout(data: bytes) -> bool:
+    """Write data to stdout; return False if the reader has gone away."""
+    try:
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+        return True
+    except BrokenPipeError:
+        # Avoid a second error when Python flushes stdout at exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return False
+
+
+@contextlib.contextmanager
+def stdout_redirected(path: str) -> T.Iterator[None]:
+    """Redirect the stdout file descriptor (as used by children) to path."""
+    with open(path, "wb") as f:
+        saved_stdout = os.dup(sys.stdout.fileno())
+        sys.stdout.flush()
+        os.dup2(f.fileno(), sys.stdout.fileno())
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved_stdout, sys.stdout.fileno())
+            os.close(saved_stdout)
+
+
+def feed_pipe(stream: T.Optional[T.IO[bytes]], data: bytes) -> None:
+    """Write data to a child's stdin and close it, ignoring early exits."""
+    assert stream is not None
+    try:
+        stream.write(data)
+        stream.close()
+    except (BrokenPipeError, ValueError):
+        pass
+
+
+def histogram_add(histogram: T.Dict[str, int], key: T.Any) -> None:
+    histogram[str(key)] = histogram.get(str(key), 0) + 1
+
+
+def histogram_sample(
+    rng: random.Random, histogram: T.Dict[str, int], k: int
+) -> T.List[str]:
+    if not histogram or k <= 0:
+        return []
+    keys = list(histogram)
+    return rng.choices(keys, [histogram[key] for key in keys], k=k)
+
+
+class TreeShape:
+    """An anonymized shape of a traversed tree for '--record'."""
+
+    FIELDS = """
+        depths fanouts name_lengths extensions sizes pruned_names
+        """.split()
+
+    def __init__(self) -> None:
+        # Depth -> {type char -> count}.
+        self.depths: T.Dict[str, T.Dict[str, int]] = {}
+        self.fanouts: T.Dict[str, int] = {}
+        self.name_lengths: T.Dict[str, int] = {}
+        self.extensions: T.Dict[str, int] = {}
+        # Size bit length -> count of files.
+        self.sizes: T.Dict[str, int] = {}
+        self.pruned_names: T.Dict[str, int] = {}
+        # Directory path (with trailing '/') -> number of children.
+        self.children: T.Dict[str, int] = {}
+        # Field -> shuffled histogram keys still to be drawn.
+        self.bags: T.Dict[str, T.List[str]] = {}
+
+    def add(self, entry: Entry) -> None:
+        type_char = entry.type_char()
+        if type_char not in "dl":
+            type_char = "f"
+        histogram_add(self.depths.setdefault(str(entry.depth), {}), type_char)
+        if type_char == "d":
+            self.children.setdefault(join_find_path(entry.path, ""), 0)
+        if entry.depth == 0:
+            return
+        parent = entry.path[: len(entry.path) - len(entry.name)]
+        self.children[parent] = self.children.get(parent, 0) + 1
+        histogram_add(self.name_lengths, len(entry.name))
+        if type_char == "f":
+            histogram_add(self.extensions, self.extension(entry.name))
+            st = entry.stat()
+            histogram_add(self.sizes, st.st_size.bit_length() if st else 0)
+
+    def extension(self, name: str) -> str:
+        ext = os.path.splitext(name)[1]
+        # Long or unusual extensions might identify a file.
+        if len(ext) > 8 or not ext[1:].isalnum():
+            return "" if not ext else ".other"
+        return ext.lower()
+
+    def as_dict(self) -> T.Dict[str, T.Any]:
+        for count in self.children.values():
+            histogram_add(self.fanouts, count)
+        self.children = {}
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: T.Dict[str, T.Any]) -> "TreeShape":
+        """Rebuild a TreeShape, raising ValueError unless it is valid.
+
+        Keys become names below the synthetic roots, so they are checked
+        to be what add() could have produced.
+        """
+        shape = cls()
+        for field in cls.FIELDS:
+            histogram = dict(data[field])
+            for key, value in histogram.items():
+                if field == "depths":
+                    valid = key.isdigit() and isinstance(value, dict)
+                    valid = valid and set(value) <= set("dfl")
+                    counts = list(value.values()) if valid else []
+                else:
+                    valid = cls.valid_key(field, key)
+                    counts = [value]
+                if not valid or not all(
+                    type(n) is int and n >= 0 for n in counts
+                ):
+                    raise ValueError(f"invalid {field} entry {repr(key)}")
+            setattr(shape, field, histogram)
+        return shape
+
+    @staticmethod
+    def valid_key(field: str, key: str) -> bool:
+        if field == "extensions":
+            return key in ["", ".other"] or (
+                key[:1] == "." and key[1:].isalnum() and len(key) <= 8
+            )
+        if field == "pruned_names":
+            return (
+                key not in ["", ".", ".."]
+                and "/" not in key
+                and "\0" not in key
+                and len(os.fsencode(key)) <= 255
+            )
+        limit = {"name_lengths": 255, "sizes": 63}.get(field)
+        return key.isdigit() and (limit is None or int(key) <= limit)
+
+    def synthesize(self, roots: T.List[str], seed: int = 0) -> None:
+        """Create a tree with this shape below the (existing) roots."""
+        rng = random.Random(seed)
+        for field in ["name_lengths", "extensions", "sizes"]:
+            histogram = getattr(self, field)
+            bag = [key for key, n in histogram.items() for _ in range(n)]
+            rng.shuffle(bag)
+            self.bags[field] = bag
+        parents = list(roots)
+        files: T.List[str] = []
+        depth = 1
+        while parents and str(depth) in self.depths:
+            counts = self.depths[str(depth)]
+            fanouts = histogram_sample(rng, self.fanouts, len(parents))
+            weights = [int(f) + 1 for f in fanouts] or None
+            new_dirs = []
+            for type_char in "dfl":
+                count = counts.get(type_char, 0)
+                for parent in rng.choices(parents, weights, k=count):
+                    path = self.synthetic_path(rng, parent, type_char)
+                    if type_char == "d":
+                        os.mkdir(path)
+                        new_dirs.append(path)
+                    elif type_char == "f":
+                        self.write_synthetic_file(rng, path)
+                        files.append(path)
+                    else:
+                        os.symlink(rng.choice(files) if files else ".", path)
+            parents = new_dirs
+            depth += 1
+        self.synthesize_pruned(rng, roots)
+
+    def synthesize_pruned(
+        self, rng: random.Random, roots: T.List[str]
+    ) -> None:
+        dirs = [d for root in roots for d, _, _ in os.walk(root)]
+        for name, count in self.pruned_names.items():
+            for parent in rng.choices(dirs, k=count):
+                path = os.path.join(parent, name)
+                if os.path.lexists(path):
+                    continue
+                os.mkdir(path)
+                for i in range(10):
+                    file_path = os.path.join(path, str(i))
+                    self.write_synthetic_file(rng, file_path)
+
+    def draw(self, rng: random.Random, field: str) -> str:
+        """Draw a key so that, overall, the histogram is reproduced."""
+        bag = self.bags.get(field)
+        if bag:
+            return bag.pop()
+        return (histogram_sample(rng, getattr(self, field), 1) or [""])[0]
+
+    def synthetic_path(
+        self, rng: random.Random, parent: str, type_char: str
+    ) -> str:
+        length = int(self.draw(rng, "name_lengths") or 8)
+        ext = self.draw(rng, "extensions") if type_char == "f" else ""
+        letters = "abcdefghijklmnopqrstuvwxyz0123456789"
+        stem_length = max(1, length - len(ext))
+        while True:
+            stem = "".join(rng.choice(letters) for _ in range(stem_length))
+            path = os.path.join(parent, stem + ext)
+            if not os.path.lexists(path):
+                return path
+
+    def write_synthetic_file(self, rng: random.Random, path: str) -> None:
+        bits = int(self.draw(rng, "sizes") or 0)
+        size = rng.randrange(1 << (bits - 1), 1 << bits) if bits else 0
+        chunk = b"lorem ipsum dolor sit amet consectetur adipiscing elit\n"
+        chunk *= 1024
+        with open(path, "wb") as f:
+            for offset in range(0, size, len(chunk)):
+                f.write(chunk[: size - offset])
+
+
+# A compiled 'find' expression.
+Predicate = T.Callable[[Entry], bool]
+
+# A compiled ignore rule: (regex, negate, dir_only, anchored).
+CompiledIgnoreRule = T.Tuple[T.Pattern[str], bool, bool, bool]
+
+
+class IgnoreMatcher:
+    """Layered matching against per-directory '.gitignore'-format files.
+
+    Parsed rules are cached in a JSON file keyed by each ignore file's path,
+    mtime, and size, so unchanged ignore files are not parsed again.
+    """
+
+    def __init__(self, names: T.List[str], cache_file: str) -> None:
+        self.names = names
+        self.cache_file = cache_file
+        self._dir_rules: T.Dict[str, T.List[CompiledIgnoreRule]] = {}
+        self._cache: T.Dict[str, T.Any] = {}
+        self._cache_dirty = False
+        try:
+            with open(cache_file, "rb") as f:
+                cache = json.loads(f.read())
+            if isinstance(cache, dict):
+                self._cache = cache
+        except (OSError, ValueError):
+            pass
+
+    def raw_rules(self, path: str) -> T.List[IgnoreRule]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return []
+        key = os.path.abspath(path)
+        stamp = [st.st_mtime_ns, st.st_size]
+        record = self._cache.get(key)
+        if isinstance(record, dict) and record.get("stamp") == stamp:
+            return [T.cast(IgnoreRule, tuple(r)) for r in record["rules"]]
+        try:
+            with open(path, encoding="utf-8", errors="surrogateescape") as f:
+                rules = parse_ignore_lines(f)
+        except OSError:
+            return []
+        self._cache[key] = {"stamp": stamp, "rules": rules}
+        self._cache_dirty = True
+        return rules
+
+    def dir_rules(self, dir_path: str) -> T.List[CompiledIgnoreRule]:
+        if dir_path not in self._dir_rules:
+            rules = []
+            # Later files (e.g., '.ignore') override earlier ones.
+            for name in self.names:
+                path = join_find_path(dir_path, name)
+                for regex, negate, dir_only, anchored in self.raw_rules(path):
+                    compiled = re.compile(regex, re.DOTALL)
+                    rules.append((compiled, negate, dir_only, anchored))
+            self._dir_rules[dir_path] = rules
+        return self._dir_rules[dir_path]
+
+    def ignored(self, entry: Entry) -> bool:
+        """Return True if entry is ignored by its ancestors' ignore files.
+
+        Deeper ignore files take precedence, and the last matching rule in
+        a file wins.
+        """
+        parts = entry.rel_parts()
+        is_dir = entry.is_dir()
+        for depth in range(len(parts) - 1, -1, -1):
+            if depth:
+                dir_path = join_find_path(entry.root, "/".join(parts[:depth]))
+            else:
+                dir_path = entry.root
+            rel_path = "/".join(parts[depth:])
+            rules = self.dir_rules(dir_path)
+            for regex, negate, dir_only, anchored in reversed(rules):
+                if dir_only and not is_dir:
+                    continue
+                if regex.fullmatch(rel_path if anchored else parts[-1]):
+                    return not negate
+        return False
+
+    def save(self) -> None:
+        if self._cache_dirty:
+            data = json.dumps(self._cache).encode("utf-8", "surrogateescape")
+            try:
+                atomic_write(self.cache_file, data)
+            except OSError as e:
+                warn(f"Cannot write {repr(self.cache_file)}: {e.strerror}")
+            self._cache_dirty = False
+
+
+class ResultCache:
+    """Query results cached in files, evicted least recently used first.
+
+    Each file holds a JSON header mapping the roots and every directory
+    read during the walk to its mtime, followed by NUL-terminated paths.
+    Adding, removing, or renaming an entry changes its directory's mtime,
+    so the results stay valid while none of those mtimes change.
+    """
+
+    # Changes within this long of a directory's mtime (in nanoseconds) may
+    # leave it unchanged, as timestamps come from a coarse clock.
+    RACY_NS = 2 * 10**9
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key: str) -> T.Optional[T.List[str]]:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                data = f.read()
+            for dir_path, mtime in header["dirs"].items():
+                if os.stat(dir_path).st_mtime_ns != mtime:
+                    return None
+            os.utime(path)
+        except (OSError, ValueError, KeyError, AttributeError):
+            return None
+        records = data.split(b"\0")[:-1]
+        return [os.fsdecode(record) for record in records]
+
+    def save(
+        self,
+        key: str,
+        dirs: T.Dict[str, int],
+        paths: T.List[str],
+        started_ns: int,
+    ) -> None:
+        """Save results of a walk that began at started_ns.
+
+        Results are not saved while any directory was modified too
+        recently to tell whether it changed again during the walk.
+        """
+        if any(mtime > started_ns - self.RACY_NS for mtime in dirs.values()):
+            return
+        header = json.dumps({"dirs": dirs}).encode("utf-8", "surrogateescape")
+        data = b"".join(os.fsencode(path) + b"\0" for path in paths)
+        if len(header) + len(data) > self.max_bytes:
+            return
+        atomic_write(self.path(key), header + b"\n" + data)
+        self.evict()
+
+    def evict(self) -> None:
+        try:
+            with os.scandir(self.cache_dir) as it:
+                files = [(e.stat().st_mtime, e.stat().st_size, e) for e in it]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in files)
+        for _, size, dir_entry in sorted(files, key=lambda f: f[0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(dir_entry.path)
+            except OSError:
+                pass
+            total -= size
+
+
+class NativeCompiler:
+    """Compile ExprNode trees into predicates over Entry objects.
+
+    Only side-effect-free tests are supported; mode names the findx mode
+    requiring native evaluation for use in error messages.
+    """
+
+    GLOB_TESTS = {
+        "-name": (False, False),
+        "-iname": (False, True),
+        "-path": (True, False),
+        "-ipath": (True, True),
+        "-wholename": (True, False),
+        "-iwholename": (True, True),
+    }
+
+    def __init__(self, mode: str) -> None:
+        self.mode = mode
+        # Directories found to contain a '-prune-markers' marker file.
+        self.marked_dirs = 0
+
+    def compile(self, node: T.Optional[ExprNode]) -> Predicate:
+        if node is None:
+            return lambda entry: True
+        elif node.op == "test":
+            return self.compile_test(node.args)
+        children = [self.compile(child) for child in node.children]
+        if node.op == "not":
+            child = children[0]
+            return lambda entry: not child(entry)
+        elif node.op == "and":
+            return lambda entry: all(c(entry) for c in children)
+        elif node.op == "or":
+            return lambda entry: any(c(entry) for c in children)
+        else:
+
+            def comma(entry: Entry) -> bool:
+                for c in children:
+                    result = c(entry)
+                return result
+
+            return comma
+
+    def compile_prune(
+        self, excludes: T.Optional[ExprNode], includes: T.Optional[ExprNode]
+    ) -> T.Optional[Predicate]:
+        """Compile the pruning test '( EXCLUDES ) ! ( INCLUDES )'."""
+        if excludes is None:
+            return None
+        exclude = self.compile(excludes)
+        if includes is None:
+            return exclude
+        include = self.compile(includes)
+
+        def prune(entry: Entry) -> bool:
+            return exclude(entry) and not include(entry)
+
+        return prune
+
+    def compile_test(self, args: T.List[str]) -> Predicate:
+        test = args[0]
+        marker = marker_test_name(args)
+        if marker is not None:
+
+            def has_marker(entry: Entry) -> bool:
+                if not os.path.lexists(join_find_path(entry.path, marker)):
+                    return False
+                self.marked_dirs += 1
+                return True
+
+            return has_marker
+        elif test in self.GLOB_TESTS:
+            whole_path, ignore_case = self.GLOB_TESTS[test]
+            regex = glob_regex(args[1], ignore_case)
+            if whole_path:
+                return lambda entry: bool(regex.fullmatch(entry.path))
+            return lambda entry: bool(regex.fullmatch(entry.name))
+        elif test == "-type":
+            type_chars = args[1].replace(",", "")
+            return lambda entry: entry.type_char() in type_chars
+        elif test == "-newer":
+            try:
+                reference = os.stat(args[1]).st_mtime_ns
+            except OSError as e:
+                raise ReferenceFileError(args[1], str(e.strerror))
+
+            def newer(entry: Entry) -> bool:
+                st = entry.stat()
+                return st is not None and st.st_mtime_ns > reference
+
+            return newer
+        elif test == "-true":
+            return lambda entry: True
+        elif test == "-false":
+            return lambda entry: False
+        raise NativeUnsupportedError(test, self.mode)
+
+
+class Heatmap:
+    """Per-directory costs and yields of a native walk, for '-heatmap'."""
+
+    def __init__(self) -> None:
+        # Directory path -> [entries read, seconds, paths yielded].
+        self.dirs: T.Dict[str, T.List[float]] = {}
+        self.parents: T.Dict[str, T.Optional[str]] = {}
+
+    def charge(
+        self,
+        path: str,
+        entries: int = 0,
+        seconds: float = 0.0,
+        paths: int = 0,
+    ) -> None:
+        totals = self.dirs.setdefault(path, [0, 0.0, 0])
+        totals[0] += entries
+        totals[1] += seconds
+        totals[2] += paths
+
+    def scanned(self, entry: Entry, entries: int, seconds: float) -> None:
+        self.parents[entry.path] = (
+            None if entry.depth == 0 else entry_dir(entry)
+        )
+        self.charge(entry.path, entries, seconds)
+
+    def timed(self, predicate: Predicate) -> Predicate:
+        """Return predicate, charging its time to each entry's directory."""
+
+        def timed_predicate(entry: Entry) -> bool:
+            start = time.perf_counter()
+            try:
+                return predicate(entry)
+            finally:
+                seconds = time.perf_counter() - start
+                self.charge(entry_dir(entry), seconds=seconds)
+
+        return timed_predicate
+
+    def counted(self, entries: T.Iterable[Entry]) -> T.Iterator[Entry]:
+        for entry in entries:
+            self.charge(entry_dir(entry), paths=1)
+            yield entry
+
+    def subtree_totals(self) -> T.Dict[str, T.List[float]]:
+        totals = {path: list(t) for path, t in self.dirs.items()}
+        # Directories are scanned after their parents.
+        for path in reversed(list(self.parents)):
+            parent = self.parents[path]
+            if parent is not None and path in totals:
+                parent_totals = totals.setdefault(parent, [0, 0.0, 0])
+                for i, value in enumerate(totals[path]):
+                    parent_totals[i] += value
+        return totals
+
+    def barren_dirs(self, top: int) -> T.List[T.Tuple[str, T.List[float]]]:
+        """Return the costliest subtrees below ROOTS yielding no paths."""
+        totals = self.subtree_totals()
+        barren = [
+            (path, totals[path])
+            for path, parent in self.parents.items()
+            if parent is not None
+            and totals[path][2] == 0
+            # Inside a ROOT or a directory yielding paths.
+            and (self.parents.get(parent) is None or totals[parent][2] > 0)
+        ]
+        barren.sort(key=lambda item: item[1][1], reverse=True)
+        return barren[:top]
+
+    def report(self, top: int, config_format: bool) -> None:
+        barren = self.barren_dirs(top)
+        if config_format:
+            names = []
+            for path, _ in barren:
+                name = escape_glob(os.path.basename(path))
+                if name not in names:
+                    names.append(name)
+            if names:
+                # Unprefixed, so the line can be pasted into a config file.
+                line = f"stdxd = +{optionally_quoted_join(names)}\n"
+                sys.stderr.write(line)
+                sys.stderr.flush()
+            return
+        warn(f"heatmap: {len(barren)} costliest directories yielding no paths")
+        for path, (entries, seconds, _) in barren:
+            warn(f"heatmap: {seconds:9.3f}s {entries:9.0f} entries  {path}")
+
+
+class NativeQuery:
+    """A findx command compiled for native evaluation.
+
+    Mirrors 'find ROOTS ( EXCLUDES ) ! ( INCLUDES ) -prune -o EXPRESSION'.
+    """
+
+    def __init__(
+        self,
+        follow: bool,
+        mindepth: int,
+        maxdepth: T.Optional[int],
+        prune: T.Optional[Predicate],
+        match: Predicate,
+    ) -> None:
+        self.follow = follow
+        self.mindepth = mindepth
+        self.maxdepth = maxdepth
+        self.prune = prune
+        self.match = match
+        self.follow_roots = follow
+        self.ignores: T.Optional[IgnoreMatcher] = None
+        self.heatmap: T.Optional[Heatmap] = None
+        self.compiler: T.Optional[NativeCompiler] = None
+        self.visited = 0
+        # Mtimes of the directories read, when recording for '-cache'.
+        self.dirs: T.Optional[T.Dict[str, int]] = None
+
+    def beyond_maxdepth(self, depth: int) -> bool:
+        return self.maxdepth is not None and depth > self.maxdepth
+
+    def pruned(self, entry: Entry, revisit: bool = False) -> bool:
+        # Called once per entry visited, plus for any revisits.
+        if not revisit:
+            self.visited += 1
+        if self.ignores is not None and self.ignores.ignored(entry):
+            return True
+        # As with 'find', nothing is evaluated above 'mindepth'.
+        if self.prune is None or entry.depth < self.mindepth:
+            return False
+        return self.prune(entry)
+
+    def matched(self, entry: Entry) -> bool:
+        return entry.depth >= self.mindepth and self.match(entry)
+
+
+class BatchQuery:
+    """One query from a '--batch' file and the destination of its paths."""
+
+    def __init__(
+        self, line_num: int, output: T.Optional[str], findx: "Findx"
+    ) -> None:
+        self.line_num = line_num
+        self.output = output
+        self.findx = findx
+        # Set when the query shares a native walk with other queries.
+        self.query: T.Optional[NativeQuery] = None
+        self.stream: T.Optional[T.IO[bytes]] = None
+        self.output_file: T.Optional[T.IO[bytes]] = None
+        self.proc: T.Optional["Popen[bytes]"] = None
+        self.separator = b"\n"
+        self.broken = False
+
+    def open(self) -> None:
+        xargs_pipe_args = self.findx.xargs_pipe_args
+        if self.output:
+            self.output_file = open(self.output, "wb")
+        if xargs_pipe_args:
+            if xargs_pipe_args[1:2] == ["-0"]:
+                self.separator = b"\0"
+            self.proc = Popen(
+                xargs_pipe_args,
+                stdin=PIPE,
+                stdout=self.output_file,
+                executable=must_find_executable(xargs_pipe_args[0]),
+            )
+            self.stream = self.proc.stdin
+        elif self.output_file is not None:
+            self.stream = self.output_file
+        else:
+            self.stream = sys.stdout.buffer
+
+    def write(self, path: str) -> None:
+        assert self.stream is not None
+        if self.broken:
+            return
+        try:
+            self.stream.write(os.fsencode(path) + self.separator)
+        except BrokenPipeError:
+            self.broken = True
+
+    def close(self, find_status: int) -> int:
+        """Finish the query, returning its exit status."""
+        assert self.stream is not None
+        try:
+            if self.stream is sys.stdout.buffer:
+                self.stream.flush()
+            else:
+                self.stream.close()
+        except BrokenPipeError:
+            pass
+        xargs_status = self.proc.wait() if self.proc is not None else 0
+        if self.output_file is not None:
+            self.output_file.close()
+        if self.query is not None and self.query.ignores is not None:
+            self.query.ignores.save()
+        self.findx.pipe_status = (find_status, xargs_status)
+        return merge_find_xargs_status(find_status, xargs_status)
+
+
+class Findx:
+    OPTIONS_0 = []
+    OPTIONS_1 = []
+    OPTIONS_2 = []
+    OPTIONS_VAR = []
+
+    # PRE_PATH_OPTIONS must come before any paths.
+    PRE_PATH_OPTIONS_0 = """
+        -H -L -P -O0 -O1 -O2 -O3
+        """.split()
+    OPTIONS_0.extend(PRE_PATH_OPTIONS_0)
+
+    PRE_PATH_OPTIONS_1 = """
+        -D --files0-from
+        """.split()
+    OPTIONS_1.extend(PRE_PATH_OPTIONS_1)
+
+    PRE_PATH_OPTIONS = PRE_PATH_OPTIONS_0 + PRE_PATH_OPTIONS_1
+
+    # POST_PATH_OPTIONS must come immediately after any paths.
+    POST_PATH_OPTIONS_0 = """
+        -d -depth --help -help -ignore_readdir_race -mount
+        -noignore_readdir_race -noleaf -nowarn -version --version -warn
+        -xautofs -xdev
+        """.split()
+    OPTIONS_0.extend(POST_PATH_OPTIONS_0)
+
+    POST_PATH_OPTIONS_1 = """
+        -maxdepth -mindepth
+        """.split()
+    OPTIONS_1.extend(POST_PATH_OPTIONS_1)
+
+    POST_PATH_OPTIONS = POST_PATH_OPTIONS_0 + POST_PATH_OPTIONS_1
+
+    # Options that go before the expression.
+    PRE_EXPR_OPTIONS = PRE_PATH_OPTIONS + POST_PATH_OPTIONS
+
+    # Action options.
+    ACTIONS_VAR = """
+        -exec -execdir -ok -okdir
+        """.split()
+    OPTIONS_VAR.extend(ACTIONS_VAR)
+
+    ACTIONS_0 = """
+        -delete -ls -print -print0 -quit
+        """.split()
+    OPTIONS_0.extend(ACTIONS_0)
+
+    ACTIONS_1 = """
+        -fls -fprint -fprint0 -printf
+        """.split()
+    OPTIONS_1.extend(ACTIONS_1)
+
+    ACTIONS_2 = """
+        -fprintf
+        """.split()
+    OPTIONS_2.extend(ACTIONS_2)
+
+    ACTIONS = ACTIONS_VAR + ACTIONS_0 + ACTIONS_1 + ACTIONS_2
+
+    # Test options.
+    TESTS_0 = """
+        -daystart -empty -executable -false -follow -nogroup -nouser -prune
+        -readable -true -writable
+        """.split()
+    OPTIONS_0.extend(TESTS_0)
+
+    TESTS_1 = """
+        -amin -anewer -atime -cmin -cnewer -context -ctime -fstype -gid -group
+        -inum -iregex -links -mmin -mtime -newer -perm -regex -regextype
+        -samefile -size -type -uid -used -user -xtype
+        """.split()
+    ref_types = "aBcmt"
+    for x in ref_types:
+        for y in ref_types:
+            TESTS_1.append(f"-newer{x}{y}")
+    OPTIONS_1.extend(TESTS_1)
+
+    TESTS_WITH_GLOB = """
+        -ilname -iname -ipath -iwholename -lname -name -path -wholename
+        """.split()
+    OPTIONS_1.extend(TESTS_WITH_GLOB)
+
+    TESTS = TESTS_0 + TESTS_1 + TESTS_WITH_GLOB
+
+    # All possible options.
+    OPTIONS = OPTIONS_0 + OPTIONS_1 + OPTIONS_2 + OPTIONS_VAR
+
+    UNARY_OPERATORS = """
+        ! -not
+        """.split()
+
+    BINARY_OPERATORS = """
+        , -a -and -o -or
+        """.split()
+
+    OPERATORS = UNARY_OPERATORS + BINARY_OPERATORS
+
+    RESERVED_WORDS = OPTIONS + OPERATORS + ["(", ")"]
+
+    META_CHARS = "*?|,"
+
+    META_PAIRS = "[]{}"
+
+    def __init__(self) -> None:
+        self.pre_path_options: T.List[str] = []
+        self.post_path_options: T.List[str] = []
+        self.roots: T.List[str] = []
+        # The arguments given to parse_command_line(), for '--record'.
+        self.command_args: T.List[str] = []
+        self.excludes: T.List[str] = []
+        self.includes: T.List[str] = []
+        self.saw_action = False
+        self.saw_print = False
+
+        self.expression: T.List[str] = []
+        self.in_xargs = False
+        self.locked_in_xargs = False
+        self.need_xarg = False
+        self.xargs: T.List[str] = []
+        self.find_pipe_args: T.List[str] = []
+        self.xargs_pipe_args: T.List[str] = []
+        self.show = False
+        self.show_help = False
+        self.show_version = False
+        self.show_readme = False
+        self.shown = False
+        self.pipe_status: T.Optional[T.Tuple[int, ...]] = None
+        self.config = Config(VALID_VARS)
+        self.stdxd = False
+        self.stdxf = False
+        self.stdxm = False
+        self.prune_markers = False
+        self.grep_tool: T.Optional[str] = None
+        self.backend = "find"
+        self.backend_files: T.Dict[str, bytes] = {}
+        self.git = False
+        self.ignore_files = False
+        self.native_modes: T.List[str] = []
+        self.bfs = False
+        self.heatmap = False
+        self.estimate = False
+        self.dupes = False
+        self.walk_errors = 0
+        self.stats: T.Optional[Stats] = None
+        self.report_stats = False
+        self.limit: T.Optional[int] = None
+        self.top: T.Optional[int] = None
+        self.top_by = ""
+        self.du = 1
+        # '-top' or '-du' and its arguments.
+        self.report_args: T.List[str] = []
+        self.since_last_run: T.Optional[str] = None
+        self.cache_results = False
+        self.optimize = True
+        self.collapse_roots = False
+        self.background = False
+        self.throttle: T.Optional[Throttle] = None
+        self.exclude_notes: T.List[str] = []
+        self.since_last_run_path = ""
+        self.since_last_run_start = 0.0
+        self.first = False
+        self.interactive = False
+        self.stopped_early = False
+        self.tools: T.Dict[str, T.Dict[str, str]] = {}
+        self.parse_seconds = 0.0
+        self.probe_seconds = 0.0
+        # Probed tool styles, shared with the queries of a '--batch' file.
+        self.probed_styles: T.Dict[str, str] = {}
+
+    def get_var(self, var: str) -> T.List[str]:
+        return self.config.get(var)
+
+    def get_non_empty_var(self, var: str) -> T.List[str]:
+        value = self.get_var(var)
+        if not value:
+            raise InvalidEmptyConfigVarError(var)
+        return value
+
+    def get_scalar_var(self, var: str) -> str:
+        value = self.get_var(var)
+        if len(value) != 1:
+            raise InvalidScalarConfigVarError(var)
+        return value[0]
+
+    def get_choice_var(self, var: str, choices: T.List[str]) -> str:
+        value = self.get_scalar_var(var)
+        if value not in choices:
+            raise InvalidChoiceConfigVarError(var, choices)
+        return value
+
+    def get_int_var(self, var: str, minimum: int) -> int:
+        try:
+            value = int(self.get_scalar_var(var))
+        except ValueError:
+            value = minimum - 1
+        if value < minimum:
+            raise InvalidIntConfigVarError(var, minimum)
+        return value
+
+    def expand_path_var(self, path_var: str) -> T.List[str]:
+        locations = self.get_non_empty_var(path_var)
+        return [os.path.expanduser(p) for p in locations]
+
+    def resolve_path_var(self, path_var: str) -> str:
+        with span("probe " + path_var):
+            tool = self.find_path_var(path_var)
+        tool_info = self.tools.setdefault(path_var.replace("_path", ""), {})
+        tool_info["path"] = tool
+        return tool
+
+    def find_path_var(self, path_var: str) -> str:
+        locations = self.expand_path_var(path_var)
+        start = time.perf_counter()
+        try:
+            for tool in locations:
+                if shutil.which(tool):
+                    return tool
+        finally:
+            self.probe_seconds += time.perf_counter() - start
+        # Not found; fall back to first configured location.
+        return locations[0]
+
+    def run_args(self, args: T.List[str]) -> T.Tuple[int, bytes]:
+        start = time.perf_counter()
+        try:
+            with span("probe " + args[0]):
+                return self.run_probe_args(args)
+        finally:
+            self.probe_seconds += time.perf_counter() - start
+
+    def run_probe_args(self, args: T.List[str]) -> T.Tuple[int, bytes]:
+        with open(os.devnull) as stdin:
+            try:
+                p = Popen(args, stdin=stdin, stdout=PIPE, stderr=STDOUT)
+                output = p.communicate()[0]
+                retcode = p.poll()
+                if retcode is None:
+                    retcode = 1
+            except OSError:
+                retcode = 1
+                output = b""
+            return retcode, output
+
+    def probe_gnu_style(self, tool: str) -> str:
+        if tool not in self.probed_styles:
+            retcode, output = self.run_args([tool, "--version"])
+            if retcode == 0 and b"GNU" in output:
+                style = "gnu"
+            else:
+                style = "bsd"
+            self.probed_styles[tool] = style
+        return self.probed_styles[tool]
+
+    def resolve_xargs_style(self, xargs_tool: str) -> str:
+        choices = ["probe", "gnu", "bsd", "posix"]
+        style = self.get_choice_var("xargs_style", choices)
+        if style == "probe":
+            style = self.probe_gnu_style(xargs_tool)
+        self.tools.setdefault("xargs", {})["style"] = style
+        return style
+
+    def resolve_find_style(self, find_tool: str) -> str:
+        choices = ["probe", "gnu", "bsd", "posix"]
+        style = self.get_choice_var("find_style", choices)
+        if style == "probe":
+            style = self.probe_gnu_style(find_tool)
+        self.tools.setdefault("find", {})["style"] = style
+        return style
+
+    def resolve_grep_style(self, grep_tool: str) -> str:
+        choices = ["probe", "gnu", "bsd", "posix"]
+        style = self.get_choice_var("grep_style", choices)
+        if style == "probe":
+            style = self.probe_gnu_style(grep_tool)
+        self.tools.setdefault("grep", {})["style"] = style
+        return style
+
+    def has_meta(self, s: str) -> bool:
+        for c in self.META_CHARS:
+            if c in s:
+                return True
+        # Paired characters cannot match one-character string.
+        if len(s) > 1:
+            for c in self.META_PAIRS:
+                if c in s:
+                    return True
+        return False
+
+    def matches_root(self, s: str) -> bool:
+        return (
+            s not in self.RESERVED_WORDS
+            and not s.startswith("-")
+            and (not self.has_meta(s) or os.path.exists(s))
+        )
+
+    def push_arg(self, arg: str) -> None:
+        self.args.insert(0, arg)
+
+    def push_arg_list(self, arg_list: T.List[str]) -> None:
+        self.args[:0] = arg_list
+
+    def peek_arg(self) -> str:
+        try:
+            return self.args[0]
+        except IndexError:
+            raise MissingArgumentError()
+
+    def pop_arg(self) -> str:
+        try:
+            return self.args.pop(0)
+        except IndexError:
+            raise MissingArgumentError()
 
     def pop_expected_arg(self, expected_arg: str) -> str:
         arg = self.pop_arg()
@@ -1296,23 +3517,32 @@ class Findx:
     def expand_test_with_glob(self, test: str, glob: str) -> T.List[str]:
         return self.distribute_option(test, self.split_glob(glob))
 
-    def get_option_list(self) -> T.List[str]:
-        option = self.pop_arg()
+    def take_option_list(self, args: T.List[str]) -> T.List[str]:
+        def pop() -> str:
+            try:
+                return args.pop(0)
+            except IndexError:
+                raise MissingArgumentError()
+
+        option = pop()
         option_list = [option]
         if option in self.OPTIONS_1:
-            option_list.append(self.pop_arg())
+            option_list.append(pop())
         elif option in self.OPTIONS_2:
-            option_list.append(self.pop_arg())
-            option_list.append(self.pop_arg())
+            option_list.append(pop())
+            option_list.append(pop())
         elif option in self.OPTIONS_VAR:
             while True:
-                option_list.append(self.pop_arg())
+                option_list.append(pop())
                 if option_list[-1] in [";", "+"]:
                     break
         elif option not in self.OPTIONS_0:
             raise InvalidOptionError(option)
         return option_list
 
+    def get_option_list(self) -> T.List[str]:
+        return self.take_option_list(self.args)
+
     def get_optional_term(self) -> T.List[str]:
         arg = self.peek_arg()
         if arg == "(":
@@ -1365,6 +3595,69 @@ class Findx:
                     break
         return expr
 
+    def make_expr_node(self, op: str, children: T.List[ExprNode]) -> ExprNode:
+        if len(children) == 1:
+            return children[0]
+        flat_children: T.List[ExprNode] = []
+        for child in children:
+            if child.op == op:
+                flat_children.extend(child.children)
+            else:
+                flat_children.append(child)
+        return ExprNode(op, children=flat_children)
+
+    def parse_expr_unary(self, args: T.List[str]) -> ExprNode:
+        if args[0] in self.UNARY_OPERATORS:
+            operator = args.pop(0)
+            return ExprNode(
+                "not", [operator], children=[self.parse_expr_unary(args)]
+            )
+        elif args[0] == "(":
+            args.pop(0)
+            node = self.parse_expr_comma(args)
+            args.pop(0)
+            return node
+        else:
+            return ExprNode("test", args=self.take_option_list(args))
+
+    def parse_expr_and(self, args: T.List[str]) -> ExprNode:
+        children = [self.parse_expr_unary(args)]
+        while args and args[0] not in [",", "-o", "-or", ")"]:
+            if args[0] in ["-a", "-and"]:
+                args.pop(0)
+            children.append(self.parse_expr_unary(args))
+        return self.make_expr_node("and", children)
+
+    def parse_expr_or(self, args: T.List[str]) -> ExprNode:
+        children = [self.parse_expr_and(args)]
+        while args and args[0] in ["-o", "-or"]:
+            args.pop(0)
+            children.append(self.parse_expr_and(args))
+        return self.make_expr_node("or", children)
+
+    def parse_expr_comma(self, args: T.List[str]) -> ExprNode:
+        children = [self.parse_expr_or(args)]
+        while args and args[0] == ",":
+            args.pop(0)
+            children.append(self.parse_expr_or(args))
+        return self.make_expr_node(",", children)
+
+    def parse_expr_tree(self, expr: T.List[str]) -> T.Optional[ExprNode]:
+        """Return a tree for expr (as validated by get_expression()).
+
+        Returns None for an empty expression.
+        """
+        if not expr:
+            return None
+        args = list(expr)
+        try:
+            node = self.parse_expr_comma(args)
+        except (IndexError, FindxSyntaxError):
+            raise FindxInternalError("Invalid expression %s" % repr(expr))
+        if args:
+            raise FindxInternalError("Invalid expression %s" % repr(expr))
+        return node
+
     def or_extend(self, base: T.List[str], extension: T.List[str]) -> None:
         if base and extension:
             base.append("-o")
@@ -1427,6 +3720,10 @@ class Findx:
             self.stdxd = True
         elif arg == "-stdxf":
             self.stdxf = True
+        elif arg == "-stdxm":
+            self.stdxm = True
+        elif arg == "-prune-markers":
+            self.prune_markers = True
         elif arg in ["-e", "-x"]:
             self.parse_include_exclude(self.excludes)
         elif arg == "-i":
@@ -1436,12 +3733,97 @@ class Findx:
                 self.excludes = []
                 self.stdxd = False
                 self.stdxf = False
+                self.stdxm = False
+                self.prune_markers = False
             else:
                 self.parse_include_exclude(self.includes)
         else:
             parsed = False
         return parsed
 
+    def parse_findx_arg_mode(self, arg: str) -> bool:
+        parsed = True
+        if arg == "-git":
+            self.git = True
+            self.native_modes.append(arg)
+        elif arg == "-ignore-files":
+            self.ignore_files = True
+            self.native_modes.append(arg)
+        elif arg == "-bfs":
+            self.bfs = True
+            self.native_modes.append(arg)
+        elif arg == "-heatmap":
+            self.heatmap = True
+            self.native_modes.append(arg)
+        elif arg == "-estimate":
+            self.estimate = True
+            self.native_modes.append(arg)
+        elif arg == "-dupes":
+            self.dupes = True
+            self.native_modes.append(arg)
+        else:
+            parsed = self.parse_findx_arg_run(arg)
+        return parsed
+
+    def parse_findx_arg_run(self, arg: str) -> bool:
+        parsed = True
+        if arg == "-stats":
+            progress = sys.stderr.isatty() and not sys.stdout.isatty()
+            self.stats = Stats(progress)
+            self.report_stats = True
+        elif arg == "-limit":
+            value = self.pop_arg()
+            try:
+                self.limit = int(value)
+            except ValueError:
+                self.limit = 0
+            if self.limit < 1:
+                raise InvalidOptionError(f"{arg} {value}")
+        elif arg == "-first":
+            self.first = True
+        elif arg == "-top":
+            self.parse_top(arg)
+        elif arg == "-du":
+            self.parse_du(arg)
+        elif arg == "-since-last-run":
+            self.since_last_run = self.pop_arg()
+        elif arg == "-cache":
+            self.cache_results = True
+        elif arg == "-no-optimize":
+            self.optimize = False
+        elif arg == "-collapse-roots":
+            self.collapse_roots = True
+        elif arg == "-background":
+            self.background = True
+        else:
+            parsed = False
+        return parsed
+
+    def parse_top(self, arg: str) -> None:
+        value = self.pop_arg()
+        self.top_by = self.pop_arg()
+        try:
+            self.top = int(value)
+        except ValueError:
+            self.top = 0
+        if self.top < 1 or self.top_by not in self.TOP_KEYS:
+            raise InvalidOptionError(f"{arg} {value} {self.top_by}")
+        self.set_report_args([arg, value, self.top_by])
+
+    def parse_du(self, arg: str) -> None:
+        # DEPTH is optional.
+        if self.args and self.args[0].isdigit():
+            self.du = int(self.pop_arg())
+        self.set_report_args([arg, str(self.du)])
+
+    def set_report_args(self, report_args: T.List[str]) -> None:
+        """Select the report ('-top' or '-du') to make of the entries."""
+        if self.report_args and self.report_args[0] != report_args[0]:
+            raise ReportConflictError(
+                report_args[0], repr(self.report_args[0])
+            )
+        self.report_args = report_args
+
     def parse_findx_arg(self, arg: str) -> None:
         if self.parse_findx_arg_show(arg):
             pass
@@ -1449,12 +3831,15 @@ class Findx:
             pass
         elif self.parse_findx_arg_exclude(arg):
             pass
+        elif self.parse_findx_arg_mode(arg):
+            pass
         elif arg == "-root":
             self.roots.append(self.pop_arg())
         elif arg == "-grep":
             grep_tool = self.resolve_path_var("grep_path")
             grep_style = self.resolve_grep_style(grep_tool)
             grep_args = self.get_var(grep_style + "_grep_args")
+            self.grep_tool = grep_tool
             self.push_arg_list([":", grep_tool] + grep_args + ["[", ":"])
         elif arg in self.PRE_PATH_OPTIONS:
             self.push_arg(arg)
@@ -1486,6 +3871,388 @@ class Findx:
             expr = self.distribute_option("-iname", expr)
         return expr
 
+    def cache_path(self) -> str:
+        return os.path.expanduser(self.get_scalar_var("cache_dir"))
+
+    def post_path_int(self, option: str, default: int) -> T.Optional[int]:
+        """Return the value of a numeric post-path option (None if bad)."""
+        value = default
+        args = list(self.post_path_options)
+        while args:
+            option_list = self.take_option_list(args)
+            if option_list[0] == option:
+                try:
+                    value = int(option_list[1])
+                except ValueError:
+                    return None
+        return value
+
+    def name_test_globs(
+        self, node: ExprNode, tests: T.List[str]
+    ) -> T.Optional[NameFilter]:
+        """Return (test, globs) if node ORs together tests of one kind."""
+        test = ""
+        globs = []
+        for term in node.or_terms():
+            if term.op != "test" or term.args[0] not in tests:
+                return None
+            if test and term.args[0] != test:
+                return None
+            test = term.args[0]
+            globs.append(term.args[1])
+        return test, globs
+
+    def type_test_chars(self, node: ExprNode) -> T.Optional[str]:
+        name_filter = self.name_test_globs(node, ["-type"])
+        if name_filter is None:
+            return None
+        type_chars = name_filter[1]
+        if not all(len(c) == 1 for c in type_chars):
+            return None
+        return "".join(type_chars)
+
+    def backend_glob(self, test: str, glob: str) -> T.Optional[str]:
+        """Return glob in '.gitignore' format for a '-name'/'-iname' test."""
+        if test == "-iname":
+            ci_glob = case_insensitive_glob(glob)
+            if ci_glob is None:
+                return None
+            glob = ci_glob
+        return ignore_file_glob(glob)
+
+    def classify_prune_term(
+        self, node: ExprNode
+    ) -> T.Optional[T.Tuple[str, T.List[str]]]:
+        """Return (kind, globs) for an exclusion or inclusion term.
+
+        kind is "any", "dir" (for '-type d'), or "file" (for '-not -type d');
+        globs are in '.gitignore' format.
+        """
+        kind = "any"
+        name_node = None
+        for term in node.and_terms():
+            if term.op == "not":
+                type_chars = self.type_test_chars(term.children[0])
+            else:
+                type_chars = self.type_test_chars(term)
+            if type_chars == "d" and kind == "any":
+                kind = "file" if term.op == "not" else "dir"
+            elif name_node is None:
+                name_node = term
+            else:
+                return None
+        if name_node is None:
+            return None
+        name_filter = self.name_test_globs(name_node, ["-name", "-iname"])
+        if name_filter is None:
+            return None
+        test, globs = name_filter
+        ignore_globs = []
+        for glob in globs:
+            ignore_glob = self.backend_glob(test, glob)
+            if ignore_glob is None:
+                return None
+            ignore_globs.append(ignore_glob)
+        return kind, ignore_globs
+
+    def prune_ignore_lines(self) -> T.Optional[T.List[str]]:
+        """Translate exclusions and inclusions into '.gitignore' lines."""
+        file_lines = []
+        other_lines = []
+        exclude_tree = self.parse_expr_tree(self.excludes)
+        for term in exclude_tree.or_terms() if exclude_tree else []:
+            prune_term = self.classify_prune_term(term)
+            if prune_term is None:
+                return None
+            kind, globs = prune_term
+            for glob in globs:
+                if kind == "file":
+                    # Re-include directories that share the file's name.
+                    file_lines.extend([glob, f"!{glob}/"])
+                elif kind == "dir":
+                    other_lines.append(glob + "/")
+                else:
+                    other_lines.append(glob)
+        include_lines: T.List[str] = []
+        include_tree = self.parse_expr_tree(self.includes)
+        for term in include_tree.or_terms() if include_tree else []:
+            prune_term = self.classify_prune_term(term)
+            if prune_term is None or prune_term[0] == "file":
+                return None
+            kind, globs = prune_term
+            suffix = "/" if kind == "dir" else ""
+            include_lines.extend(f"!{glob}{suffix}" for glob in globs)
+        # The last matching line wins in '.gitignore' files.
+        return file_lines + other_lines + include_lines
+
+    def backend_ignore_file(self, lines: T.List[str]) -> T.List[str]:
+        """Return flags naming an ignore file holding lines (if any).
+
+        The file itself is written by run() just before use.
+        """
+        if not lines:
+            return []
+        text = "".join(line + "\n" for line in lines)
+        data = text.encode("utf-8", "surrogateescape")
+        digest = hashlib.sha1(data).hexdigest()[:16]
+        path = os.path.join(self.cache_path(), f"ignore-{digest}")
+        self.backend_files[path] = data
+        return ["--ignore-file", path]
+
+    def write_backend_files(self) -> None:
+        for path, data in self.backend_files.items():
+            if not os.path.exists(path):
+                atomic_write(path, data)
+
+    def backend_walk_flags(self, for_fd: bool) -> T.Optional[T.List[str]]:
+        """Translate pre- and post-path options into 'fd'/'rg' flags."""
+        flags = []
+        if any(o not in ["-L", "-P"] for o in self.pre_path_options):
+            return None
+        if self.pre_path_options[-1:] == ["-L"]:
+            flags.append("--follow")
+        args = list(self.post_path_options)
+        while args:
+            option_list = self.take_option_list(args)
+            option = option_list[0]
+            if option == "-maxdepth":
+                flags.extend(["--max-depth", option_list[1]])
+            elif option == "-mindepth" and for_fd:
+                flags.extend(["--min-depth", option_list[1]])
+            elif option == "-mindepth":
+                # 'rg' searches only files below its (directory) roots.
+                mindepth = self.post_path_int("-mindepth", 0)
+                if mindepth is None or mindepth > 1:
+                    return None
+            elif option in ["-xdev", "-mount"]:
+                flags.append("--one-file-system")
+            else:
+                return None
+        return flags
+
+    def backend_filters(
+        self,
+    ) -> T.Optional[T.Tuple[T.Optional[str], T.Optional[NameFilter]]]:
+        """Return (type_chars, name_filter) for a translatable expression."""
+        if self.saw_action:
+            return None
+        type_chars = None
+        name_filter = None
+        tree = self.parse_expr_tree(self.expression)
+        for term in tree.and_terms() if tree else []:
+            term_type_chars = self.type_test_chars(term)
+            term_name_filter = self.name_test_globs(term, ["-name", "-iname"])
+            if term_type_chars is not None and type_chars is None:
+                type_chars = term_type_chars
+            elif term_name_filter is not None and name_filter is None:
+                name_filter = term_name_filter
+            else:
+                return None
+        if not all(os.path.isdir(root) for root in self.roots):
+            return None
+        return type_chars, name_filter
+
+    FD_TYPES = {
+        "f": "file",
+        "d": "directory",
+        "l": "symlink",
+        "p": "pipe",
+        "s": "socket",
+    }
+
+    def translate_fd_args(
+        self, fd_tool: str, print0: bool
+    ) -> T.Optional[T.List[str]]:
+        """Return 'fd' arguments equivalent to 'find_pipe_args' (or None)."""
+        if not shutil.which(fd_tool):
+            return None
+        filters = self.backend_filters()
+        walk_flags = self.backend_walk_flags(for_fd=True)
+        prune_lines = self.prune_ignore_lines()
+        if filters is None or walk_flags is None or prune_lines is None:
+            return None
+        type_chars, name_filter = filters
+        if type_chars is None or "d" in type_chars:
+            # 'fd' never prints its roots, but 'find' might.
+            mindepth = self.post_path_int("-mindepth", 0)
+            if mindepth is None or mindepth < 1:
+                return None
+        fd_args = [fd_tool, "--hidden", "--no-ignore", "--color=never"]
+        fd_args.extend(walk_flags)
+        for c in type_chars or "":
+            if c not in self.FD_TYPES:
+                return None
+            fd_args.extend(["--type", self.FD_TYPES[c]])
+        if "--follow" in fd_args and "symlink" in fd_args:
+            # 'find -L -type l' matches only broken symlinks.
+            return None
+        if print0:
+            fd_args.append("--print0")
+        fd_args.extend(self.backend_ignore_file(prune_lines))
+        return fd_args + self.fd_pattern_args(name_filter) + self.roots
+
+    def fd_pattern_args(
+        self, name_filter: T.Optional[NameFilter]
+    ) -> T.List[str]:
+        if name_filter is None:
+            return ["--case-sensitive", "--glob", "--", "*"]
+        test, globs = name_filter
+        if test == "-iname":
+            case_flag = "--ignore-case"
+        else:
+            case_flag = "--case-sensitive"
+        pattern = ",".join(ignore_file_glob(glob) for glob in globs)
+        if len(globs) > 1:
+            pattern = "{" + pattern + "}"
+        return [case_flag, "--glob", "--", pattern]
+
+    GREP_RG_FLAGS = {
+        "-E": "",
+        "-F": "--fixed-strings",
+        "-H": "--with-filename",
+        "-L": "--files-without-match",
+        "-c": "--count --include-zero",
+        "-h": "--no-filename",
+        "-i": "--ignore-case",
+        "-l": "--files-with-matches",
+        "-n": "--line-number",
+        "-o": "--only-matching",
+        "-s": "--no-messages",
+        "-v": "--invert-match",
+        "-w": "--word-regexp",
+        "-x": "--line-regexp",
+    }
+
+    def rg_compatible_pattern(
+        self, pattern: str, fixed: bool, extended: bool
+    ) -> bool:
+        """Return True if pattern means the same to grep and 'rg'."""
+        if fixed:
+            return True
+        # Avoid regex syntax where grep and 'rg' dialects diverge.
+        special = "\\" if extended else "\\+?|(){}"
+        if any(c in special for c in pattern) or pattern.startswith("*"):
+            return False
+        for divergent in ["&&", "--", "~~"]:
+            if divergent in pattern:
+                return False
+        return "[[" not in pattern.replace("[[:", "")
+
+    def split_grep_args(
+        self, args: T.List[str]
+    ) -> T.Optional[T.Tuple[T.List[str], T.List[str]]]:
+        """Return (flags, patterns) for grep arguments with 'rg' analogs."""
+        flags: T.List[str] = []
+        patterns = []
+        positionals = []
+        args = list(args)
+        while args:
+            arg = args.pop(0)
+            if arg == "--":
+                positionals.extend(args)
+                break
+            elif arg == "-e" and args:
+                patterns.append(args.pop(0))
+            elif arg in ["--color=auto", "--color=always", "--color=never"]:
+                flags.append(arg)
+            elif arg.startswith("--"):
+                return None
+            elif arg.startswith("-") and arg != "-":
+                for c in arg[1:]:
+                    if "-" + c not in self.GREP_RG_FLAGS:
+                        return None
+                    flags.append("-" + c)
+            else:
+                positionals.append(arg)
+        if not patterns:
+            patterns, positionals = positionals[:1], positionals[1:]
+        if not patterns or positionals:
+            return None
+        return flags, patterns
+
+    def translate_grep_args(
+        self, args: T.List[str]
+    ) -> T.Optional[T.List[str]]:
+        """Return 'rg' arguments equivalent to grep arguments (or None)."""
+        split_args = self.split_grep_args(args)
+        if split_args is None:
+            return None
+        flags, patterns = split_args
+        if "-c" in flags and "-o" in flags:
+            # grep counts matching lines, but 'rg' counts each match.
+            return None
+        for pattern in patterns:
+            fixed = "-F" in flags
+            if not self.rg_compatible_pattern(pattern, fixed, "-E" in flags):
+                return None
+        rg_args: T.List[str] = []
+        for flag in flags:
+            rg_args.extend(self.GREP_RG_FLAGS.get(flag, flag).split())
+        if "-n" not in flags:
+            rg_args.append("--no-line-number")
+        for pattern in patterns:
+            rg_args.extend(["-e", pattern])
+        return rg_args + ["--"]
+
+    def translate_rg_args(self, rg_tool: str) -> T.Optional[T.List[str]]:
+        """Return 'rg' arguments equivalent to the pipeline (or None)."""
+        if self.grep_tool is None or self.xargs[:1] != [self.grep_tool]:
+            return None
+        if not shutil.which(rg_tool):
+            return None
+        filters = self.backend_filters()
+        walk_flags = self.backend_walk_flags(for_fd=False)
+        prune_lines = self.prune_ignore_lines()
+        grep_args = self.translate_grep_args(self.xargs[1:])
+        if (
+            filters is None
+            or walk_flags is None
+            or prune_lines is None
+            or grep_args is None
+            or self.includes
+        ):
+            return None
+        type_chars, name_filter = filters
+        if type_chars != "f":
+            return None
+        name_lines = []
+        if name_filter is not None:
+            test, globs = name_filter
+            # Ignore all files except those matching the name filter.
+            name_lines = ["*", "!*/"]
+            for glob in globs:
+                ignore_glob = self.backend_glob(test, glob)
+                if ignore_glob is None:
+                    return None
+                name_lines.append("!" + ignore_glob)
+        rg_args = [rg_tool, "--no-config", "--hidden", "--no-ignore"]
+        rg_args.extend(["--no-heading", "--binary"])
+        rg_args.extend(walk_flags)
+        rg_args.extend(self.backend_ignore_file(name_lines + prune_lines))
+        return rg_args + grep_args + self.roots
+
+    def select_backend(self, print0: bool) -> None:
+        self.backend = "find"
+        if self.report_args:
+            # Only 'find' prints the fields.
+            return
+        grep_backend = self.get_choice_var("grep_backend", ["grep", "rg"])
+        if grep_backend == "rg" and self.grep_tool is not None:
+            rg_tool = self.resolve_path_var("rg_path")
+            rg_args = self.translate_rg_args(rg_tool)
+            if rg_args is not None:
+                self.backend = "rg"
+                self.find_pipe_args = rg_args
+                self.xargs_pipe_args = []
+                return
+        find_backend = self.get_choice_var("find_backend", ["find", "fd"])
+        if find_backend == "fd":
+            fd_tool = self.resolve_path_var("fd_path")
+            fd_args = self.translate_fd_args(fd_tool, print0)
+            if fd_args is not None:
+                self.backend = "fd"
+                self.find_pipe_args = fd_args
+
     def parse_findx_args(self, args: T.List[str]) -> None:
         self.args = list(args)
         while self.args:
@@ -1508,49 +4275,310 @@ class Findx:
                 self.need_xarg = True
                 self.locked_in_xargs = True
             else:
-                self.parse_findx_arg(arg)
-        if self.need_xarg:
-            raise MissingXargError()
+                self.parse_findx_arg(arg)
+        if self.need_xarg:
+            raise MissingXargError()
+
+        if self.saw_print and self.xargs:
+            raise PrintWithXargsError()
+
+        if self.xargs:
+            self.check_xargs_allowed()
+
+        if not self.roots:
+            self.roots.append(".")
+
+    def check_xargs_allowed(self) -> None:
+        """Reject XARGS for modes that run no command."""
+        for option, active in [
+            ("-estimate", self.estimate),
+            ("-dupes", self.dupes),
+        ]:
+            if active:
+                raise ReportConflictError(option, "XARGS")
+
+    def prune_args(self) -> T.List[str]:
+        args = []
+        if self.excludes:
+            args.extend(["("] + self.excludes + [")"])
+            if self.includes:
+                args.extend(["!", "("] + self.includes + [")"])
+            args.append("-prune")
+            args.append("-o")
+        return args
+
+    def build_excludes(self) -> T.List[str]:
+        std_excludes: T.List[str] = []
+        if self.stdxd:
+            expr = self.iname_globs(self.get_var("stdxd"))
+            if expr:
+                self.or_extend(std_excludes, ["-type", "d"] + expr)
+        if self.stdxf:
+            expr = self.iname_globs(self.get_var("stdxf"))
+            if expr:
+                self.or_extend(std_excludes, ["-not", "-type", "d"] + expr)
+        if self.stdxm:
+            self.or_extend(std_excludes, self.mount_excludes())
+        if self.prune_markers:
+            self.or_extend(std_excludes, self.marker_excludes())
+        self.or_extend(std_excludes, self.excludes)
+        return self.canonical_excludes(std_excludes)
+
+    def name_test_subsumes(self, node: ExprNode, other: ExprNode) -> bool:
+        """Return True if every name matching other matches node.
+
+        Both must be '-name' or '-iname' tests.
+        """
+        name_tests = ["-name", "-iname"]
+        if node.op != "test" or other.op != "test":
+            return False
+        if node.args[0] not in name_tests or other.args[0] not in name_tests:
+            return False
+        ignore_case = node.args[0] == "-iname"
+        if other.args[0] == "-iname" and not ignore_case:
+            return False
+        return glob_subsumes(node.args[1], other.args[1], ignore_case)
+
+    def canonical_or_children(
+        self, children: T.List[ExprNode], notes: T.List[str]
+    ) -> T.List[ExprNode]:
+        """Return children without duplicates or subsumed name tests."""
+        unique: T.List[ExprNode] = []
+        for child in children:
+            if any(kept.tokens() == child.tokens() for kept in unique):
+                tokens = optionally_quoted_join(child.tokens())
+                notes.append(f"dropped duplicate {tokens}")
+            else:
+                unique.append(child)
+        dropped: T.Set[int] = set()
+        for i, child in enumerate(unique):
+            for j, other in enumerate(unique):
+                if i == j or j in dropped:
+                    continue
+                if not self.name_test_subsumes(other, child):
+                    continue
+                # Of two equivalent tests, keep the first.
+                if j > i and self.name_test_subsumes(child, other):
+                    continue
+                notes.append(
+                    f"dropped {optionally_quoted_join(child.tokens())}"
+                    f" (subsumed by {optionally_quoted_join(other.tokens())})"
+                )
+                dropped.add(i)
+                break
+        return [c for i, c in enumerate(unique) if i not in dropped]
+
+    def canonical_expr_node(
+        self, node: ExprNode, notes: T.List[str]
+    ) -> ExprNode:
+        if node.op == "test":
+            return node
+        children = [
+            self.canonical_expr_node(child, notes) for child in node.children
+        ]
+        if node.op == "or":
+            children = self.canonical_or_children(children, notes)
+        if node.op == "not":
+            return ExprNode(node.op, node.args, children)
+        return self.make_expr_node(node.op, children)
+
+    def canonical_excludes(self, excludes: T.List[str]) -> T.List[str]:
+        """Return excludes without redundant terms or parentheses.
+
+        Notes on what was removed are kept for '-show'.
+        """
+        self.exclude_notes = []
+        node = self.parse_expr_tree(excludes)
+        if node is None:
+            return excludes
+        tokens = self.canonical_expr_node(node, self.exclude_notes).tokens()
+        if tokens != excludes and not self.exclude_notes:
+            self.exclude_notes.append("flattened redundant parentheses")
+        return tokens
+
+    def mount_excludes(self) -> T.List[str]:
+        """Return '-path' tests for mounts below ROOTS of excluded fstypes.
+
+        A ROOT inside such a mount is walked as requested, and mounts below
+        an excluded mount need no test of their own.
+        """
+        fstype_regexes = [
+            glob_regex(glob, False) for glob in self.get_var("stdx_fstypes")
+        ]
+        mount_points = sorted(
+            mount_point
+            for mount_point, fstype in mount_table()
+            if any(regex.fullmatch(fstype) for regex in fstype_regexes)
+        )
+        paths: T.List[str] = []
+        for root in self.roots:
+            real_root = os.path.realpath(root)
+            excluded: T.List[str] = []
+            for mount_point in mount_points:
+                rel_path = os.path.relpath(mount_point, real_root)
+                if rel_path in [".", ".."] or rel_path.startswith("../"):
+                    continue
+                if any(
+                    mount_point.startswith(join_find_path(e, ""))
+                    for e in excluded
+                ):
+                    continue
+                excluded.append(mount_point)
+                path = escape_glob(join_find_path(root, rel_path))
+                if path not in paths:
+                    paths.append(path)
+        tests: T.List[str] = []
+        for path in paths:
+            self.or_extend(tests, ["-path", path])
+        return tests
+
+    def follow_flags(self) -> T.Tuple[bool, bool]:
+        """Return whether symlinks are followed below and at ROOTS.
+
+        As with 'find', the last of '-H', '-L', and '-P' wins.
+        """
+        follow = follow_roots = False
+        for option in self.pre_path_options:
+            if option in ["-H", "-L", "-P"]:
+                follow = option == "-L"
+                follow_roots = option != "-P"
+        return follow, follow_roots
+
+    def collapsed_roots(self) -> T.List[str]:
+        """Return ROOTS without those walked from another ROOT."""
+        follow, follow_roots = self.follow_flags()
+        # Consider shallower ROOTS (and, among duplicates, earlier ones)
+        # first so that each ROOT is tested against ROOTS already kept.
+        real_paths = [walked_path(root, follow_roots) for root in self.roots]
+        order = sorted(
+            range(len(self.roots)), key=lambda i: len(real_paths[i])
+        )
+        stop = self.collapse_stop_test()
+        # A symlinked ROOT is not walked under '-P'.
+        stops = [
+            stop if follow_roots or not os.path.islink(root) else None
+            for root in self.roots
+        ]
+        kept: T.List[int] = []
+        containers: T.Dict[int, int] = {}
+        for i in order:
+            container = None
+            if os.path.lexists(self.roots[i]):
+                container = next(
+                    (
+                        j
+                        for j in kept
+                        if self.root_covers(
+                            self.roots[j],
+                            real_paths[j],
+                            real_paths[i],
+                            follow,
+                            stops[j],
+                        )
+                    ),
+                    None,
+                )
+            if container is None:
+                kept.append(i)
+            else:
+                containers[i] = container
+        for i, container in sorted(containers.items()):
+            warn(
+                f"Dropped ROOT {repr(self.roots[i])}; it is walked from"
+                f" {repr(self.roots[container])}"
+            )
+        return [r for i, r in enumerate(self.roots) if i not in containers]
 
-        if self.saw_print and self.xargs:
-            raise PrintWithXargsError()
+    def collapse_stop_test(self) -> T.Optional[Predicate]:
+        """Return a test for entries a walk does not pass through.
 
-        if not self.roots:
-            self.roots.append(".")
+        Returns None if the results below a ROOT depend on the ROOT.
+        """
+        if (
+            self.git
+            or self.ignore_files
+            or self.post_path_int("-maxdepth", -1) != -1
+            or self.post_path_int("-mindepth", 0) != 0
+        ):
+            return None
+        try:
+            prune = NativeCompiler("-collapse-roots").compile_prune(
+                self.parse_expr_tree(self.excludes),
+                self.parse_expr_tree(self.includes),
+            )
+        except NativeUnsupportedError:
+            return None
+        xdev = any(o in ["-xdev", "-mount"] for o in self.post_path_options)
+
+        def stops_walk(entry: Entry) -> bool:
+            if prune is not None and prune(entry):
+                return True
+            return xdev and not same_device(
+                Entry(entry.root, 0, True).stat(), entry.stat()
+            )
+
+        return stops_walk
+
+    def root_covers(
+        self,
+        container: str,
+        container_path: str,
+        path: str,
+        follow: bool,
+        stop: T.Optional[Predicate],
+    ) -> bool:
+        """Return whether walking container reaches the entry at path.
+
+        container_path is the real path walked from ROOT container.
+        """
+        rel_path = os.path.relpath(path, container_path)
+        if rel_path == ".":
+            return True
+        if rel_path == ".." or rel_path.startswith("../") or stop is None:
+            return False
+        entry_path = container
+        for depth, part in enumerate(rel_path.split("/"), 1):
+            entry_path = join_find_path(entry_path, part)
+            if stop(Entry(entry_path, depth, follow, root=container)):
+                return False
+        return True
+
+    def marker_excludes(self) -> T.List[str]:
+        tests: T.List[str] = []
+        for marker in self.get_var("prune_markers"):
+            self.or_extend(tests, marker_test_args(marker))
+        if len(tests) > len(marker_test_args("")):
+            tests = ["("] + tests + [")"]
+        return ["-type", "d"] + tests if tests else []
 
     def parse_command_line(self, args: T.List[str]) -> None:
-        self.parse_findx_args(args)
+        self.command_args = list(args)
+        with span("parse"):
+            self.parse_findx_args(args)
+        with span("expression"):
+            self.build_pipeline_args()
+
+    def build_pipeline_args(self) -> None:
         find_tool = self.resolve_path_var("find_path")
         find_style = self.resolve_find_style(find_tool)
         have_print_zero = find_style in ["gnu", "bsd"]
+        self.excludes = self.build_excludes()
+        if self.collapse_roots:
+            self.roots = self.collapsed_roots()
         self.find_pipe_args = (
             [find_tool]
             + self.pre_path_options
             + self.roots
             + self.post_path_options
         )
-
-        std_excludes: T.List[str] = []
-        if self.stdxd:
-            expr = self.iname_globs(self.get_var("stdxd"))
-            if expr:
-                self.or_extend(std_excludes, ["-type", "d"] + expr)
-        if self.stdxf:
-            expr = self.iname_globs(self.get_var("stdxf"))
-            if expr:
-                self.or_extend(std_excludes, ["-not", "-type", "d"] + expr)
-        self.or_extend(std_excludes, self.excludes)
-        self.excludes = std_excludes
-
-        if self.excludes:
-            self.find_pipe_args.extend(["("] + self.excludes + [")"])
-            if self.includes:
-                self.find_pipe_args.extend(["!", "("] + self.includes + [")"])
-            self.find_pipe_args.append("-prune")
-            self.find_pipe_args.append("-o")
+        self.find_pipe_args.extend(self.prune_args())
+        if self.expression and self.optimize:
+            self.expression = self.optimize_expression(self.expression)
         if self.expression:
             self.expression.insert(0, "(")
             self.expression.append(")")
+        if self.since_last_run is not None:
+            self.expression.extend(self.since_last_run_test())
         self.find_pipe_args.extend(self.expression)
         need_print = not self.saw_action and (self.xargs or self.excludes)
         print_action = "-print"
@@ -1567,8 +4595,1270 @@ class Findx:
             self.xargs_pipe_args.extend(self.xargs)
         else:
             self.xargs_pipe_args = []
-        if need_print:
+        self.prefer_native_walk()
+        if self.report_args:
+            self.configure_report(find_style)
+        elif need_print:
             self.find_pipe_args.append(print_action)
+        if not self.native_modes:
+            self.select_backend(print_action == "-print0")
+        self.configure_relay()
+
+    def prefer_native_walk(self) -> None:
+        """Walk natively for '-prune-markers' unless 'find' is needed.
+
+        'find' would run one 'test' process per directory and marker.
+        """
+        if not self.prune_markers or self.native_modes:
+            return
+        try:
+            self.native_query()
+        except NativeUnsupportedError:
+            return
+        self.native_modes.append("-prune-markers")
+
+    # '-top' keys: 'find -printf' directive and 'os.stat_result' attribute.
+    TOP_KEYS = {
+        "size": ("%s", "st_size"),
+        "mtime": ("%T@", "st_mtime"),
+        "atime": ("%A@", "st_atime"),
+    }
+
+    # '-du' fields: type, size, blocks, device, inode, links, ROOT, path.
+    DU_PRINTF = r"%y\0%s\0%b\0%D\0%i\0%n\0%H\0%P\0"
+
+    def configure_report(self, find_style: str) -> None:
+        """Make 'find' print fields for '-top' or '-du'.
+
+        Without GNU 'find', findx walks natively instead.
+        """
+        mode = self.report_args[0]
+        if self.saw_action:
+            raise ReportConflictError(mode, "an action in EXPRESSION")
+        # findx ranks or sums every entry itself, bypassing these.
+        for option, given in [
+            ("-limit", self.limit is not None),
+            ("-first", self.first),
+            ("-stats", self.report_stats),
+        ]:
+            if given:
+                raise ReportConflictError(mode, repr(option))
+        if mode == "-du" and self.xargs:
+            raise ReportConflictError(mode, "XARGS")
+        if find_style != "gnu" and not self.native_modes:
+            self.native_modes.append(mode)
+        if self.native_modes:
+            return
+        if mode == "-top":
+            fields = self.TOP_KEYS[self.top_by][0] + r"\0%p\0"
+        else:
+            fields = self.DU_PRINTF
+        self.find_pipe_args.extend(["-printf", fields])
+
+    def configure_relay(self) -> None:
+        """Set up how findx relays paths for '-first' and interactive use.
+
+        Also paces '-background' scans.
+        """
+        if self.background:
+            file_rate = self.get_int_var("background_file_rate", 0)
+            byte_rate = self.get_int_var("background_byte_rate", 0)
+            if file_rate or byte_rate:
+                self.throttle = Throttle(file_rate, byte_rate)
+        if self.first and not self.xargs_pipe_args:
+            # Without a command, the first path (or match) is the output.
+            self.limit = 1
+        elif self.first:
+            self.line_buffer_grep()
+        if self.xargs_pipe_args:
+            interactive = self.get_choice_var(
+                "interactive", ["auto", "yes", "no"]
+            )
+            if interactive == "auto":
+                self.interactive = sys.stdout.isatty()
+            else:
+                self.interactive = interactive == "yes"
+
+    def since_last_run_test(self) -> T.List[str]:
+        """Return a test for entries changed since the last successful run.
+
+        Each KEY and query has a stamp file whose mtime marks the start of
+        the last successful run.
+        """
+        assert self.since_last_run is not None
+        query = (
+            [self.since_last_run]
+            + [os.path.abspath(root) for root in self.roots]
+            + self.pre_path_options
+            + self.post_path_options
+            + self.excludes
+            + self.includes
+            + self.expression
+            + [":"]
+            + self.xargs
+        )
+        data = "\0".join(query).encode("utf-8", "surrogateescape")
+        self.since_last_run_path = os.path.join(
+            self.cache_path(),
+            "since-last-run",
+            hashlib.sha256(data).hexdigest()[:32],
+        )
+        self.since_last_run_start = time.time()
+        if os.path.exists(self.since_last_run_path):
+            return ["-newer", self.since_last_run_path]
+        return []
+
+    def save_since_last_run(self, exit_status: int) -> None:
+        """Advance the '-since-last-run' stamp after a complete success."""
+        if self.since_last_run is None or exit_status or self.stopped_early:
+            return
+        atomic_write(
+            self.since_last_run_path,
+            (self.since_last_run + "\n").encode("utf-8", "surrogateescape"),
+            mtime=self.since_last_run_start,
+        )
+
+    def line_buffer_grep(self) -> None:
+        """Make '-grep' flush each line so '-first' can stop promptly."""
+        if self.grep_tool is None or self.xargs[:1] != [self.grep_tool]:
+            return
+        if self.resolve_grep_style(self.grep_tool) in ["gnu", "bsd"]:
+            i = len(self.xargs_pipe_args) - len(self.xargs) + 1
+            self.xargs_pipe_args.insert(i, "--line-buffered")
+
+    # Tests by relative cost: those needing only the name, those needing
+    # the type (usually known from the directory listing), and those
+    # needing a 'stat()' or more.  Other terms are actions, or options
+    # affecting later terms (e.g., '-daystart'), which must not move.
+    NAME_TESTS = """
+        -name -iname -path -ipath -wholename -iwholename -regex -iregex
+        -true -false
+        """.split()
+    TYPE_TESTS = ["-type"]
+    STAT_TESTS = """
+        -size -empty -perm -user -group -uid -gid -nouser -nogroup -links
+        -inum -samefile -mtime -mmin -atime -amin -ctime -cmin -used
+        -newer -anewer -cnewer -xtype -lname -ilname -fstype
+        -readable -writable -executable
+        """.split()
+
+    def expr_cost(self, node: ExprNode) -> T.Optional[int]:
+        """Return the relative cost of node, or None if it must not move."""
+        if node.op == "test":
+            test = node.args[0]
+            if test in self.NAME_TESTS:
+                return 0
+            elif test in self.TYPE_TESTS:
+                return 1
+            elif test in self.STAT_TESTS or test.startswith("-newer"):
+                return 2
+            return None
+        costs = [self.expr_cost(child) for child in node.children]
+        if None in costs:
+            return None
+        return max(T.cast(T.List[int], costs))
+
+    def optimize_expr_node(self, node: ExprNode) -> ExprNode:
+        """Return node with cheap tests moved first in its AND chains.
+
+        Only runs of adjacent movable terms are reordered (stably), so
+        actions and options keep their place relative to every other term.
+        """
+        if node.op == "test":
+            return node
+        children = [self.optimize_expr_node(child) for child in node.children]
+        if node.op == "and":
+            reordered: T.List[ExprNode] = []
+            # Costs and movable terms of the current run.
+            movable: T.List[T.Tuple[int, ExprNode]] = []
+            for child in children:
+                cost = self.expr_cost(child)
+                if cost is None:
+                    movable.sort(key=lambda term: term[0])
+                    reordered.extend(term[1] for term in movable)
+                    movable = []
+                    reordered.append(child)
+                else:
+                    movable.append((cost, child))
+            movable.sort(key=lambda term: term[0])
+            reordered.extend(term[1] for term in movable)
+            children = reordered
+        return ExprNode(node.op, node.args, children)
+
+    def optimize_expression(self, expression: T.List[str]) -> T.List[str]:
+        """Return expression with cheap tests first, if that changes it."""
+        node = self.parse_expr_tree(expression)
+        assert node is not None
+        tokens = self.optimize_expr_node(node).tokens()
+        if tokens == node.tokens():
+            return expression
+        return tokens
+
+    # Post-path options that don't affect which entries are selected.
+    NATIVE_IGNORED_OPTIONS = """
+        -ignore_readdir_race -noignore_readdir_race -noleaf -nowarn -warn
+        """.split()
+
+    def native_query(self) -> NativeQuery:
+        """Compile the findx command for native evaluation.
+
+        Raises NativeUnsupportedError for anything 'find' alone can do.
+        """
+        mode = self.native_modes[0] if self.native_modes else "findx"
+        follow, follow_roots = self.follow_flags()
+        depths: T.Dict[str, int] = {}
+        args = list(self.post_path_options)
+        while args:
+            option_list = self.take_option_list(args)
+            option = option_list[0]
+            if option in ["-maxdepth", "-mindepth"]:
+                try:
+                    depths[option] = int(option_list[1])
+                except ValueError:
+                    raise InvalidOptionError(" ".join(option_list))
+            elif option not in self.NATIVE_IGNORED_OPTIONS:
+                raise NativeUnsupportedError(option, mode)
+        compiler = NativeCompiler(mode)
+        query = NativeQuery(
+            follow,
+            depths.get("-mindepth", 0),
+            depths.get("-maxdepth"),
+            compiler.compile_prune(
+                self.parse_expr_tree(self.excludes),
+                self.parse_expr_tree(self.includes),
+            ),
+            compiler.compile(self.parse_expr_tree(self.expression)),
+        )
+        query.follow_roots = follow_roots
+        query.compiler = compiler
+        if self.ignore_files:
+            query.ignores = IgnoreMatcher(
+                self.get_var("ignore_files"),
+                os.path.join(self.cache_path(), "ignore-rules.json"),
+            )
+        if self.heatmap:
+            query.heatmap = Heatmap()
+            query.match = query.heatmap.timed(query.match)
+            if query.prune is not None:
+                query.prune = query.heatmap.timed(query.prune)
+        return query
+
+    def native_show_args(self) -> T.List[str]:
+        return (
+            self.pre_path_options
+            + self.post_path_options
+            + self.prune_args()
+            + self.expression
+        )
+
+    GIT_LS_FILES_ARGS = """
+        ls-files -z --cached --others --exclude-standard
+        """.split()
+
+    def git_ls_files_args(self, root: str) -> T.List[str]:
+        git_tool = self.resolve_path_var("git_path")
+        return [git_tool, "-C", root] + self.GIT_LS_FILES_ARGS
+
+    def filter_git_paths(
+        self, root: str, query: NativeQuery, rel_paths: T.Iterable[bytes]
+    ) -> T.Iterator[Entry]:
+        """Yield matching entries for paths relative to root.
+
+        Ancestor directories are evaluated (and yielded if matched) the first
+        time they are seen; pruning a directory drops all paths below it.
+        """
+        dir_pruned: T.Dict[str, bool] = {}
+        for rel_path in rel_paths:
+            parts = os.fsdecode(rel_path).split("/")
+            depth = len(parts)
+            if query.maxdepth is not None:
+                parts = parts[: query.maxdepth + 1]
+            pruned = False
+            for dir_depth in range(len(parts)):
+                rel_dir = "/".join(parts[:dir_depth])
+                if rel_dir not in dir_pruned:
+                    if rel_dir:
+                        path = join_find_path(root, rel_dir)
+                        follow = query.follow
+                    else:
+                        path, follow = root, query.follow_roots
+                    entry = Entry(path, dir_depth, follow, root=root)
+                    dir_pruned[rel_dir] = query.pruned(entry)
+                    if not dir_pruned[rel_dir] and query.matched(entry):
+                        yield entry
+                if dir_pruned[rel_dir]:
+                    pruned = True
+                    break
+            if pruned or query.beyond_maxdepth(depth):
+                continue
+            path = join_find_path(root, "/".join(parts))
+            entry = Entry(path, depth, query.follow, root=root)
+            if not os.path.lexists(entry.path):
+                # Tracked but deleted from the work tree.
+                continue
+            if not query.pruned(entry) and query.matched(entry):
+                yield entry
+
+    def iter_git_entries(self, query: NativeQuery) -> T.Iterator[Entry]:
+        for root in self.roots:
+            git_args = self.git_ls_files_args(root)
+            git_abs_path = must_find_executable(git_args[0])
+            start = time.perf_counter()
+            git_proc = Popen(git_args, stdout=PIPE, executable=git_abs_path)
+            assert git_proc.stdout is not None
+            try:
+                yield from self.filter_git_paths(
+                    root, query, iter_records(git_proc.stdout, b"\0")
+                )
+            finally:
+                git_proc.stdout.close()
+                self.wait_stage(git_proc, "git", start)
+            if git_proc.returncode != 0:
+                raise GitListingError(root, git_proc.returncode)
+
+    def scan_dir(
+        self, entry: Entry, query: NativeQuery, report: bool = True
+    ) -> T.List[Entry]:
+        if query.dirs is not None:
+            # Taken before reading so that concurrent changes are noticed.
+            st = entry.stat()
+            query.dirs[entry.path] = st.st_mtime_ns if st else -1
+        start = time.perf_counter()
+        try:
+            with os.scandir(entry.path) as it:
+                children = [
+                    Entry(
+                        join_find_path(entry.path, d.name),
+                        entry.depth + 1,
+                        query.follow,
+                        d,
+                        entry.root,
+                    )
+                    for d in it
+                ]
+            if query.heatmap is not None:
+                seconds = time.perf_counter() - start
+                query.heatmap.scanned(entry, len(children), seconds)
+            return children
+        except OSError as e:
+            if report:
+                warn(f"{repr(entry.path)}: {e.strerror}")
+                self.walk_errors += 1
+            return []
+
+    DirId = T.Tuple[int, int]
+
+    def descend(
+        self,
+        entry: Entry,
+        ancestors: T.Tuple[DirId, ...],
+        query: NativeQuery,
+        report: bool = True,
+    ) -> T.Optional[T.Tuple[DirId, ...]]:
+        """Return the ancestors of entry's children, or None to not descend.
+
+        With '-L', ancestors holds the ids of the directories above, for
+        loop detection.
+        """
+        if query.beyond_maxdepth(entry.depth + 1) or not entry.is_dir():
+            return None
+        if not query.follow:
+            return ancestors
+        st = entry.stat()
+        dir_id = (st.st_dev, st.st_ino) if st else (0, 0)
+        if dir_id in ancestors:
+            if report:
+                warn(f"File system loop detected: {repr(entry.path)}")
+                self.walk_errors += 1
+            return None
+        return ancestors + (dir_id,)
+
+    def walk_root(self, root: str, query: NativeQuery) -> T.Iterator[Entry]:
+        """Yield matching entries at or below root in 'find' order."""
+        root_entry = Entry(root, 0, query.follow_roots)
+        stack: T.List[T.Tuple[Entry, T.Tuple[Findx.DirId, ...]]] = [
+            (root_entry, ())
+        ]
+        while stack:
+            entry, ancestors = stack.pop()
+            if query.pruned(entry):
+                continue
+            if query.matched(entry):
+                yield entry
+            child_ancestors = self.descend(entry, ancestors, query)
+            if child_ancestors is None:
+                continue
+            children = self.scan_dir(entry, query)
+            stack.extend(
+                (child, child_ancestors) for child in reversed(children)
+            )
+
+    def walk_root_bfs(
+        self, root: str, query: NativeQuery
+    ) -> T.Iterator[Entry]:
+        """Yield matching entries at or below root, shallowest first.
+
+        Directories still to be scanned are queued.  Should the queue
+        outgrow 'bfs_frontier', the remaining levels are walked by
+        iterative deepening, which rescans upper levels but needs memory
+        only in proportion to the depth.
+        """
+        frontier_limit = self.get_int_var("bfs_frontier", 1)
+        root_entry = Entry(root, 0, query.follow_roots)
+        if query.pruned(root_entry):
+            return
+        if query.matched(root_entry):
+            yield root_entry
+        ancestors = self.descend(root_entry, (), query)
+        if ancestors is None:
+            return
+        queue = collections.deque([(root_entry, ancestors)])
+        while queue:
+            if len(queue) > frontier_limit:
+                yield from self.walk_deepening(list(queue), query)
+                return
+            entry, ancestors = queue.popleft()
+            for child in self.scan_dir(entry, query):
+                if query.pruned(child):
+                    continue
+                if query.matched(child):
+                    yield child
+                child_ancestors = self.descend(child, ancestors, query)
+                if child_ancestors is not None:
+                    queue.append((child, child_ancestors))
+
+    def walk_deepening(
+        self,
+        frontier: T.List[T.Tuple[Entry, T.Tuple[DirId, ...]]],
+        query: NativeQuery,
+    ) -> T.Iterator[Entry]:
+        """Yield matching entries below frontier one depth at a time."""
+        target = min(entry.depth for entry, _ in frontier) + 1
+        more = True
+        while more:
+            more = False
+            for top, top_ancestors in frontier:
+                if top.depth >= target:
+                    # Scanned on the next pass.
+                    more = True
+                    continue
+                stack = [(top, top_ancestors)]
+                while stack:
+                    entry, ancestors = stack.pop()
+                    # Problems were reported when first scanned.
+                    first = entry.depth == target - 1
+                    children = self.scan_dir(entry, query, report=first)
+                    if not first:
+                        children.reverse()
+                    for child in children:
+                        if query.pruned(child, revisit=not first):
+                            continue
+                        if first and query.matched(child):
+                            yield child
+                        child_ancestors = self.descend(
+                            child, ancestors, query, report=first
+                        )
+                        if child_ancestors is None:
+                            continue
+                        if first:
+                            more = True
+                        else:
+                            stack.append((child, child_ancestors))
+            target += 1
+
+    # Estimated totals: entries, paths, bytes, and seconds.
+    ESTIMATES = ["entries", "paths", "bytes", "seconds"]
+
+    def estimate_counts(
+        self, entry: Entry, query: NativeQuery
+    ) -> T.List[float]:
+        """Return the ESTIMATES of an entry itself (apart from its scan)."""
+        if not query.matched(entry):
+            return [1, 0, 0, 0]
+        st = entry.stat() if entry.type_char() == "f" else None
+        return [1, 1, st.st_size if st else 0, 0]
+
+    ProbeStep = T.Tuple[T.List[float], T.List[T.Tuple[Entry, T.Any]]]
+
+    def estimate_scan(
+        self,
+        entry: Entry,
+        ancestors: T.Tuple[DirId, ...],
+        query: NativeQuery,
+    ) -> ProbeStep:
+        """Return the ESTIMATES of a directory's entries and its subdirs."""
+        start = time.perf_counter()
+        totals = [0.0, 0.0, 0.0, 0.0]
+        subdirs = []
+        # Each directory is scanned once, so its errors are reported once.
+        for child in self.scan_dir(entry, query):
+            if query.pruned(child):
+                totals[0] += 1
+                continue
+            for i, count in enumerate(self.estimate_counts(child, query)):
+                totals[i] += count
+            child_ancestors = self.descend(child, ancestors, query)
+            if child_ancestors is not None:
+                subdirs.append((child, child_ancestors))
+        totals[3] = time.perf_counter() - start
+        return totals, subdirs
+
+    def estimate_root(
+        self, root: str, query: NativeQuery
+    ) -> T.Tuple[T.List[float], Entry, T.Optional[T.Tuple[DirId, ...]]]:
+        """Return root's own ESTIMATES, its entry, and its descent."""
+        entry = Entry(root, 0, query.follow_roots)
+        if query.pruned(entry):
+            return [1, 0, 0, 0], entry, None
+        counts = self.estimate_counts(entry, query)
+        return counts, entry, self.descend(entry, (), query, report=False)
+
+    def estimate_probe(
+        self,
+        root: str,
+        query: NativeQuery,
+        rng: random.Random,
+        scans: T.Dict[str, ProbeStep],
+        unscanned: T.Set[str],
+    ) -> T.List[float]:
+        """Return one probe's estimate of the ESTIMATES below root.
+
+        Each directory on a random path down from root stands in for all
+        the directories at its depth (Knuth's estimator).  scans holds the
+        directories already scanned, and unscanned those seen but not yet
+        scanned.
+        """
+        totals, entry, ancestors = self.estimate_root(root, query)
+        weight = 1
+        while ancestors is not None:
+            if entry.path not in scans:
+                scans[entry.path] = self.estimate_scan(entry, ancestors, query)
+                unscanned.discard(entry.path)
+                unscanned.update(d.path for d, _ in scans[entry.path][1])
+            counts, subdirs = scans[entry.path]
+            for i, count in enumerate(counts):
+                totals[i] += weight * count
+            if not subdirs:
+                break
+            weight *= len(subdirs)
+            entry, ancestors = rng.choice(subdirs)
+        return totals
+
+    def run_estimate(self) -> int:
+        for d in self.roots:
+            if not os.path.exists(d):
+                raise InvalidRootError(d)
+        query = self.native_query()
+        budget = self.get_int_var("estimate_seconds", 1)
+        rng = random.Random()
+        scans: T.Dict[str, Findx.ProbeStep] = {}
+        unscanned: T.Set[str] = set()
+        # Per ROOT and estimate: probes, sum, and sum of squares.
+        sums = [[[0.0] * 3 for _ in self.ESTIMATES] for _ in self.roots]
+        start = time.perf_counter()
+        probes = 0
+        exhausted = False
+        while not exhausted:
+            for root, root_sums in zip(self.roots, sums):
+                sample = self.estimate_probe(
+                    root, query, rng, scans, unscanned
+                )
+                for value, value_sums in zip(sample, root_sums):
+                    value_sums[0] += 1
+                    value_sums[1] += value
+                    value_sums[2] += value**2
+            probes += 1
+            intervals = self.estimate_intervals(sums)
+            elapsed = time.perf_counter() - start
+            converged = all(w <= 0.01 * m for m, w in intervals)
+            # Every directory scanned: the counts are exact.
+            exhausted = not unscanned
+            if elapsed >= budget or (probes >= 30 and converged):
+                break
+        if exhausted:
+            intervals = [(t, 0.0) for t in self.exact_estimates(query, scans)]
+        self.print_estimates(probes, elapsed, intervals)
+        return min(self.walk_errors, 1)
+
+    def estimate_intervals(
+        self, sums: T.List[T.List[T.List[float]]]
+    ) -> T.List[T.Tuple[float, float]]:
+        """Return the estimate and confidence half-width of each ESTIMATE."""
+        intervals = []
+        for i in range(len(self.ESTIMATES)):
+            means_and_widths = [
+                mean_interval(*root_sums[i]) for root_sums in sums
+            ]
+            # Estimates for each ROOT add up, as do their variances.
+            mean = sum(m for m, _ in means_and_widths)
+            width = sum(w**2 for _, w in means_and_widths) ** 0.5
+            intervals.append((mean, width))
+        return intervals
+
+    def print_estimates(
+        self,
+        probes: int,
+        elapsed: float,
+        intervals: T.List[T.Tuple[float, float]],
+    ) -> None:
+        print(
+            f"estimate: {probes} probes in {elapsed:.2f}s;"
+            " 95% confidence intervals:"
+        )
+        for name, (mean, width) in zip(self.ESTIMATES, intervals):
+            low, high = max(mean - width, 0), mean + width
+            digits = 3 if name == "seconds" else 0
+            print(
+                f"{name:8} {mean:14.{digits}f}"
+                f"  ({low:.{digits}f} to {high:.{digits}f})"
+            )
+
+    def exact_estimates(
+        self, query: NativeQuery, scans: T.Dict[str, ProbeStep]
+    ) -> T.List[float]:
+        """Return the ESTIMATES of fully scanned ROOTS."""
+        totals = [0.0] * len(self.ESTIMATES)
+        counts = [self.estimate_root(root, query)[0] for root in self.roots]
+        counts.extend(counts for counts, _ in scans.values())
+        for root_counts in counts:
+            for i, count in enumerate(root_counts):
+                totals[i] += count
+        return totals
+
+    # A group of files: size, digest, and (path, inode) of each file.
+    DupeGroup = T.Tuple[int, str, T.List[T.Tuple[str, DirId]]]
+
+    def refine_dupes(
+        self,
+        pool: concurrent.futures.Executor,
+        groups: T.List[DupeGroup],
+        partial: bool,
+    ) -> T.List[DupeGroup]:
+        """Split groups by file digest, dropping files left on their own."""
+        digests: T.Dict[Findx.DirId, "concurrent.futures.Future[str]"] = {}
+        refined = []
+        hashed = []
+        for group in groups:
+            size, _, files = group
+            if not partial and size <= 2 * DUPES_CHUNK_BYTES:
+                # Hashed in full already.
+                refined.append(group)
+                continue
+            hashed.append(group)
+            for path, inode in files:
+                if inode not in digests:
+                    digests[inode] = pool.submit(
+                        file_digest, path, size, partial
+                    )
+        for size, _, files in hashed:
+            by_digest: T.Dict[str, T.List[T.Tuple[str, Findx.DirId]]] = {}
+            for path, inode in files:
+                try:
+                    digest = digests[inode].result()
+                except OSError as e:
+                    warn(f"{repr(path)}: {e.strerror}")
+                    self.walk_errors += 1
+                    continue
+                by_digest.setdefault(digest, []).append((path, inode))
+            refined.extend(
+                (size, digest, same)
+                for digest, same in by_digest.items()
+                if len(same) > 1
+            )
+        return refined
+
+    def run_dupes(self) -> int:
+        for d in self.roots:
+            if not os.path.exists(d):
+                raise InvalidRootError(d)
+        groups = self.dupe_candidates(self.iter_native_entries())
+        jobs = self.get_int_var("dupes_jobs", 0) or os.cpu_count() or 1
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            groups = self.refine_dupes(pool, groups, partial=True)
+            groups = self.refine_dupes(pool, groups, partial=False)
+        groups.sort(key=lambda group: (-group[0], min(group[2])))
+        for size, digest, files in groups:
+            paths = sorted(path for path, _ in files)
+            record = {"size": size, "hash": digest, "paths": paths}
+            if not write_stdout(json.dumps(record).encode() + b"\n"):
+                break
+        return min(self.walk_errors, 1)
+
+    def dupe_candidates(self, entries: T.Iterable[Entry]) -> T.List[DupeGroup]:
+        """Group nonempty files by size, keeping sizes shared by files."""
+        # One path per inode, as hard links are not duplicates.
+        paths: T.Dict[Findx.DirId, str] = {}
+        sizes: T.Dict[Findx.DirId, int] = {}
+        for entry in entries:
+            st = entry.stat() if entry.type_char() == "f" else None
+            if st is not None and st.st_size > 0:
+                inode = (st.st_dev, st.st_ino)
+                if inode not in paths or entry.path < paths[inode]:
+                    paths[inode] = entry.path
+                sizes[inode] = st.st_size
+        by_size: T.Dict[int, T.List[T.Tuple[str, Findx.DirId]]] = {}
+        for inode, size in sizes.items():
+            by_size.setdefault(size, []).append((paths[inode], inode))
+        return [
+            (size, "", files)
+            for size, files in by_size.items()
+            if len(files) > 1
+        ]
+
+    def iter_walk_entries(self, query: NativeQuery) -> T.Iterator[Entry]:
+        walk = self.walk_root_bfs if self.bfs else self.walk_root
+        for root in self.roots:
+            yield from walk(root, query)
+
+    def write_entries(
+        self, stream: T.IO[bytes], entries: T.Iterable[Entry], separator: bytes
+    ) -> None:
+        for entry in entries:
+            data = os.fsencode(entry.path) + separator
+            stream.write(data)
+            if self.stats is not None:
+                self.stats.count(len(data))
+        stream.flush()
+
+    def wait_stage(
+        self, proc: "Popen[bytes]", stage: str, start: float
+    ) -> int:
+        if self.stats is None:
+            return proc.wait()
+        return self.stats.wait(proc, stage, start)
+
+    def relays_pipeline(self) -> bool:
+        """Return True if findx must relay paths between stages."""
+        return (
+            self.limit is not None
+            or self.first
+            or self.interactive
+            or self.throttle is not None
+        )
+
+    def limit_records(self, records: T.Iterable[bytes]) -> T.Iterator[bytes]:
+        """Yield at most 'limit' records, noting whether any were left."""
+        if self.limit is None:
+            yield from records
+            return
+        for count, record in enumerate(records, 1):
+            yield record
+            if count >= self.limit:
+                self.stopped_early = True
+                return
+
+    def limit_entries(self, entries: T.Iterable[Entry]) -> T.Iterator[Entry]:
+        """Yield at most 'limit' entries, noting if the walk was cut short."""
+        if self.limit is None:
+            yield from entries
+            return
+        for count, entry in enumerate(entries, 1):
+            yield entry
+            if count >= self.limit:
+                self.stopped_early = True
+                return
+
+    def paced_records(self, records: T.Iterable[bytes]) -> T.Iterator[bytes]:
+        """Yield records, pacing them for '-background' if requested."""
+        for record in records:
+            if self.throttle is not None:
+                self.throttle.pace(record)
+            yield record
+
+    def paced_entries(self, entries: T.Iterable[Entry]) -> T.Iterator[Entry]:
+        """Yield entries, pacing them for '-background' if requested."""
+        for entry in entries:
+            if self.throttle is not None:
+                self.throttle.pace(entry.path)
+            yield entry
+
+    def run_batches(self, records: T.Iterable[bytes]) -> int:
+        """Run XARGS via a BatchRunner, returning the 'xargs' status."""
+        runner = BatchRunner(
+            self.xargs_pipe_args,
+            self.stats,
+            first=self.first,
+            grow=self.first or self.interactive,
+        )
+        for record in self.limit_records(records):
+            if not runner.add(record):
+                break
+            if self.stats is not None:
+                self.stats.count(len(record) + 1)
+        status = runner.close()
+        if runner.matched:
+            self.stopped_early = True
+        return status
+
+    def write_records(
+        self, records: T.Iterable[bytes], separator: bytes
+    ) -> None:
+        """Write records to stdout, stopping quietly if it is closed."""
+        for record in self.limit_records(records):
+            if not write_stdout(record + separator):
+                self.stopped_early = True
+                break
+            if self.stats is not None:
+                self.stats.count(len(record) + 1)
+
+    def pipe_entries_to_xargs(self, entries: T.Iterable[Entry]) -> int:
+        xargs_abs_path = must_find_executable(self.xargs_pipe_args[0])
+        if self.xargs_pipe_args[1:2] == ["-0"]:
+            separator = b"\0"
+        else:
+            separator = b"\n"
+        start = time.perf_counter()
+        xargs_proc = Popen(
+            self.xargs_pipe_args, stdin=PIPE, executable=xargs_abs_path
+        )
+        assert xargs_proc.stdin is not None
+        try:
+            self.write_entries(xargs_proc.stdin, entries, separator)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                xargs_proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            self.wait_stage(xargs_proc, "xargs", start)
+        return xargs_proc.returncode
+
+    def run_native_pipeline(self, entries: T.Iterable[Entry]) -> int:
+        """Run the pipeline with findx itself producing the entries."""
+        entries = self.limit_entries(entries)
+        if self.throttle is not None:
+            entries = self.paced_entries(entries)
+        if not self.xargs_pipe_args:
+            try:
+                self.write_entries(sys.stdout.buffer, entries, b"\n")
+            except BrokenPipeError:
+                # Behave like 'find' killed by SIGPIPE.
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                self.pipe_status = (128 + signal.SIGPIPE,)
+                return 128 + signal.SIGPIPE
+            find_status = min(self.walk_errors, 1)
+            self.pipe_status = (find_status,)
+            return merge_find_xargs_status(find_status, 0)
+        if self.relays_pipeline():
+            records = (os.fsencode(entry.path) for entry in entries)
+            xargs_status = self.run_batches(records)
+        else:
+            xargs_status = self.pipe_entries_to_xargs(entries)
+        find_status = min(self.walk_errors, 1)
+        self.pipe_status = (find_status, xargs_status)
+        return merge_find_xargs_status(find_status, xargs_status)
+
+    def show_command(self) -> None:
+        if self.native_modes:
+            # Reject what the native walk cannot run, as running would.
+            self.native_query()
+        if self.git:
+            stages = [
+                " ".join(self.git_ls_files_args(root)) for root in self.roots
+            ]
+            s = " | filter ".join(
+                [" ; ".join(stages), " ".join(self.native_show_args())]
+            )
+        elif self.native_modes:
+            walk_args = ["walk"] + self.native_modes + self.roots
+            s = "%s | filter %s" % (
+                " ".join(walk_args),
+                " ".join(self.native_show_args()),
+            )
+        else:
+            s = " ".join(self.find_pipe_args)
+        if self.report_args:
+            s += " | " + " ".join(self.report_args)
+        if self.xargs_pipe_args:
+            s += " | " + " ".join(self.xargs_pipe_args)
+        print(s)
+        for note in self.exclude_notes:
+            print(f"# excludes: {note}")
+
+    def relay_output(
+        self, stream: T.IO[bytes], out: T.IO[bytes], separator: bytes
+    ) -> None:
+        """Copy 'find' output to out, counting records for '-stats'."""
+        assert self.stats is not None
+        while True:
+            chunk = stream.read1(65536)  # type: ignore[attr-defined]
+            if not chunk:
+                break
+            out.write(chunk)
+            out.flush()
+            self.stats.count(len(chunk), chunk.count(separator))
+
+    def run_find_relay(self) -> T.Tuple[int, int]:
+        """Run 'find' with findx relaying its output.
+
+        Used for '-limit', '-first', interactive XARGS, and paced
+        '-background' scans; once findx stops reading early, 'find' is
+        terminated and its resulting status ignored.
+        """
+        find_abs_path = must_find_executable(self.find_pipe_args[0])
+        self.write_backend_files()
+        start = time.perf_counter()
+        find_proc = Popen(
+            self.find_pipe_args, stdout=PIPE, executable=find_abs_path
+        )
+        assert find_proc.stdout is not None
+        xargs_status = 0
+        self.stopped_early = False
+        try:
+            if self.xargs_pipe_args:
+                if self.xargs_pipe_args[1:2] == ["-0"]:
+                    separator = b"\0"
+                else:
+                    separator = b"\n"
+                records = iter_records(find_proc.stdout, separator)
+                xargs_status = self.run_batches(self.paced_records(records))
+            else:
+                if "-print0" in self.find_pipe_args:
+                    separator = b"\0"
+                else:
+                    separator = b"\n"
+                records = iter_records(find_proc.stdout, separator)
+                self.write_records(self.paced_records(records), separator)
+        finally:
+            if self.stopped_early and find_proc.poll() is None:
+                find_proc.terminate()
+            find_proc.stdout.close()
+            find_status = self.wait_stage(find_proc, self.backend, start)
+        if self.stopped_early and find_status < 0:
+            find_status = 0
+        return find_status, xargs_status
+
+    def iter_printf_fields(self, count: int) -> T.Iterator[T.List[bytes]]:
+        """Run 'find', yielding the count fields printed for each entry."""
+        find_abs_path = must_find_executable(self.find_pipe_args[0])
+        find_proc = Popen(
+            self.find_pipe_args, stdout=PIPE, executable=find_abs_path
+        )
+        assert find_proc.stdout is not None
+        try:
+            records = iter_records(find_proc.stdout, b"\0")
+            fields = list(itertools.islice(records, count))
+            while len(fields) == count:
+                yield fields
+                fields = list(itertools.islice(records, count))
+        finally:
+            find_proc.stdout.close()
+            self.pipe_status = (find_proc.wait(),)
+
+    def iter_native_entries(self) -> T.Iterator[Entry]:
+        query = self.native_query()
+        if self.git:
+            yield from self.iter_git_entries(query)
+        else:
+            yield from self.iter_walk_entries(query)
+        self.pipe_status = (min(self.walk_errors, 1),)
+
+    def iter_top_keys(self) -> T.Iterator[T.Tuple[float, str]]:
+        """Yield the '-top' key and path of each entry found."""
+        if not self.native_modes:
+            for key, path in self.iter_printf_fields(2):
+                yield float(key), os.fsdecode(path)
+            return
+        attribute = self.TOP_KEYS[self.top_by][1]
+        for entry in self.iter_native_entries():
+            st = entry.stat()
+            if st is not None:
+                yield getattr(st, attribute), entry.path
+
+    # An entry's type, apparent and allocated bytes, inode, links, ROOT,
+    # and path components below ROOT.
+    DuRecord = T.Tuple[str, int, int, DirId, int, str, T.List[str]]
+
+    def iter_du_records(self) -> T.Iterator[DuRecord]:
+        if not self.native_modes:
+            for fields in self.iter_printf_fields(8):
+                type_char, size, blocks, dev, ino, links = (
+                    os.fsdecode(field) for field in fields[:6]
+                )
+                rel_path = os.fsdecode(fields[7])
+                yield (
+                    type_char,
+                    int(size),
+                    int(blocks) * 512,
+                    (int(dev), int(ino)),
+                    int(links),
+                    os.fsdecode(fields[6]),
+                    rel_path.split("/") if rel_path else [],
+                )
+            return
+        for entry in self.iter_native_entries():
+            st = entry.stat()
+            if st is not None:
+                yield (
+                    entry.type_char(),
+                    st.st_size,
+                    st.st_blocks * 512,
+                    (st.st_dev, st.st_ino),
+                    st.st_nlink,
+                    entry.root,
+                    entry.rel_parts(),
+                )
+
+    def run_du(self) -> int:
+        """Run the query for '-du', summing sizes per directory."""
+        # (ROOT, path components) -> [allocated bytes, apparent bytes].
+        totals: T.Dict[T.Tuple[str, T.Tuple[str, ...]], T.List[int]] = {}
+        linked: T.Set[Findx.DirId] = set()
+        for record in self.iter_du_records():
+            type_char, size, allocated, inode, links, root, parts = record
+            if links > 1 and type_char != "d":
+                if inode in linked:
+                    continue
+                linked.add(inode)
+            # Sizes count toward the directories holding the entry, and
+            # toward the entry itself if it is a directory.
+            depth = len(parts) if type_char == "d" else len(parts) - 1
+            for i in range(min(max(depth, 0), self.du) + 1):
+                key = (root, tuple(parts[:i]))
+                dir_totals = totals.setdefault(key, [0, 0])
+                dir_totals[0] += allocated
+                dir_totals[1] += size
+        assert self.pipe_status is not None
+        rows = sorted(totals.items(), key=lambda item: (-item[1][0], item[0]))
+        for (root, dir_parts), (allocated, size) in rows:
+            if dir_parts:
+                path = join_find_path(root, "/".join(dir_parts))
+            else:
+                path = root
+            if not write_stdout(os.fsencode(f"{allocated} {size} {path}\n")):
+                break
+        return merge_find_xargs_status(self.pipe_status[0], 0)
+
+    def run_top(self) -> int:
+        """Run the query for '-top', keeping only the best N entries."""
+        assert self.top is not None
+        # heapq.nlargest() holds just N entries at a time.
+        top = heapq.nlargest(
+            self.top, self.iter_top_keys(), key=lambda item: item[0]
+        )
+        assert self.pipe_status is not None
+        find_status = self.pipe_status[0]
+        if self.xargs_pipe_args:
+            xargs_status = self.pipe_entries_to_xargs(
+                Entry(path, 0, False) for _, path in top
+            )
+            self.pipe_status = (find_status, xargs_status)
+            return merge_find_xargs_status(find_status, xargs_status)
+        for key, path in top:
+            if self.top_by == "size":
+                text = str(int(key))
+            else:
+                text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(key))
+            if not write_stdout(os.fsencode(f"{text} {path}\n")):
+                break
+        return merge_find_xargs_status(find_status, 0)
+
+    def run_find_pipe(self) -> T.Tuple[int, int]:
+        find_abs_path = must_find_executable(self.find_pipe_args[0])
+        self.write_backend_files()
+        start = time.perf_counter()
+        counting = self.stats is not None and self.stats.counting
+        if not self.xargs_pipe_args and not counting:
+            find_proc = Popen(self.find_pipe_args, executable=find_abs_path)
+            return self.wait_stage(find_proc, self.backend, start), 0
+        find_proc = Popen(
+            self.find_pipe_args, stdout=PIPE, executable=find_abs_path
+        )
+        if not self.xargs_pipe_args:
+            self.pass_through(find_proc, sys.stdout.buffer)
+            return self.wait_stage(find_proc, self.backend, start), 0
+        xargs_abs_path = must_find_executable(self.xargs_pipe_args[0])
+        if not counting:
+            xargs_proc = Popen(
+                self.xargs_pipe_args,
+                stdin=find_proc.stdout,
+                executable=xargs_abs_path,
+            )
+        else:
+            xargs_proc = Popen(
+                self.xargs_pipe_args, stdin=PIPE, executable=xargs_abs_path
+            )
+            assert xargs_proc.stdin is not None
+            self.pass_through(find_proc, xargs_proc.stdin)
+        find_status = self.wait_stage(find_proc, self.backend, start)
+        xargs_status = self.wait_stage(xargs_proc, "xargs", start)
+        return find_status, xargs_status
+
+    def pass_through(
+        self, find_proc: "Popen[bytes]", out: T.IO[bytes]
+    ) -> None:
+        """Copy 'find' output to out unchanged, counting it for '-stats'.
+
+        Closing out lets the next stage see end of input; if it stops
+        reading early, 'find' meets a broken pipe as it would without
+        findx in between.
+        """
+        assert find_proc.stdout is not None
+        if self.xargs_pipe_args[1:2] == ["-0"]:
+            separator = b"\0"
+        elif not self.xargs_pipe_args and "-print0" in self.find_pipe_args:
+            separator = b"\0"
+        else:
+            separator = b"\n"
+        try:
+            self.relay_output(find_proc.stdout, out, separator)
+        except BrokenPipeError:
+            if out is sys.stdout.buffer:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
+        finally:
+            find_proc.stdout.close()
+            if out is not sys.stdout.buffer:
+                try:
+                    out.close()
+                except BrokenPipeError:
+                    pass
+
+    def run_find_pipeline(self) -> int:
+        if self.relays_pipeline():
+            find_status, xargs_status = self.run_find_relay()
+        else:
+            find_status, xargs_status = self.run_find_pipe()
+        if self.xargs_pipe_args:
+            self.pipe_status = (find_status, xargs_status)
+            return merge_find_xargs_status(find_status, xargs_status)
+        self.pipe_status = (find_status,)
+        if self.backend == "rg":
+            return merge_find_xargs_status(
+                0, rg_status_as_xargs_status(find_status)
+            )
+        return merge_find_xargs_status(find_status, 0)
+
+    def cacheable_query(self) -> T.Optional[NativeQuery]:
+        """Return the query compiled for '-cache', or None if uncacheable.
+
+        Results may be cached only if they depend on nothing but the names
+        and types of entries, whose changes show in directory mtimes.
+        """
+        if self.git or self.ignore_files or self.heatmap or self.report_args:
+            return None
+        if self.prune_markers:
+            # Pruned directories are never read, so their mtimes (and any
+            # removal of their marker) go unrecorded.
+            return None
+        if any(self.follow_flags()):
+            # Changes behind a symlink leave the recorded mtimes alone.
+            return None
+        terms = self.excludes + self.includes + self.expression
+        if "-newer" in terms:
+            return None
+        try:
+            return self.native_query()
+        except NativeUnsupportedError:
+            return None
+
+    def result_cache_key(self) -> str:
+        query = (
+            [os.getcwd()]
+            + self.native_modes
+            + self.roots
+            + self.native_show_args()
+        )
+        data = json.dumps(query).encode("utf-8", "surrogateescape")
+        return hashlib.sha256(data).hexdigest()[:32]
+
+    def run_cached_pipeline(self, query: NativeQuery) -> int:
+        """Run the pipeline from cached results or a recorded native walk."""
+        cache = ResultCache(
+            os.path.join(self.cache_path(), "results"),
+            self.get_int_var("result_cache_bytes", 0),
+        )
+        key = self.result_cache_key()
+        paths = cache.load(key)
+        if paths is not None:
+            return self.run_native_pipeline(
+                Entry(path, 0, False) for path in paths
+            )
+        query.dirs = {}
+        started_ns = time.time_ns()
+        for root in self.roots:
+            st = Entry(root, 0, query.follow_roots).stat()
+            query.dirs[root] = st.st_mtime_ns if st else -1
+        paths = []
+        complete = False
+
+        def recorded_entries() -> T.Iterator[Entry]:
+            nonlocal complete
+            for entry in self.iter_walk_entries(query):
+                paths.append(entry.path)
+                yield entry
+            complete = True
+
+        try:
+            status = self.run_native_pipeline(recorded_entries())
+        finally:
+            if self.stats is not None:
+                self.stats.visited = query.visited
+        if complete and not self.walk_errors:
+            cache.save(key, query.dirs, paths, started_ns)
+        return status
+
+    def run_pipeline(self) -> int:
+        for d in self.roots:
+            if not os.path.exists(d):
+                raise InvalidRootError(d)
+        if self.background:
+            set_background_priority()
+        if self.cache_results:
+            query = self.cacheable_query()
+            if query is not None:
+                return self.run_cached_pipeline(query)
+        if self.top is not None:
+            return self.run_top()
+        if self.report_args:
+            return self.run_du()
+        if not self.native_modes:
+            return self.run_find_pipeline()
+        query = self.native_query()
+        if self.git:
+            entries = self.iter_git_entries(query)
+        else:
+            entries = self.iter_walk_entries(query)
+        if query.heatmap is not None:
+            entries = query.heatmap.counted(entries)
+        try:
+            return self.run_native_pipeline(entries)
+        finally:
+            self.finish_native_query(query)
+
+    def finish_native_query(self, query: NativeQuery) -> None:
+        """Save and report what a native walk gathered."""
+        if query.ignores is not None:
+            query.ignores.save()
+        if self.stats is not None:
+            self.stats.visited = query.visited
+            if self.prune_markers and query.compiler is not None:
+                self.stats.marked_dirs = query.compiler.marked_dirs
+        if query.heatmap is not None:
+            query.heatmap.report(
+                self.get_int_var("heatmap_top", 1),
+                self.get_choice_var("heatmap_format", ["table", "config"])
+                == "config",
+            )
+
+    def run_pipeline_with_stats(self, stats: Stats) -> int:
+        start = time.perf_counter()
+        user, sys_ = cpu_times()
+        try:
+            return self.run_pipeline()
+        finally:
+            end_user, end_sys = cpu_times()
+            wall = time.perf_counter() - start
+            stats.add_stage(
+                project_name, wall, end_user - user, end_sys - sys_
+            )
+            parse = max(self.parse_seconds - self.probe_seconds, 0.0)
+            stats.phases["parse"] = parse
+            stats.phases["probe"] = self.probe_seconds
+            stats.phases["run"] = wall
+            if self.report_stats:
+                stats.report()
 
     def run(self) -> int:
         self.pipe_status = None
@@ -1582,53 +5872,480 @@ class Findx:
             )
         elif self.show_readme:
             readme()
+        elif self.show and self.get_var("batch"):
+            self.show_batch(self.load_batch(self.get_scalar_var("batch")))
         elif self.show:
-            s = " ".join(self.find_pipe_args)
-            if self.xargs_pipe_args:
-                s += " | " + " ".join(self.xargs_pipe_args)
-            print(s)
-        elif not self.shown:
-            for d in self.roots:
+            self.show_command()
+        elif self.shown:
+            pass
+        else:
+            exit_status = self.run_query()
+        return exit_status
+
+    def runs_query(self) -> bool:
+        """Return True unless findx only shows help, a command, etc."""
+        return not (
+            self.show_help
+            or self.show_version
+            or self.show_readme
+            or self.show
+            or self.shown
+        )
+
+    def run_query(self) -> int:
+        exit_status = 0
+        if self.estimate:
+            exit_status = self.run_estimate()
+        elif self.dupes:
+            exit_status = self.run_dupes()
+        elif self.get_var("replay"):
+            exit_status = self.run_replay(self.get_scalar_var("replay"))
+        elif self.get_var("batch"):
+            with span("batch"):
+                exit_status = self.run_batch(self.get_scalar_var("batch"))
+        elif (
+            self.stats is not None
+            or self.get_var("metrics_file")
+            or self.get_var("record")
+        ):
+            if self.stats is None:
+                # Only a record needs paths counted.
+                counting = bool(self.get_var("record"))
+                self.stats = Stats(progress=False, counting=counting)
+            with span("pipeline"):
+                exit_status = self.run_pipeline_with_stats(self.stats)
+            if self.get_var("record"):
+                self.write_record(self.get_scalar_var("record"), exit_status)
+            self.save_since_last_run(exit_status)
+        else:
+            with span("pipeline"):
+                exit_status = self.run_pipeline()
+            self.save_since_last_run(exit_status)
+        return exit_status
+
+    def help(self) -> None:
+        print(HELP_TEXT)
+
+    def tree_shape(self) -> TreeShape:
+        """Walk ROOTS natively, returning the shape of the traversed tree."""
+        shape = TreeShape()
+        compiler = NativeCompiler("--record")
+        try:
+            prune = compiler.compile_prune(
+                self.parse_expr_tree(self.excludes),
+                self.parse_expr_tree(self.includes),
+            )
+        except NativeUnsupportedError:
+            prune = None
+
+        def record_prune(entry: Entry) -> bool:
+            if prune is None or not prune(entry):
+                return False
+            if entry.is_dir():
+                histogram_add(shape.pruned_names, entry.name)
+            return True
+
+        follow, follow_roots = self.follow_flags()
+        query = NativeQuery(
+            follow,
+            0,
+            self.post_path_int("-maxdepth", -1),
+            record_prune,
+            lambda entry: True,
+        )
+        if query.maxdepth == -1:
+            query.maxdepth = None
+        query.follow_roots = follow_roots
+        for entry in self.iter_walk_entries(query):
+            shape.add(entry)
+        return shape
+
+    def write_record(self, path: str, exit_status: int) -> None:
+        """Write the '--record' file describing this run."""
+        assert self.stats is not None
+        record = {
+            "args": self.command_args,
+            "stats": self.stats.as_dict(),
+            "pipe_status": self.pipe_status,
+            "exit_status": exit_status,
+            "shape": self.tree_shape().as_dict(),
+        }
+        data = json.dumps(record, indent=1).encode("utf-8", "surrogateescape")
+        try:
+            atomic_write(os.path.expanduser(path), data)
+        except OSError as e:
+            warn(f"Cannot write {repr(path)}: {e.strerror}")
+
+    def load_record(self, path: str) -> T.Dict[str, T.Any]:
+        try:
+            with open(os.path.expanduser(path), "rb") as f:
+                text = f.read().decode("utf-8", "surrogateescape")
+            record = json.loads(text)
+            if not isinstance(record, dict):
+                raise ValueError("not a JSON object")
+            if not isinstance(record["args"], list) or not all(
+                isinstance(arg, str) for arg in record["args"]
+            ):
+                raise ValueError("'args' is not a list of strings")
+            record["shape"] = TreeShape.from_dict(record["shape"])
+            record["stats"] = Stats.from_dict(record["stats"])
+        except OSError as e:
+            raise InvalidRecordError(path, e.strerror or str(e))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise InvalidRecordError(path, f"malformed record ({e})")
+        return record
+
+    # Variables that recorded arguments may set: those shaping the query,
+    # plus those only the recording run itself consulted.
+    REPLAY_VARS = """
+        find_backend grep_backend ignore_files bfs_frontier stdx_fstypes
+        prune_markers interactive background_file_rate background_byte_rate
+        result_cache_bytes stdxd stdxf record metrics_file profile
+        """.split()
+
+    # Options that run commands or name files to read or write.
+    REPLAY_UNSAFE_OPTIONS = """
+        -delete -fls -fprint -fprint0 -fprintf --files0-from -files0-from
+        """.split()
+    REPLAY_UNSAFE_OPTIONS.extend(ACTIONS_VAR)
+
+    def replay_findx(self, path: str, args: T.List[str]) -> "Findx":
+        """Return a Findx parsed from recorded args, if safe to replay."""
+        f = Findx()
+        f.config = self.config.copy()
+        f.probed_styles = self.probed_styles
+        f.tools = self.tools
+        try:
+            f.parse_findx_args(args)
+        except FindxError as e:
+            raise InvalidRecordError(path, str(e))
+        for var in VALID_VARS:
+            if var in self.REPLAY_VARS:
+                continue
+            if f.config.get(var) != self.config.get(var):
+                raise InvalidRecordError(path, f"sets {repr(var)}")
+        terms = (
+            f.pre_path_options
+            + f.post_path_options
+            + f.excludes
+            + f.includes
+            + f.expression
+        )
+        for term in terms:
+            if term in self.REPLAY_UNSAFE_OPTIONS:
+                raise InvalidRecordError(path, f"uses {repr(term)}")
+        if f.native_modes:
+            modes = " ".join(f.native_modes)
+            raise InvalidRecordError(path, f"native mode {modes}")
+        if f.xargs and (f.grep_tool is None or f.xargs[0] != f.grep_tool):
+            warn(f"replay: not running XARGS {repr(' '.join(f.xargs))}")
+            f.xargs = []
+        return f
+
+    def run_replay(self, path: str) -> int:
+        """Rerun a recorded workload on a synthetic tree."""
+        record = self.load_record(path)
+        f = self.replay_findx(path, record["args"])
+        tmp_dir = tempfile.mkdtemp(prefix=f"{project_name}-replay-")
+        try:
+            f.config.set("cache_dir", "=", [os.path.join(tmp_dir, "cache")])
+            roots = []
+            for i in range(len(f.roots)):
+                root = os.path.join(tmp_dir, f"root{i}")
+                os.mkdir(root)
+                roots.append(root)
+            record["shape"].synthesize(roots)
+            f.roots = roots
+            f.build_pipeline_args()
+            f.stats = self.stats = Stats(progress=False)
+            f.report_stats = True
+            warn(f"replay: recorded run of {repr(path)}:")
+            record["stats"].report()
+            warn("replay: synthetic run:")
+            with stdout_redirected(os.devnull):
+                return f.run_pipeline_with_stats(f.stats)
+        finally:
+            self.pipe_status = f.pipe_status
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def batch_findx(self) -> "Findx":
+        """Return a Findx sharing this one's settings and probe results."""
+        f = Findx()
+        f.config = self.config.copy()
+        f.config.set("batch", "=", [])
+        f.probed_styles = self.probed_styles
+        f.tools = self.tools
+        return f
+
+    def load_batch(self, path: str) -> T.List[BatchQuery]:
+        """Parse each query line of a '--batch' file.
+
+        A line holds findx arguments (quoted as in config files), optionally
+        preceded by '> FILE' to send the query's output to FILE.
+        """
+        try:
+            with open(
+                path, encoding="utf-8", errors="surrogateescape"
+            ) as batch_file:
+                lines = batch_file.read().splitlines()
+        except OSError as e:
+            raise InvalidBatchLineError(path, 0, str(e.strerror))
+        queries = []
+        for line_num, line in enumerate(lines, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            try:
+                args = quoted_split(line)
+                output = None
+                if args[:1] == [">"]:
+                    if len(args) < 2:
+                        raise MissingArgumentError()
+                    output = args[1]
+                    args = args[2:]
+                f = self.batch_findx()
+                f.parse_command_line(args)
+            except (ValueError, FindxSyntaxError) as e:
+                raise InvalidBatchLineError(path, line_num, str(e))
+            queries.append(BatchQuery(line_num, output, f))
+        return queries
+
+    def batch_walk_key(
+        self, batch_query: BatchQuery
+    ) -> T.Optional[T.Tuple[T.Any, ...]]:
+        """Return the key of the shared walk for a query, if it can join one.
+
+        Queries join a walk if findx can evaluate them natively with no
+        ordering, early termination, pacing, or report of their own.
+        """
+        f = batch_query.findx
+        own_pipeline = [
+            f.git,
+            f.bfs,
+            f.backend == "rg",
+            f.stats is not None,
+            f.limit is not None,
+            f.first,
+            f.saw_action,
+            bool(f.report_args),
+            f.dupes,
+            f.estimate,
+            f.heatmap,
+            f.cache_results,
+            f.background,
+        ]
+        if any(own_pipeline):
+            return None
+        try:
+            query = f.native_query()
+        except NativeUnsupportedError:
+            return None
+        batch_query.query = query
+        return (tuple(f.roots), query.follow, query.follow_roots)
+
+    def walk_root_multi(
+        self, root: str, queries: T.List[NativeQuery]
+    ) -> T.Iterator[T.Tuple[Entry, T.List[int]]]:
+        """Yield entries below root with the indices of queries they match.
+
+        Each directory is scanned once for all queries, and each query stops
+        evaluating below directories it prunes.
+        """
+        first = queries[0]
+        root_entry = Entry(root, 0, first.follow_roots)
+        stack: T.List[
+            T.Tuple[Entry, T.Tuple[Findx.DirId, ...], T.List[int]]
+        ] = [(root_entry, (), list(range(len(queries))))]
+        while stack:
+            entry, ancestors, active = stack.pop()
+            active = [i for i in active if not queries[i].pruned(entry)]
+            matches = [i for i in active if queries[i].matched(entry)]
+            if matches:
+                yield entry, matches
+            active = [
+                i
+                for i in active
+                if not queries[i].beyond_maxdepth(entry.depth + 1)
+            ]
+            if not active:
+                continue
+            child_ancestors = self.descend(entry, ancestors, first)
+            if child_ancestors is None:
+                continue
+            children = self.scan_dir(entry, first)
+            stack.extend(
+                (child, child_ancestors, active)
+                for child in reversed(children)
+            )
+
+    def run_batch_walk(self, batch_queries: T.List[BatchQuery]) -> int:
+        """Evaluate queries over one shared walk, returning worst status."""
+        queries = []
+        for batch_query in batch_queries:
+            assert batch_query.query is not None
+            queries.append(batch_query.query)
+        walk_errors = self.walk_errors
+        for batch_query in batch_queries:
+            batch_query.open()
+        try:
+            for root in batch_queries[0].findx.roots:
+                for entry, matches in self.walk_root_multi(root, queries):
+                    for i in matches:
+                        batch_queries[i].write(entry.path)
+        finally:
+            find_status = min(self.walk_errors - walk_errors, 1)
+            statuses = [q.close(find_status) for q in batch_queries]
+        for batch_query, status in zip(batch_queries, statuses):
+            batch_query.findx.save_since_last_run(status)
+        return self.report_batch_statuses(batch_queries, statuses)
+
+    def run_batch_query(self, batch_query: BatchQuery) -> int:
+        """Run a query that cannot share a walk as its own pipeline."""
+        f = batch_query.findx
+        try:
+            if batch_query.output:
+                with stdout_redirected(batch_query.output):
+                    status = f.run_query()
+            else:
+                status = f.run_query()
+        except FindxRuntimeError as e:
+            warn("Error: " + str(e))
+            status = 2
+        return self.report_batch_statuses([batch_query], [status])
+
+    def report_batch_statuses(
+        self, batch_queries: T.List[BatchQuery], statuses: T.List[int]
+    ) -> int:
+        for batch_query, status in zip(batch_queries, statuses):
+            if status:
+                warn(
+                    f"batch: line {batch_query.line_num} "
+                    f"exited with status {status}"
+                )
+        return next((status for status in statuses if status), 0)
+
+    def group_batch(
+        self, batch_queries: T.List[BatchQuery]
+    ) -> T.List[T.List[BatchQuery]]:
+        """Group queries by shared walk, keeping file order otherwise."""
+        groups: T.List[T.List[BatchQuery]] = []
+        walks: T.Dict[T.Tuple[T.Any, ...], T.List[BatchQuery]] = {}
+        for batch_query in batch_queries:
+            key = self.batch_walk_key(batch_query)
+            if key is None:
+                groups.append([batch_query])
+            elif key in walks:
+                walks[key].append(batch_query)
+            else:
+                walks[key] = [batch_query]
+                groups.append(walks[key])
+        return groups
+
+    def run_batch(self, path: str) -> int:
+        """Run every query of a '--batch' file, sharing walks of ROOTS.
+
+        Returns the first non-zero query status (each one is reported).
+        """
+        batch_queries = self.load_batch(path)
+        for batch_query in batch_queries:
+            for d in batch_query.findx.roots:
                 if not os.path.exists(d):
                     raise InvalidRootError(d)
-            find_abs_path = must_find_executable(self.find_pipe_args[0])
-            if self.xargs_pipe_args:
-                xargs_abs_path = must_find_executable(self.xargs_pipe_args[0])
-                find_proc = Popen(
-                    self.find_pipe_args, stdout=PIPE, executable=find_abs_path
-                )
-                xargs_proc = Popen(
-                    self.xargs_pipe_args,
-                    stdin=find_proc.stdout,
-                    executable=xargs_abs_path,
-                )
-                find_proc.wait()
-                xargs_proc.wait()
-                find_status = find_proc.returncode
-                xargs_status = xargs_proc.returncode
-                self.pipe_status = (find_status, xargs_status)
-                exit_status = merge_find_xargs_status(
-                    find_status, xargs_status
-                )
+        exit_status = 0
+        for group in self.group_batch(batch_queries):
+            if group[0].query is None:
+                status = self.run_batch_query(group[0])
             else:
-                find_proc = Popen(
-                    self.find_pipe_args, executable=find_abs_path
-                )
-                find_proc.wait()
-                find_status = find_proc.returncode
-                self.pipe_status = (find_status,)
-                exit_status = merge_find_xargs_status(find_status, 0)
+                status = self.run_batch_walk(group)
+            if not exit_status:
+                exit_status = status
         return exit_status
 
-    def help(self) -> None:
-        print(HELP_TEXT)
+    def show_batch(self, batch_queries: T.List[BatchQuery]) -> None:
+        for walk_num, group in enumerate(self.group_batch(batch_queries), 1):
+            for batch_query in group:
+                f = batch_query.findx
+                if batch_query.query is None:
+                    print(f"# line {batch_query.line_num}: own pipeline")
+                    f.show_command()
+                    continue
+                print(f"# line {batch_query.line_num}: walk {walk_num}")
+                s = "walk %s | filter %s" % (
+                    " ".join(f.roots),
+                    " ".join(f.native_show_args()),
+                )
+                if f.xargs_pipe_args:
+                    s += " | " + " ".join(f.xargs_pipe_args)
+                print(s)
+
+    def argv_shape(self, args: T.List[str]) -> T.List[str]:
+        """Return args with everything but options and operators masked.
+
+        Roots, globs, and option values may be sensitive, so only their
+        positions are kept.
+        """
+        keep = set(self.RESERVED_WORDS + [":", "::", "[", "]", "]]"])
+        return [
+            arg if arg in keep or re.fullmatch(r"-[\w-]+", arg) else "_"
+            for arg in args
+        ]
+
+    def metrics_record(
+        self, args: T.List[str], exit_status: int
+    ) -> T.Dict[str, T.Any]:
+        stats = self.stats if self.stats is not None else Stats(False)
+        return {
+            "timestamp": round(time.time(), 3),
+            "argv_shape": self.argv_shape(args),
+            "backend": self.backend,
+            "native_modes": self.native_modes,
+            "tools": self.tools,
+            "stats": stats.as_dict(),
+            "rusage": rusage_dicts(),
+            "pipe_status": self.pipe_status,
+            "exit_status": exit_status,
+        }
+
+    def write_metrics(self, args: T.List[str], exit_status: int) -> None:
+        """Write the metrics record to 'metrics_file' (if configured)."""
+        try:
+            metrics_file = self.get_var("metrics_file")
+            if not metrics_file or not self.runs_query():
+                return
+            path = os.path.expanduser(self.get_scalar_var("metrics_file"))
+            record = self.metrics_record(args, exit_status)
+        except FindxError as e:
+            warn("Error: " + str(e))
+            return
+        if path.endswith(".prom"):
+            data = prometheus_text(record).encode("utf-8")
+        else:
+            data = json.dumps(record).encode("utf-8") + b"\n"
+        try:
+            atomic_write(path, data)
+        except OSError as e:
+            warn(f"Cannot write {repr(path)}: {e.strerror}")
 
 
 def main() -> int:
+    try:
+        start_profiler(early_profile_path(sys.argv[1:]))
+    except ValueError as e:
+        warn(f"Error: Invalid 'profile' value: {e}")
+    try:
+        return run_main()
+    finally:
+        stop_profiler()
+
+
+def run_main() -> int:
     try:
         f = Findx()
         try:
+            start = time.perf_counter()
             f.parse_command_line(sys.argv[1:])
+            f.parse_seconds = time.perf_counter() - start
+            if f.get_var("profile"):
+                start_profiler(f.get_scalar_var("profile"))
             exit_status = f.run()
         except FindxSyntaxError as e:
             warn("Error: " + str(e))
@@ -1638,6 +6355,7 @@ def main() -> int:
             exit_status = 2
         except KeyboardInterrupt:
             exit_status = 128 + signal.SIGINT
+        f.write_metrics(sys.argv[1:], exit_status)
     except Exception:
         warn("uncaught exception:")
         traceback.print_exc()
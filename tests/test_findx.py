@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 
 
+import hashlib
+import json
+import os
+import random
+import re
+import sys
 import textwrap
+import time
 import typing as T
 
 import pytest
@@ -413,7 +420,7 @@ def test_exclude2() -> None:
     f = findx.Findx()
     f.parse_command_line("-print -e ( -type f -name *.exe ) -print".split())
     assert f.expression == "( -print -print )".split()
-    assert f.excludes == "( -type f -name *.exe )".split()
+    assert f.excludes == "-type f -name *.exe".split()
 
 
 def test_distribute_option() -> None:
@@ -503,3 +510,1220 @@ def test_text_settings_invalid() -> None:
             """
             )
         )
+
+
+def test_parse_expr_tree() -> None:
+    f = findx.Findx()
+    expr = "( -type f -o -type d ) -a -name *.c , ! ( -empty ) -print"
+    tree = f.parse_expr_tree(expr.split())
+    assert tree is not None
+    assert tree.op == ","
+    assert [c.op for c in tree.children] == ["and", "and"]
+    assert tree.tokens() == (
+        "( -type f -o -type d ) -name *.c , ! -empty -print".split()
+    )
+    assert f.parse_expr_tree([]) is None
+
+
+def test_case_insensitive_glob() -> None:
+    assert findx.case_insensitive_glob("*.c") == "*.[cC]"
+    assert findx.case_insensitive_glob(r"\*x2") == r"\*[xX]2"
+    assert findx.case_insensitive_glob("a[bc]") is None
+
+
+def test_ignore_file_glob() -> None:
+    assert findx.ignore_file_glob("*.c") == "*.c"
+    assert findx.ignore_file_glob("a{b}") == "a[{]b[}]"
+    assert findx.ignore_file_glob("[{]x") == "[{]x"
+    assert findx.ignore_file_glob("#x") == r"\#x"
+
+
+def make_fake_tool(tmp_path: T.Any, name: str) -> str:
+    path = tmp_path / name
+    path.write_text("#!/bin/sh\n")
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_fd_backend(tmp_path: T.Any, monkeypatch: T.Any) -> None:
+    fd = make_fake_tool(tmp_path, "fd")
+    monkeypatch.setenv("FINDX_FIND_BACKEND", "fd")
+    monkeypatch.setenv("FINDX_FD_PATH", fd)
+    f = findx.Findx()
+    f.parse_command_line(["-type", "f", "*.{c,h}", str(tmp_path)])
+    assert f.backend == "fd"
+    assert f.find_pipe_args == [
+        fd,
+        "--hidden",
+        "--no-ignore",
+        "--color=never",
+        "--type",
+        "file",
+        "--case-sensitive",
+        "--glob",
+        "--",
+        "{*.c,*.h}",
+        str(tmp_path),
+    ]
+
+
+def test_fd_backend_excludes(tmp_path: T.Any, monkeypatch: T.Any) -> None:
+    fd = make_fake_tool(tmp_path, "fd")
+    monkeypatch.setenv("FINDX_FIND_BACKEND", "fd")
+    monkeypatch.setenv("FINDX_FD_PATH", fd)
+    monkeypatch.setenv("FINDX_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("FINDX_STDXD", "build")
+    monkeypatch.setenv("FINDX_STDXF", "*.o")
+    f = findx.Findx()
+    f.parse_command_line(["-ffx", "-x", "-name", "x", str(tmp_path)])
+    assert f.backend == "fd"
+    assert list(f.backend_files.values()) == [
+        b"*.[oO]\n!*.[oO]/\n[bB][uU][iI][lL][dD]/\nx\n"
+    ]
+
+
+def test_fd_backend_fallback(tmp_path: T.Any, monkeypatch: T.Any) -> None:
+    monkeypatch.setenv("FINDX_FIND_BACKEND", "fd")
+    monkeypatch.setenv("FINDX_FD_PATH", make_fake_tool(tmp_path, "fd"))
+    for args in [
+        "-type f -size +1k",
+        "-type f -path */x",
+        "-type f -x -size +1k",
+        "-type f -i -not -type d -name x",
+        "-name *.c",
+        "-type f -delete",
+        "-H -type f",
+    ]:
+        f = findx.Findx()
+        f.parse_command_line(args.split() + [str(tmp_path)])
+        assert f.backend == "find"
+        assert f.find_pipe_args[0] != "fd"
+
+
+def test_translate_grep_args() -> None:
+    f = findx.Findx()
+    assert f.translate_grep_args(["-H", "-in", "main"]) == [
+        "--with-filename",
+        "--ignore-case",
+        "--line-number",
+        "-e",
+        "main",
+        "--",
+    ]
+    assert f.translate_grep_args(["-e", "a", "-e", "b"]) == [
+        "--no-line-number",
+        "-e",
+        "a",
+        "-e",
+        "b",
+        "--",
+    ]
+    assert f.translate_grep_args(["-c", "a"]) == [
+        "--count",
+        "--include-zero",
+        "--no-line-number",
+        "-e",
+        "a",
+        "--",
+    ]
+    assert f.translate_grep_args(["-co", "a"]) is None
+    assert f.translate_grep_args(["-F", "a(b"]) is not None
+    assert f.translate_grep_args(["-E", "a(b|c)"]) is not None
+    assert f.translate_grep_args(["a\\|b"]) is None
+    assert f.translate_grep_args(["a(b"]) is None
+    assert f.translate_grep_args(["-P", "a"]) is None
+    assert f.translate_grep_args(["--include=x", "a"]) is None
+    assert f.translate_grep_args(["a", "file"]) is None
+
+
+def test_rg_backend(tmp_path: T.Any, monkeypatch: T.Any) -> None:
+    rg = make_fake_tool(tmp_path, "rg")
+    monkeypatch.setenv("FINDX_GREP_BACKEND", "rg")
+    monkeypatch.setenv("FINDX_RG_PATH", rg)
+    monkeypatch.setenv("FINDX_GREP_PATH", "grep")
+    monkeypatch.setenv("FINDX_GREP_STYLE", "gnu")
+    monkeypatch.setenv("FINDX_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("FINDX_STDXD", "build")
+    monkeypatch.setenv("FINDX_STDXF", "")
+    f = findx.Findx()
+    f.parse_command_line(["-ffg", "main", "[", "*.c", str(tmp_path)])
+    assert f.backend == "rg"
+    assert f.xargs_pipe_args == []
+    assert f.find_pipe_args[0] == rg
+    assert f.find_pipe_args[-4:] == ["-e", "main", "--", str(tmp_path)]
+    assert list(f.backend_files.values()) == [
+        b"*\n!*/\n!*.c\n[bB][uU][iI][lL][dD]/\n"
+    ]
+
+
+def test_rg_status_as_xargs_status() -> None:
+    assert findx.rg_status_as_xargs_status(0) == 0
+    assert findx.rg_status_as_xargs_status(1) == 123
+    assert findx.rg_status_as_xargs_status(2) == 123
+
+
+def test_glob_regex() -> None:
+    def match(glob: str, name: str, ignore_case: bool = False) -> bool:
+        return bool(findx.glob_regex(glob, ignore_case).fullmatch(name))
+
+    assert match("*.c", "a.c")
+    assert not match("*.c", "a.h")
+    assert match("*", ".hidden")
+    assert match("a*", "a/b")
+    assert match("[!a]x", "bx")
+    assert not match("[^a]x", "ax")
+    assert match("[]]", "]")
+    assert match(r"a\*", "a*")
+    assert not match(r"a\*", "ab")
+    assert match("[", "[")
+    assert match("*.C", "x.c", ignore_case=True)
+
+
+def test_filter_git_paths(tmp_path: T.Any) -> None:
+    for rel_path in ["a.c", "src/b.c", "src/x.o", "venv/c.c"]:
+        path = tmp_path / rel_path
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("")
+    root = str(tmp_path)
+    rel_paths = [b"a.c", b"deleted.c", b"src/b.c", b"src/x.o", b"venv/c.c"]
+
+    def filtered(args: str) -> T.List[str]:
+        f = findx.Findx()
+        f.parse_command_line(["-git", root] + args.split())
+        query = f.native_query()
+        entries = f.filter_git_paths(root, query, rel_paths)
+        return [e.path[len(root) :] for e in entries]
+
+    assert filtered("*.c") == ["/a.c", "/src/b.c", "/venv/c.c"]
+    assert filtered("-type d") == ["", "/src", "/venv"]
+    assert filtered("-x venv, -x *.o") == [
+        "",
+        "/a.c",
+        "/src",
+        "/src/b.c",
+    ]
+    assert filtered("-x venv, -i -name venv -type f") == [
+        "/a.c",
+        "/src/b.c",
+        "/src/x.o",
+        "/venv/c.c",
+    ]
+    assert filtered("-maxdepth 1 -mindepth 1") == ["/a.c", "/src", "/venv"]
+
+
+def test_native_query_unsupported() -> None:
+    f = findx.Findx()
+    f.parse_command_line("-git -size +1".split())
+    with pytest.raises(findx.NativeUnsupportedError):
+        f.native_query()
+
+
+def test_show_native_unsupported() -> None:
+    f = findx.Findx()
+    f.parse_command_line("-show -git . -print".split())
+    with pytest.raises(findx.NativeUnsupportedError):
+        f.run()
+
+
+def test_ignore_pattern_regex() -> None:
+    def matches(pattern: str, path: str) -> bool:
+        regex = findx.ignore_pattern_regex(pattern)
+        return re.fullmatch(regex, path) is not None
+
+    assert matches("*.log", "x.log")
+    assert not matches("*.log", "a/x.log")
+    assert matches("**/x", "a/b/x")
+    assert matches("**/x", "x")
+    assert matches("a/**", "a/b/c")
+    assert not matches("[a/]", "/")
+    assert matches(r"\*", "*")
+
+
+def test_parse_ignore_lines() -> None:
+    lines = ["# comment\n", "\n", "build/\n", "!/src/keep.o\n", "tail\\ \n"]
+    assert findx.parse_ignore_lines(lines) == [
+        ("build", False, True, False),
+        (r"src/keep\.o", True, False, True),
+        (r"tail\ ", False, False, False),
+    ]
+
+
+def test_walk_ignore_files(tmp_path: T.Any) -> None:
+    tree = tmp_path / "tree"
+    for rel_path in ["a/x.log", "a/keep.log", "a/b/y.txt", "build/z", "w"]:
+        path = tree / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    (tree / ".gitignore").write_text("build/\n*.log\n/w\n")
+    (tree / "a" / ".ignore").write_text("!keep.log\n")
+    root = str(tree)
+    cache_dir = str(tmp_path / "cache")
+
+    def walked() -> T.List[str]:
+        f = findx.Findx()
+        f.parse_command_line(
+            ["-ignore-files", "--cache-dir", cache_dir, root, "-type", "f"]
+        )
+        query = f.native_query()
+        try:
+            entries = f.iter_walk_entries(query)
+            return sorted(e.path[len(root) :] for e in entries)
+        finally:
+            assert query.ignores is not None
+            query.ignores.save()
+
+    expected = ["/.gitignore", "/a/.ignore", "/a/b/y.txt", "/a/keep.log"]
+    assert walked() == expected
+    assert (tmp_path / "cache" / "ignore-rules.json").exists()
+    assert walked() == expected
+
+
+def test_prune_markers_find_args() -> None:
+    f = findx.Findx()
+    f.parse_command_line("--prune-markers CACHEDIR.TAG -prune-markers".split())
+    assert f.find_pipe_args[1:] == [
+        ".",
+        "(",
+        "-type",
+        "d",
+        "-exec",
+        "test",
+        "-e",
+        "{}/CACHEDIR.TAG",
+        ";",
+        ")",
+        "-prune",
+        "-o",
+        "-print",
+    ]
+
+
+def test_prune_markers_native(tmp_path: T.Any) -> None:
+    for rel_path in ["a/t/CACHEDIR.TAG", "b/.findxignore", "c/f"]:
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    root = str(tmp_path)
+    f = findx.Findx()
+    f.parse_command_line(["-prune-markers", "-ignore-files", root])
+    query = f.native_query()
+    query.ignores = None
+    paths = [e.path[len(root) :] for e in f.iter_walk_entries(query)]
+    assert sorted(paths) == ["", "/a", "/c", "/c/f"]
+
+
+def test_prune_markers_walk(tmp_path: T.Any, capfd: T.Any) -> None:
+    for rel_path in ["a/t/CACHEDIR.TAG", "b/.findxignore", "c/f"]:
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    f = findx.Findx()
+    f.parse_command_line(["-prune-markers", "-stats", str(tmp_path)])
+    assert f.native_modes == ["-prune-markers"]
+    assert f.run() == 0
+    out, err = capfd.readouterr()
+    assert "/t\n" not in out and "/b\n" not in out
+    assert "stats: directories pruned by markers: 2" in err
+
+    # A test that only 'find' evaluates keeps the 'find' walk.
+    f = findx.Findx()
+    f.parse_command_line(["-prune-markers", str(tmp_path), "-size", "+1"])
+    assert f.native_modes == []
+
+
+@pytest.mark.parametrize(
+    "options, expected",
+    [
+        ("", (False, False)),
+        ("-L", (True, True)),
+        ("-H", (False, True)),
+        ("-L -P", (False, False)),
+        ("-L -H", (False, True)),
+        ("-P -L", (True, True)),
+    ],
+)
+def test_follow_flags(options: str, expected: T.Tuple[bool, bool]) -> None:
+    f = findx.Findx()
+    f.parse_command_line(options.split() + ["."])
+    assert f.follow_flags() == expected
+
+
+def test_batch_runner() -> None:
+    stats = findx.Stats(progress=False)
+    runner = findx.BatchRunner(["xargs", "-0", "true"], stats)
+    runner.max_bytes = 10
+    assert all(runner.add(b"abcd") for _ in range(5))
+    assert runner.close() == 0
+    assert runner.batches == stats.batches == 3
+    assert stats.stages["xargs"][3] == 3
+
+    runner = findx.BatchRunner(["xargs", "-0", "sh", "-c", "exit 255"])
+    runner.max_bytes = 1
+    assert runner.add(b"a")
+    assert not runner.add(b"b")
+    assert runner.close() == 124
+
+
+def test_stats_native_walk(tmp_path: T.Any) -> None:
+    for rel_path in ["a/x", "a/y", "b/z"]:
+        path = tmp_path / "tree" / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    f = findx.Findx()
+    root = tmp_path / "tree"
+    f.parse_command_line(
+        ["-stats", "-ignore-files", "--cache-dir", str(tmp_path / "cache")]
+        + [str(root), "-type", "f"]
+    )
+    f.stats = findx.Stats(progress=False)
+    assert f.run_pipeline() == 0
+    assert f.stats.visited == 6
+    assert f.stats.emitted == 3
+
+
+def test_stats_find_pipe(tmp_path: T.Any, capfd: T.Any) -> None:
+    for name in ["x", "y", "z"]:
+        (tmp_path / name).write_text("")
+    f = findx.Findx()
+    f.parse_command_line(["-stats", str(tmp_path), "-type", "f", ":", "echo"])
+    assert not f.relays_pipeline()
+    f.stats = findx.Stats(progress=False)
+    assert f.run_pipeline() == 0
+    # One concurrent 'xargs' batches the paths itself.
+    assert capfd.readouterr().out.count("\n") == 1
+    assert f.stats.stages["find"][3] == 1
+    assert f.stats.stages["xargs"][3] == 1
+    assert f.stats.emitted == 3
+    assert f.stats.batches is None
+
+
+def test_stats_without_resource(
+    tmp_path: T.Any, monkeypatch: T.Any, capfd: T.Any
+) -> None:
+    # Windows has no 'resource' module.
+    monkeypatch.setattr(findx, "resource", None)
+    (tmp_path / "x").write_text("")
+    f = findx.Findx()
+    f.parse_command_line(["-stats", str(tmp_path)])
+    assert f.run() == 0
+    assert f.stats is not None and f.stats.stages["findx"][3] == 1
+    assert f.metrics_record([], 0)["rusage"] == {}
+
+
+def test_argv_shape() -> None:
+    f = findx.Findx()
+    args = "-stdx secret -x -name *.o --cache-dir /x : grep -i y".split()
+    assert f.argv_shape(args) == [
+        "-stdx",
+        "_",
+        "-x",
+        "-name",
+        "_",
+        "--cache-dir",
+        "_",
+        ":",
+        "_",
+        "-i",
+        "_",
+    ]
+
+
+def test_write_metrics(tmp_path: T.Any) -> None:
+    f = findx.Findx()
+    metrics_file = tmp_path / "findx.prom"
+    f.parse_command_line(["--metrics-file", str(metrics_file)])
+    f.stats = findx.Stats(progress=False)
+    f.stats.phases["run"] = 0.5
+    f.pipe_status = (0, 123)
+    f.write_metrics([], 123)
+    text = metrics_file.read_text()
+    assert "findx_exit_status 123\n" in text
+    assert 'findx_pipe_status{stage="1"} 123\n' in text
+    assert 'findx_phase_seconds{phase="run"} 0.5\n' in text
+    assert text.count("# TYPE findx_pipe_status gauge") == 1
+
+    metrics_file = tmp_path / "findx.json"
+    f.config.set("metrics_file", "=", [str(metrics_file)])
+    f.write_metrics(["/root", "-name", "x"], 0)
+    record = json.loads(metrics_file.read_text())
+    assert record["argv_shape"] == ["_", "-name", "_"]
+    assert record["stats"]["phases"] == {"run": 0.5}
+    assert record["tools"]["find"]["path"]
+
+
+def test_metrics_file_pipeline(tmp_path: T.Any, capfd: T.Any) -> None:
+    (tmp_path / "x").write_text("")
+    metrics_file = tmp_path / "findx.json"
+    f = findx.Findx()
+    f.parse_command_line(
+        ["--metrics-file", str(metrics_file), str(tmp_path), "-type", "f"]
+        + [":", "echo"]
+    )
+    assert f.run() == 0
+    assert f.stats is not None and not f.stats.counting
+    assert f.stats.stages["xargs"][3] == 1
+    f.write_metrics([], 0)
+    record = json.loads(metrics_file.read_text())
+    assert record["stats"]["paths_emitted"] is None
+
+    metrics_file.unlink()
+    f = findx.Findx()
+    f.parse_command_line(["--metrics-file", str(metrics_file), "-show"])
+    assert f.run() == 0
+    f.write_metrics([], 0)
+    assert not metrics_file.exists()
+
+
+def test_early_profile_path(monkeypatch: T.Any) -> None:
+    monkeypatch.delenv("FINDX_PROFILE", raising=False)
+    assert findx.early_profile_path(["-stdx", "--profile"]) == ""
+    assert findx.early_profile_path(["--profile", "p.json", "x"]) == "p.json"
+    assert findx.early_profile_path([":", "--profile", "p.json"]) == ""
+    monkeypatch.setenv("FINDX_PROFILE", "env.prof")
+    assert findx.early_profile_path(["-stdx"]) == "env.prof"
+
+
+def test_profiler_trace(tmp_path: T.Any) -> None:
+    path = tmp_path / "trace.json"
+    assert findx.span("off") is findx.span("off")
+    findx.start_profiler(str(path))
+    try:
+        f = findx.Findx()
+        f.parse_command_line(["-stdx"])
+    finally:
+        findx.stop_profiler()
+    names = [e["name"] for e in json.loads(path.read_text())["traceEvents"]]
+    assert "parse" in names
+    assert "expression" in names
+
+
+def test_tree_shape_synthesize(tmp_path: T.Any) -> None:
+    tree = tmp_path / "tree"
+    for rel_path in ["a/x.c", "a/b/y.c", "a/b/z.h", "w.txt", ".git/HEAD"]:
+        path = tree / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("data\n")
+    f = findx.Findx()
+    f.parse_command_line([str(tree), "-x", "-name", ".git"])
+    shape = findx.TreeShape.from_dict(f.tree_shape().as_dict())
+    assert shape.depths == {
+        "0": {"d": 1},
+        "1": {"d": 1, "f": 1},
+        "2": {"d": 1, "f": 1},
+        "3": {"f": 2},
+    }
+    assert shape.extensions == {".c": 2, ".h": 1, ".txt": 1}
+    assert shape.pruned_names == {".git": 1}
+    assert shape.fanouts == {"2": 3}
+
+    synthetic = tmp_path / "synthetic"
+    synthetic.mkdir()
+    shape.synthesize([str(synthetic)])
+    f = findx.Findx()
+    f.parse_command_line([str(synthetic), "-x", "-name", ".git"])
+    synthetic_shape = f.tree_shape()
+    assert synthetic_shape.depths == shape.depths
+    assert synthetic_shape.extensions == shape.extensions
+    assert synthetic_shape.pruned_names == shape.pruned_names
+
+
+def test_record_replay(tmp_path: T.Any, capfd: T.Any) -> None:
+    tree = tmp_path / "tree"
+    for rel_path in ["a/x.c", "b/y.c"]:
+        path = tree / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("data\n")
+    record_file = tmp_path / "record.json"
+    args = ["--record", str(record_file), str(tree), "*.c", ":", "echo"]
+    f = findx.Findx()
+    f.parse_command_line(args)
+    assert f.run() == 0
+    record = json.loads(record_file.read_text())
+    assert record["args"] == args
+    assert record["stats"]["paths_emitted"] == 2
+
+    f = findx.Findx()
+    f.parse_command_line(["--replay", str(record_file)])
+    assert f.run() == 0
+    assert f.stats is not None
+    assert f.stats.emitted == 2
+    err = capfd.readouterr().err
+    assert "replay: not running XARGS 'echo'" in err
+    assert "replay: synthetic run:" in err
+
+
+@pytest.mark.parametrize(
+    "args, shape",
+    [
+        (["-exec", "touch", "{}", ";"], {}),
+        (["-fprint", "out"], {}),
+        (["--find-path", "/bin/sh"], {}),
+        (["--cache-dir", "/etc"], {}),
+        (["-git"], {}),
+        ([], {"pruned_names": {"../../escaped": 1}}),
+        ([], {"extensions": {".c/../../x": 1}}),
+        ([], {"sizes": {"99": 1}}),
+        ([], {"depths": {"1": {"f": "many"}}}),
+        ("-name x", {}),
+        (None, None),
+    ],
+)
+def test_replay_invalid_record(
+    tmp_path: T.Any, args: T.Any, shape: T.Optional[T.Dict[str, T.Any]]
+) -> None:
+    fields = "depths fanouts name_lengths extensions sizes pruned_names"
+    stats = findx.Stats(progress=False).as_dict()
+    record: T.Any = [args]
+    if shape is not None:
+        record = {
+            "args": args,
+            "stats": stats,
+            "shape": dict({field: {} for field in fields.split()}, **shape),
+        }
+    record_file = tmp_path / "record.json"
+    record_file.write_text(json.dumps(record))
+    f = findx.Findx()
+    f.parse_command_line(["--replay", str(record_file)])
+    with pytest.raises(findx.InvalidRecordError):
+        f.run()
+
+
+@pytest.mark.parametrize("mode", [[], ["-ignore-files"]])
+def test_limit(tmp_path: T.Any, capfd: T.Any, mode: T.List[str]) -> None:
+    for i in range(5):
+        (tmp_path / f"f{i}").write_text("data\n")
+    f = findx.Findx()
+    f.parse_command_line(mode + ["-limit", "2", str(tmp_path), "-type", "f"])
+    assert f.run() == 0
+    assert len(capfd.readouterr().out.splitlines()) == 2
+
+
+def test_limit_invalid() -> None:
+    f = findx.Findx()
+    with pytest.raises(findx.InvalidOptionError):
+        f.parse_command_line(["-limit", "0"])
+
+
+def test_first_command_line(tmp_path: T.Any, capfd: T.Any) -> None:
+    for i in range(3):
+        (tmp_path / f"f{i}").write_text("data\n")
+    f = findx.Findx()
+    f.parse_command_line(
+        ["-first", str(tmp_path), "-type", "f"]
+        + [":", "sh", "-c", "echo first; sleep 10; echo second"]
+    )
+    start = time.perf_counter()
+    assert f.run() == 0
+    assert time.perf_counter() - start < 5
+    assert capfd.readouterr().out == "first\n"
+
+
+def test_interactive_batches(tmp_path: T.Any, capfd: T.Any) -> None:
+    for i in range(10):
+        (tmp_path / f"f{i}").write_text("data\n")
+    f = findx.Findx()
+    f.parse_command_line(
+        ["--interactive", "yes", str(tmp_path), "-type", "f", ":", "echo"]
+    )
+    assert f.run() == 0
+    lines = capfd.readouterr().out.splitlines()
+    assert [len(line.split()) for line in lines] == [1, 2, 4, 3]
+
+
+def test_interactive_off_when_not_tty() -> None:
+    f = findx.Findx()
+    f.parse_command_line(["--interactive", "auto", ":", "echo"])
+    assert not f.interactive
+
+
+def test_interactive_off_by_default(monkeypatch: T.Any) -> None:
+    monkeypatch.setattr(sys.stdout, "isatty", lambda: True)
+    f = findx.Findx()
+    f.parse_command_line([":", "echo"])
+    assert not f.interactive
+    assert not f.relays_pipeline()
+
+
+@pytest.mark.parametrize("frontier", ["100000", "1"])
+def test_bfs(tmp_path: T.Any, capfd: T.Any, frontier: str) -> None:
+    for rel_path in ["a/b/c/deep", "a/mid", "d/e/mid2", "top"]:
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("data\n")
+    f = findx.Findx()
+    f.parse_command_line(
+        ["--bfs-frontier", frontier, "-bfs", str(tmp_path), "-type", "f"]
+    )
+    assert f.run() == 0
+    paths = capfd.readouterr().out.splitlines()
+    names = [os.path.basename(path) for path in paths]
+    assert names[0] == "top"
+    assert sorted(names[1:3]) == ["mid", "mid2"]
+    assert names[3] == "deep"
+
+
+def test_bfs_frontier_invalid() -> None:
+    f = findx.Findx()
+    f.parse_command_line(["--bfs-frontier", "0", "-bfs"])
+    with pytest.raises(findx.InvalidIntConfigVarError):
+        f.run()
+
+
+def test_batch_shared_walk(tmp_path: T.Any, capfd: T.Any) -> None:
+    tree = tmp_path / "tree"
+    for rel_path in ["a/x.c", "a/y.h", "b/z.c"]:
+        path = tree / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("data\n")
+    headers = tmp_path / "headers.txt"
+    batch_file = tmp_path / "queries"
+    batch_file.write_text(
+        textwrap.dedent(
+            f"""\
+            # Comments and blank lines are skipped.
+
+            {tree} -type f -name '*.c' -x -name b
+            > {headers} {tree} -name '*.h' : echo header
+            """
+        )
+    )
+    f = findx.Findx()
+    f.parse_command_line(["--batch", str(batch_file)])
+    queries = f.load_batch(str(batch_file))
+    assert [len(group) for group in f.group_batch(queries)] == [2]
+    assert f.run() == 0
+    assert capfd.readouterr().out == f"{tree}/a/x.c\n"
+    assert headers.read_text() == f"header {tree}/a/y.h\n"
+
+
+def test_batch_report_modes(tmp_path: T.Any, capfd: T.Any) -> None:
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    (tree / "big").write_text("x" * 100)
+    (tree / "small").write_text("x")
+    os.link(tree / "big", tree / "big-link")
+    batch_file = tmp_path / "queries"
+    batch_file.write_text(
+        f"-top 1 size {tree} -type f\n-dupes {tree}\n{tree} -name small\n"
+    )
+    f = findx.Findx()
+    f.parse_command_line(["--batch", str(batch_file)])
+    queries = f.load_batch(str(batch_file))
+    assert [len(group) for group in f.group_batch(queries)] == [1, 1, 1]
+    assert [q.query is None for q in queries] == [True, True, False]
+    assert f.run() == 0
+    lines = capfd.readouterr().out.splitlines()
+    assert lines[0].endswith(("/big", "/big-link"))
+    assert lines[-1] == f"{tree}/small"
+    assert len(lines) == 2
+
+
+def test_batch_invalid_line(tmp_path: T.Any) -> None:
+    batch_file = tmp_path / "queries"
+    batch_file.write_text("-type f\n-bogus\n")
+    f = findx.Findx()
+    f.parse_command_line(["--batch", str(batch_file)])
+    with pytest.raises(findx.InvalidBatchLineError, match="line 2"):
+        f.run()
+
+
+@pytest.mark.parametrize("mode", [[], ["-ignore-files"]])
+def test_since_last_run(
+    tmp_path: T.Any, capfd: T.Any, mode: T.List[str]
+) -> None:
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    for name in ["old", "new"]:
+        (tree / name).write_text("data\n")
+    args = ["--cache-dir", str(tmp_path / "cache")] + mode
+    args += ["-since-last-run", "key", str(tree), "-type", "f"]
+
+    def run() -> T.List[str]:
+        f = findx.Findx()
+        f.parse_command_line(args)
+        assert f.run() == 0
+        return sorted(capfd.readouterr().out.splitlines())
+
+    assert run() == [f"{tree}/new", f"{tree}/old"]
+    assert run() == []
+    stamps = list((tmp_path / "cache" / "since-last-run").iterdir())
+    future = stamps[0].stat().st_mtime + 10
+    os.utime(tree / "new", (future, future))
+    assert run() == [f"{tree}/new"]
+
+
+def test_since_last_run_limit(tmp_path: T.Any, capfd: T.Any) -> None:
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    for name in ["a", "b"]:
+        (tree / name).write_text("data\n")
+    args = ["--cache-dir", str(tmp_path / "cache"), "-bfs"]
+    args += ["-since-last-run", "key", "-limit", "1", str(tree), "-type", "f"]
+
+    def run() -> T.List[str]:
+        f = findx.Findx()
+        f.parse_command_line(args)
+        assert f.run() == 0
+        return sorted(capfd.readouterr().out.splitlines())
+
+    # A run cut short by '-limit' leaves the stamp alone.
+    assert len(run()) == 1
+    assert len(run()) == 1
+    assert not (tmp_path / "cache" / "since-last-run").exists()
+
+
+def test_since_last_run_failure_keeps_stamp(tmp_path: T.Any) -> None:
+    (tmp_path / "f").write_text("data\n")
+    f = findx.Findx()
+    f.parse_command_line(
+        ["--cache-dir", str(tmp_path / "cache"), "-since-last-run", "key"]
+        + [str(tmp_path), "-type", "f", ":", "false"]
+    )
+    assert f.run() != 0
+    assert not os.path.exists(f.since_last_run_path)
+
+
+def test_result_cache(tmp_path: T.Any, capfd: T.Any) -> None:
+    tree = tmp_path / "tree"
+    (tree / "sub").mkdir(parents=True)
+    (tree / "sub" / "a.py").write_text("data\n")
+
+    def age_dirs(mtime: float) -> None:
+        # Recently modified directories are not trusted for caching.
+        for path in [tree, tree / "sub"]:
+            os.utime(path, (mtime, mtime))
+
+    age_dirs(1e9)
+    args = ["--cache-dir", str(tmp_path / "cache"), "-cache", str(tree)]
+    args += ["-type", "f"]
+
+    def run() -> T.Tuple[T.List[str], T.Optional[int]]:
+        f = findx.Findx()
+        f.parse_command_line(["-stats"] + args)
+        assert f.run() == 0
+        assert f.stats is not None
+        out = capfd.readouterr().out
+        return sorted(out.splitlines()), f.stats.visited
+
+    assert run() == ([f"{tree}/sub/a.py"], 3)
+    # Served from the cache without walking.
+    assert run() == ([f"{tree}/sub/a.py"], None)
+    (tree / "sub" / "b.py").write_text("data\n")
+    assert run()[0] == [f"{tree}/sub/a.py", f"{tree}/sub/b.py"]
+    age_dirs(2e9)
+    assert run() == ([f"{tree}/sub/a.py", f"{tree}/sub/b.py"], 4)
+
+
+def test_result_cache_uncacheable() -> None:
+    f = findx.Findx()
+    f.parse_command_line(["-cache", "-size", "+1"])
+    assert f.cacheable_query() is None
+    for option in ["-L", "-H"]:
+        f = findx.Findx()
+        f.parse_command_line(["-cache", option, ".", "-type", "f"])
+        assert f.cacheable_query() is None
+    f = findx.Findx()
+    f.parse_command_line(["-cache", "-L", "-P", ".", "-type", "f"])
+    assert f.cacheable_query() is not None
+
+
+def test_result_cache_prune_markers(tmp_path: T.Any, capfd: T.Any) -> None:
+    tree = tmp_path / "tree"
+    (tree / "cachedir").mkdir(parents=True)
+    (tree / "cachedir" / "CACHEDIR.TAG").write_text("")
+    (tree / "cachedir" / "junk.txt").write_text("")
+    for path in [tree, tree / "cachedir"]:
+        os.utime(path, (1e9, 1e9))
+    args = ["--cache-dir", str(tmp_path / "cache"), "-cache"]
+    args += ["-prune-markers", str(tree), "-type", "f"]
+
+    def run() -> T.List[str]:
+        f = findx.Findx()
+        f.parse_command_line(args)
+        assert f.cacheable_query() is None
+        assert f.run() == 0
+        return sorted(capfd.readouterr().out.splitlines())
+
+    assert run() == []
+    # Removing the marker leaves every directory mtime but its own alone.
+    (tree / "cachedir" / "CACHEDIR.TAG").unlink()
+    assert run() == [f"{tree}/cachedir/junk.txt"]
+
+
+@pytest.mark.parametrize(
+    "expression, optimized",
+    [
+        ("-size +1k -name *.c", "-name *.c -size +1k"),
+        (
+            "-mtime -1 -type f -name x -exec echo {} ; -size 0 -name y",
+            "-name x -type f -mtime -1 -exec echo {} ; -name y -size 0",
+        ),
+        (
+            "( -perm 644 -o -size 0 ) -iname *.py , -mtime 1 -name z",
+            "-iname *.py ( -perm 644 -o -size 0 ) , -name z -mtime 1",
+        ),
+        ("-name x -o -size 0", "-name x -o -size 0"),
+    ],
+)
+def test_optimize_expression(expression: str, optimized: str) -> None:
+    f = findx.Findx()
+    assert f.optimize_expression(expression.split()) == optimized.split()
+
+
+def test_no_optimize() -> None:
+    f = findx.Findx()
+    f.parse_command_line("-no-optimize -size +1k -name x".split())
+    assert f.expression == "( -size +1k -name x )".split()
+
+
+@pytest.mark.parametrize(
+    "glob, other_glob, ignore_case, expected",
+    [
+        ("*.bak", "x.bak", False, True),
+        ("*.bak", "x.BAK", False, False),
+        ("*.bak", "*.BAK", True, True),
+        ("*.egg", "*.egg-info", True, False),
+        ("*", "[ab]*", False, True),
+        ("test*", "test_*.py", False, True),
+        ("*.c", "*[.]c", False, False),
+    ],
+)
+def test_glob_subsumes(
+    glob: str, other_glob: str, ignore_case: bool, expected: bool
+) -> None:
+    assert findx.glob_subsumes(glob, other_glob, ignore_case) == expected
+
+
+def test_canonical_excludes(capsys: T.Any) -> None:
+    f = findx.Findx()
+    f.parse_command_line(
+        "-x -iname *.bak -x ( -name x.bak -o -iname *.BAK ) -x -name .git"
+        " -x -name .git -x -iname .GIT".split()
+    )
+    assert f.excludes == "-iname *.bak -o -iname .GIT".split()
+    f.show_command()
+    notes = [
+        line for line in capsys.readouterr().out.splitlines() if "#" in line
+    ]
+    assert notes == [
+        "# excludes: dropped duplicate -name .git",
+        "# excludes: dropped -name x.bak (subsumed by -iname *.bak)",
+        "# excludes: dropped -iname *.BAK (subsumed by -iname *.bak)",
+        "# excludes: dropped -name .git (subsumed by -iname .GIT)",
+    ]
+
+
+def test_mount_table(tmp_path: T.Any) -> None:
+    mountinfo = tmp_path / "mountinfo"
+    mountinfo.write_text(
+        "23 28 0:22 / /proc rw,relatime shared:12 - proc proc rw\n"
+        "61 28 0:52 / /mnt/my\\040share rw - cifs //srv/share rw\n"
+        "garbage\n"
+    )
+    assert findx.mount_table(str(mountinfo)) == (
+        ("/proc", "proc"),
+        ("/mnt/my share", "cifs"),
+    )
+    assert findx.mount_table(str(tmp_path / "missing")) == ()
+
+
+def test_stdxm(monkeypatch: T.Any) -> None:
+    monkeypatch.setattr(
+        findx,
+        "mount_table",
+        lambda: (
+            ("/", "ext4"),
+            ("/proc", "proc"),
+            ("/proc/sys/fs/binfmt_misc", "binfmt_misc"),
+            ("/srv/data", "xfs"),
+            ("/srv/n[1]", "nfs4"),
+            ("/home/u/remote", "fuse.sshfs"),
+        ),
+    )
+    f = findx.Findx()
+    f.parse_command_line("-stdxm / /srv".split())
+    assert f.excludes == (
+        "-path /home/u/remote -o -path /proc -o -path /srv/n\\[1\\]".split()
+    )
+    f = findx.Findx()
+    f.parse_command_line("-stdxm /proc /srv/data".split())
+    assert f.excludes == "-path /proc/sys/fs/binfmt_misc".split()
+
+
+def test_collapse_roots(tmp_path: T.Any, capsys: T.Any) -> None:
+    (tmp_path / "src" / "lib").mkdir(parents=True)
+    (tmp_path / "build" / "x").mkdir(parents=True)
+    root = str(tmp_path)
+    f = findx.Findx()
+    f.parse_command_line(
+        [
+            "-collapse-roots",
+            f"{root}/src/lib",
+            root,
+            f"{root}/src",
+            f"{root}/build/x",
+            f"{root}/missing",
+            "-x",
+            "-name",
+            "build",
+        ]
+    )
+    assert f.roots == [root, f"{root}/build/x", f"{root}/missing"]
+    assert capsys.readouterr().err.splitlines() == [
+        f"findx: Dropped ROOT {repr(f'{root}/src/lib')};"
+        f" it is walked from {repr(root)}",
+        f"findx: Dropped ROOT {repr(f'{root}/src')};"
+        f" it is walked from {repr(root)}",
+    ]
+
+
+def test_collapse_roots_depth(tmp_path: T.Any) -> None:
+    (tmp_path / "src").mkdir()
+    (tmp_path / "link").symlink_to("src")
+    root = str(tmp_path)
+    f = findx.Findx()
+    f.parse_command_line(
+        f"-collapse-roots -maxdepth 1 {root} {root}/src {root}/src/".split()
+    )
+    assert f.roots == [root, f"{root}/src"]
+    f = findx.Findx()
+    f.parse_command_line(
+        f"-collapse-roots {root}/link/ {root}/src -print".split()
+    )
+    assert f.roots == [f"{root}/link/"]
+    f = findx.Findx()
+    f.parse_command_line(f"-collapse-roots {root}/link {root}/src".split())
+    assert f.roots == [f"{root}/link", f"{root}/src"]
+
+
+def test_throttle(tmp_path: T.Any, monkeypatch: T.Any) -> None:
+    delays: T.List[float] = []
+    monkeypatch.setattr(time, "perf_counter", lambda: 100.0)
+    monkeypatch.setattr(time, "sleep", delays.append)
+    (tmp_path / "big").write_bytes(b"x" * 3000)
+    throttle = findx.Throttle(10, 1000)
+    throttle.pace(str(tmp_path / "missing"))
+    throttle.pace(str(tmp_path / "big"))
+    assert delays == [pytest.approx(0.1), pytest.approx(3.0)]
+
+
+def test_background(tmp_path: T.Any, monkeypatch: T.Any, capfd: T.Any) -> None:
+    (tmp_path / "a").write_text("a")
+    (tmp_path / "b").write_text("b")
+    calls: T.List[int] = []
+    monkeypatch.setattr(
+        findx, "set_background_priority", lambda: calls.append(1)
+    )
+    monkeypatch.setattr(time, "sleep", lambda delay: None)
+    f = findx.Findx()
+    f.parse_command_line(
+        ["-background", "--background-file-rate", "1000", str(tmp_path)]
+    )
+    assert f.relays_pipeline()
+    assert f.run() == 0
+    assert calls == [1]
+    assert f.throttle is not None and f.throttle.files == 3
+    assert len(capfd.readouterr().out.splitlines()) == 3
+
+
+def test_heatmap(tmp_path: T.Any, capfd: T.Any) -> None:
+    for rel_path in ["src/a.c", "deps/x/b.js", "deps/y/c.js", "doc/d.txt"]:
+        (tmp_path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel_path).write_text("")
+    root = str(tmp_path)
+    f = findx.Findx()
+    f.parse_command_line(["-heatmap", root, "-name", "*.c"])
+    assert f.run() == 0
+    out, err = capfd.readouterr()
+    assert out == f"{root}/src/a.c\n"
+    lines = err.splitlines()
+    assert lines[0] == (
+        "findx: heatmap: 2 costliest directories yielding no paths"
+    )
+    entries = {line.split()[-1]: line.split()[3] for line in lines[1:]}
+    assert entries == {f"{root}/deps": "4", f"{root}/doc": "1"}
+    f = findx.Findx()
+    f.parse_command_line(
+        ["-heatmap", "--heatmap-format", "config", "--heatmap-top", "1"]
+        + [f"{root}/deps", "-name", "*.c"]
+    )
+    assert f.run() == 0
+    assert capfd.readouterr().err in [
+        "stdxd = +x\n",
+        "stdxd = +y\n",
+    ]
+
+
+def test_estimate_probe(tmp_path: T.Any) -> None:
+    for d in ["a", "b", "c"]:
+        for name in ["x.c", "y.txt"]:
+            (tmp_path / d / "sub" / name).parent.mkdir(
+                parents=True, exist_ok=True
+            )
+            (tmp_path / d / "sub" / name).write_text("12345")
+    f = findx.Findx()
+    f.parse_command_line(["-estimate", str(tmp_path), "-name", "*.c"])
+    query = f.native_query()
+    scans: T.Dict[str, T.Any] = {}
+    unscanned: T.Set[str] = set()
+    # Every directory at each depth looks alike, so any probe is exact.
+    totals = f.estimate_probe(
+        str(tmp_path), query, random.Random(1), scans, unscanned
+    )
+    assert totals[:3] == [13, 3, 15]
+    assert len(scans) == 3 and len(unscanned) == 2
+
+
+def test_estimate(tmp_path: T.Any, capsys: T.Any) -> None:
+    (tmp_path / "d").mkdir()
+    (tmp_path / "d" / "a.c").write_text("123")
+    (tmp_path / "b.c").write_text("1")
+    (tmp_path / "c.h").write_text("12")
+    f = findx.Findx()
+    f.parse_command_line(["-estimate", str(tmp_path), "-name", "*.c"])
+    assert f.run() == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].endswith("95% confidence intervals:")
+    assert lines[1].split() == ["entries", "5", "(5", "to", "5)"]
+    assert lines[2].split() == ["paths", "2", "(2", "to", "2)"]
+    assert lines[3].split() == ["bytes", "4", "(4", "to", "4)"]
+
+
+def test_estimate_errors(tmp_path: T.Any, capfd: T.Any) -> None:
+    f = findx.Findx()
+    with pytest.raises(findx.ReportConflictError):
+        f.parse_command_line(["-estimate", str(tmp_path), ":", "grep", "x"])
+    (tmp_path / "d").mkdir()
+    (tmp_path / "d" / "loop").symlink_to("..")
+    f = findx.Findx()
+    f.parse_command_line(["-estimate", "-L", str(tmp_path)])
+    assert f.run() == 1
+    assert "File system loop detected" in capfd.readouterr().err
+
+
+def test_file_digest(tmp_path: T.Any) -> None:
+    chunk = findx.DUPES_CHUNK_BYTES
+    data = bytes(range(256)) * (3 * chunk // 256)
+    path = tmp_path / "f"
+    path.write_bytes(data)
+    full = hashlib.blake2b(data, digest_size=32).hexdigest()
+    assert findx.file_digest(str(path), len(data), False) == full
+    partial = hashlib.blake2b(
+        data[:chunk] + data[-chunk:], digest_size=32
+    ).hexdigest()
+    assert findx.file_digest(str(path), len(data), True) == partial
+
+
+def test_dupes(tmp_path: T.Any, capsys: T.Any) -> None:
+    chunk = findx.DUPES_CHUNK_BYTES
+    big = b"x" * (3 * chunk)
+    # Same size, head, and tail as big, but different in the middle.
+    near = big[:chunk] + b"y" + big[chunk + 1 :]
+    files = {
+        "a/big": big,
+        "b/big": big,
+        "b/near": near,
+        "a/small": b"hi",
+        "b/small": b"hi",
+        "c/small.txt": b"hi",
+        "b/other": b"ho",
+        "d/linked": b"hard",
+        "e1": b"",
+        "e2": b"",
+    }
+    for rel_path, data in files.items():
+        (tmp_path / rel_path).parent.mkdir(exist_ok=True)
+        (tmp_path / rel_path).write_bytes(data)
+    os.link(tmp_path / "a" / "small", tmp_path / "a" / "small2")
+    os.link(tmp_path / "d" / "linked", tmp_path / "d" / "linked2")
+    root = str(tmp_path)
+    f = findx.Findx()
+    f.parse_command_line(["-dupes", root, "-x", "-name", "c"])
+    assert f.run() == 0
+    records = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+    assert records == [
+        {
+            "size": 3 * chunk,
+            "hash": hashlib.blake2b(big, digest_size=32).hexdigest(),
+            "paths": [f"{root}/a/big", f"{root}/b/big"],
+        },
+        {
+            "size": 2,
+            "hash": hashlib.blake2b(b"hi", digest_size=32).hexdigest(),
+            "paths": [f"{root}/a/small", f"{root}/b/small"],
+        },
+    ]
+    f = findx.Findx()
+    with pytest.raises(findx.ReportConflictError):
+        f.parse_command_line(["-dupes", root, ":", "echo"])
+
+
+@pytest.mark.parametrize("native", [False, True])
+def test_top(tmp_path: T.Any, capsys: T.Any, native: bool) -> None:
+    for i, size in enumerate([5, 50, 0, 20]):
+        path = tmp_path / f"f{i}"
+        path.write_bytes(b"x" * size)
+        os.utime(path, (1000 + i, 1000 + size))
+    root = str(tmp_path)
+    args = ["-bfs"] if native else []
+    f = findx.Findx()
+    f.parse_command_line(args + ["-top", "2", "size", root, "-type", "f"])
+    assert f.run() == 0
+    assert capsys.readouterr().out == f"50 {root}/f1\n20 {root}/f3\n"
+    f = findx.Findx()
+    f.parse_command_line(args + ["-top", "1", "mtime", root, "-type", "f"])
+    assert f.run() == 0
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(1050))
+    assert capsys.readouterr().out == f"{stamp} {root}/f1\n"
+
+
+def test_top_errors() -> None:
+    with pytest.raises(findx.InvalidOptionError):
+        findx.Findx().parse_command_line("-top 0 size".split())
+    with pytest.raises(findx.InvalidOptionError):
+        findx.Findx().parse_command_line("-top 3 ctime".split())
+    with pytest.raises(findx.ReportConflictError):
+        findx.Findx().parse_command_line("-top 3 size -print".split())
+    for option in ["-limit 5", "-first", "-stats"]:
+        with pytest.raises(findx.ReportConflictError):
+            findx.Findx().parse_command_line(f"-top 3 size {option} .".split())
+
+
+@pytest.mark.parametrize("native", [False, True])
+def test_du(tmp_path: T.Any, capsys: T.Any, native: bool) -> None:
+    for rel_path, size in [("a/x/f", 100), ("a/g", 10), ("b/h", 1)]:
+        (tmp_path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel_path).write_bytes(b"x" * size)
+    os.link(tmp_path / "a" / "g", tmp_path / "b" / "g2")
+    root = str(tmp_path)
+    args = ["-bfs"] if native else []
+    f = findx.Findx()
+    f.parse_command_line(args + ["-du", root, "-type", "f"])
+    assert f.run() == 0
+    rows = [line.split() for line in capsys.readouterr().out.splitlines()]
+    assert rows == sorted(rows, key=lambda row: -int(row[0]))
+    sizes = {path: size for _, size, path in rows}
+    # The hard link counts toward whichever directory is walked first.
+    assert sizes in [
+        {root: "111", f"{root}/a": "110", f"{root}/b": "1"},
+        {root: "111", f"{root}/a": "100", f"{root}/b": "11"},
+    ]
+    f = findx.Findx()
+    f.parse_command_line(args + ["-du", "0", root, "-name", "f"])
+    assert f.run() == 0
+    assert capsys.readouterr().out.split()[1:] == ["100", root]
+
+
+def test_du_errors() -> None:
+    with pytest.raises(findx.ReportConflictError):
+        findx.Findx().parse_command_line("-du -exec ls ;".split())
+    with pytest.raises(findx.ReportConflictError):
+        findx.Findx().parse_command_line("-du :: ls".split())
+    for args in ["-top 2 size -du .", "-du -top 2 size ."]:
+        with pytest.raises(findx.ReportConflictError):
+            findx.Findx().parse_command_line(args.split())
+    f = findx.Findx()
+    f.parse_command_line("-du 3 src".split())
+    assert f.du == 3 and f.roots == ["src"]